@@ -1,5 +1,4 @@
 #!/usr/bin/env python3
-import math
 import numpy as np
 from collections import deque
 from typing import Any
@@ -20,9 +19,6 @@ from opendbc.sunnypilot.car.hyundai.values import HyundaiFlagsSP
 # Default lead acceleration decay set to 50% at 1s
 _LEAD_ACCEL_TAU = 1.5
 
-# radar tracks
-SPEED, ACCEL = 0, 1     # Kalman filter states enum
-
 # stationary qualification parameters
 V_EGO_STATIONARY = 4.   # no stationary object flag below this speed
 
@@ -52,92 +48,115 @@ class KalmanParams:
     self.K = [[np.interp(dt, dts, K0)], [np.interp(dt, dts, K1)]]
 
 
-class Track:
-  def __init__(self, identifier: int, v_lead: float, kalman_params: KalmanParams):
-    self.identifier = identifier
-    self.cnt = 0
-    self.aLeadTau = FirstOrderFilter(_LEAD_ACCEL_TAU, 0.45, DT_MDL)
-    self.K_A = kalman_params.A
-    self.K_C = kalman_params.C
-    self.K_K = kalman_params.K
-    self.kf = KF1D([[v_lead], [0.0]], self.K_A, self.K_C, self.K_K)
-
-  def update(self, d_rel: float, y_rel: float, v_rel: float, v_lead: float, measured: float):
-    # relative values, copy
-    self.dRel = d_rel   # LONG_DIST
-    self.yRel = y_rel   # -LAT_DIST
-    self.vRel = v_rel   # REL_SPEED
-    self.vLead = v_lead
-    self.measured = measured   # measured or estimate
-
-    # computed velocity and accelerations
-    if self.cnt > 0:
-      self.kf.update(self.vLead)
-
-    self.vLeadK = float(self.kf.x[SPEED][0])
-    self.aLeadK = float(self.kf.x[ACCEL][0])
+def sorted_contains(haystack: np.ndarray, needles: np.ndarray) -> np.ndarray:
+  # np.isin, without its overhead on the few dozen ids of a radar frame
+  if len(haystack) == 0:
+    return np.zeros(len(needles), dtype=bool)
+  haystack = np.sort(haystack)
+  return haystack[np.minimum(np.searchsorted(haystack, needles), len(haystack) - 1)] == needles
+
+
+class Tracks:
+  """
+  Radar tracks as parallel arrays, ordered by when each track first appeared. Each track runs the same
+  constant-gain KF1D, so predict/update for all tracks is done at once on the state arrays.
+  """
+  def __init__(self, kalman_params: KalmanParams):
+    kf = KF1D([[0.0], [0.0]], kalman_params.A, kalman_params.C, kalman_params.K)
+    self.A_K = (kf.A_K_0, kf.A_K_1, kf.A_K_2, kf.A_K_3)
+    self.K = (kf.K0_0, kf.K1_0)
+    self.aLeadTau_alpha = FirstOrderFilter(_LEAD_ACCEL_TAU, 0.45, DT_MDL).alpha
+
+    self.identifier = np.zeros(0, dtype=np.int64)
+    self.cnt = np.zeros(0, dtype=np.int64)
+    self.dRel = self.yRel = self.vRel = self.vLead = self.measured = np.zeros(0)
+    self.vLeadK = self.aLeadK = self.aLeadTau = np.zeros(0)
+
+  def __len__(self) -> int:
+    return len(self.identifier)
+
+  def match_identifiers(self, identifier: np.ndarray):
+    # drop tracks that disappeared, append new ones after the rest
+    keep = sorted_contains(identifier, self.identifier)
+    added = ~sorted_contains(self.identifier, identifier)
+    num_added = np.count_nonzero(added)
+    self.identifier = np.concatenate((self.identifier[keep], identifier[added]))
+    self.cnt = np.concatenate((self.cnt[keep], np.zeros(num_added, dtype=np.int64)))
+    self.vLeadK = np.concatenate((self.vLeadK[keep], np.zeros(num_added)))
+    self.aLeadK = np.concatenate((self.aLeadK[keep], np.zeros(num_added)))
+    self.aLeadTau = np.concatenate((self.aLeadTau[keep], np.full(num_added, _LEAD_ACCEL_TAU)))
+
+  def update(self, identifier: np.ndarray, pts: np.ndarray, v_ego: float):
+    """ identifier: unique track ids of this radar frame, pts: their [dRel, yRel, vRel, measured] rows """
+    if not np.array_equal(identifier, self.identifier):
+      self.match_identifiers(identifier)
+      order = np.argsort(identifier)
+      pts = pts[order[np.searchsorted(identifier[order], self.identifier)]]
+
+    # relative values
+    self.dRel, self.yRel, self.vRel, self.measured = pts.T  # LONG_DIST, -LAT_DIST, REL_SPEED, measured or estimate
+    # align v_ego by a fixed time to align it with the radar measurement
+    self.vLead = self.vRel + v_ego
+
+    # computed velocity and accelerations, new tracks start at the measured speed and are filtered from their second frame
+    filtered = self.cnt > 0
+    x0, x1 = np.where(filtered, self.vLeadK, self.vLead), self.aLeadK
+    self.vLeadK = np.where(filtered, self.A_K[0] * x0 + self.A_K[1] * x1 + self.K[0] * self.vLead, x0)
+    self.aLeadK = np.where(filtered, self.A_K[2] * x0 + self.A_K[3] * x1 + self.K[1] * self.vLead, x1)
 
     # Learn if constant acceleration
-    if abs(self.aLeadK) < 0.5:
-      self.aLeadTau.x = _LEAD_ACCEL_TAU
-    else:
-      self.aLeadTau.update(0.0)
+    alpha = self.aLeadTau_alpha
+    self.aLeadTau = np.where(np.abs(self.aLeadK) < 0.5, _LEAD_ACCEL_TAU, (1. - alpha) * self.aLeadTau + alpha * 0.0)
 
     self.cnt += 1
 
-  def get_RadarState(self, model_prob: float = 0.0):
+  def get_RadarState(self, idx: int, model_prob: float = 0.0):
     return {
-      "dRel": float(self.dRel),
-      "yRel": float(self.yRel),
-      "vRel": float(self.vRel),
-      "vLead": float(self.vLead),
-      "vLeadK": float(self.vLeadK),
-      "aLeadK": float(self.aLeadK),
-      "aLeadTau": float(self.aLeadTau.x),
+      "dRel": float(self.dRel[idx]),
+      "yRel": float(self.yRel[idx]),
+      "vRel": float(self.vRel[idx]),
+      "vLead": float(self.vLead[idx]),
+      "vLeadK": float(self.vLeadK[idx]),
+      "aLeadK": float(self.aLeadK[idx]),
+      "aLeadTau": float(self.aLeadTau[idx]),
       "status": True,
       "fcw": self.is_potential_fcw(model_prob),
       "modelProb": model_prob,
       "radar": True,
-      "radarTrackId": self.identifier,
+      "radarTrackId": int(self.identifier[idx]),
     }
 
-  def potential_low_speed_lead(self, v_ego: float):
+  def potential_low_speed_lead(self, v_ego: float) -> np.ndarray:
     # stop for stuff in front of you and low speed, even without model confirmation
     # Radar points closer than 0.75, are almost always glitches on toyota radars
-    return abs(self.yRel) < 1.0 and (v_ego < V_EGO_STATIONARY) and (0.75 < self.dRel < 25)
+    return (np.abs(self.yRel) < 1.0) & (v_ego < V_EGO_STATIONARY) & (0.75 < self.dRel) & (self.dRel < 25)
 
   def is_potential_fcw(self, model_prob: float):
     return model_prob > .9
 
-  def __str__(self):
-    ret = f"x: {self.dRel:4.1f}  y: {self.yRel:4.1f}  v: {self.vRel:4.1f}  a: {self.aLeadK:4.1f}"
-    return ret
 
-
-def laplacian_pdf(x: float, mu: float, b: float):
+def laplacian_pdf(x: np.ndarray, mu: float, b: float):
   b = max(b, 1e-4)
-  return math.exp(-abs(x-mu)/b)
+  return np.exp(-np.abs(x-mu)/b)
 
 
-def match_vision_to_track(v_ego: float, lead: capnp._DynamicStructReader, tracks: dict[int, Track]):
+def match_vision_to_track(v_ego: float, lead: capnp._DynamicStructReader, tracks: Tracks):
   offset_vision_dist = lead.x[0] - RADAR_TO_CAMERA
 
-  def prob(c):
-    prob_d = laplacian_pdf(c.dRel, offset_vision_dist, lead.xStd[0])
-    prob_y = laplacian_pdf(c.yRel, -lead.y[0], lead.yStd[0])
-    prob_v = laplacian_pdf(c.vRel + v_ego, lead.v[0], lead.vStd[0])
-
-    # This isn't exactly right, but it's a good heuristic
-    return prob_d * prob_y * prob_v
+  prob_d = laplacian_pdf(tracks.dRel, offset_vision_dist, lead.xStd[0])
+  prob_y = laplacian_pdf(tracks.yRel, -lead.y[0], lead.yStd[0])
+  prob_v = laplacian_pdf(tracks.vRel + v_ego, lead.v[0], lead.vStd[0])
 
-  track = max(tracks.values(), key=prob)
+  # This isn't exactly right, but it's a good heuristic
+  idx = int(np.argmax(prob_d * prob_y * prob_v))
+  d_rel, v_rel = tracks.dRel[idx], tracks.vRel[idx]
 
   # if no 'sane' match is found return -1
   # stationary radar points can be false positives
-  dist_sane = abs(track.dRel - offset_vision_dist) < max([(offset_vision_dist)*.25, 5.0])
-  vel_sane = (abs(track.vRel + v_ego - lead.v[0]) < 10) or (v_ego + track.vRel > 3)
+  dist_sane = abs(d_rel - offset_vision_dist) < max([(offset_vision_dist)*.25, 5.0])
+  vel_sane = (abs(v_rel + v_ego - lead.v[0]) < 10) or (v_ego + v_rel > 3)
   if dist_sane and vel_sane:
-    return track
+    return idx
   else:
     return None
 
@@ -160,7 +179,7 @@ def get_RadarState_from_vision(lead_msg: capnp._DynamicStructReader, v_ego: floa
   }
 
 
-def get_lead(v_ego: float, ready: bool, tracks: dict[int, Track], lead_msg: capnp._DynamicStructReader,
+def get_lead(v_ego: float, ready: bool, tracks: Tracks, lead_msg: capnp._DynamicStructReader,
              model_v_ego: float, CP: structs.CarParams, CP_SP: structs.CarParamsSP, low_speed_override: bool = True) -> dict[str, Any]:
   # Determine leads, this is where the essential logic happens
   if len(tracks) > 0 and ready and lead_msg.prob > .5:
@@ -170,19 +189,19 @@ def get_lead(v_ego: float, ready: bool, tracks: dict[int, Track], lead_msg: capn
 
   lead_dict = {'status': False}
   if track is not None:
-    lead_dict = track.get_RadarState(lead_msg.prob)
+    lead_dict = tracks.get_RadarState(track, lead_msg.prob)
     lead_dict = get_custom_yrel(CP, CP_SP, lead_dict, lead_msg)
   elif (track is None) and ready and (lead_msg.prob > .5):
     lead_dict = get_RadarState_from_vision(lead_msg, v_ego, model_v_ego)
 
   if low_speed_override:
-    low_speed_tracks = [c for c in tracks.values() if c.potential_low_speed_lead(v_ego)]
+    low_speed_tracks = np.flatnonzero(tracks.potential_low_speed_lead(v_ego))
     if len(low_speed_tracks) > 0:
-      closest_track = min(low_speed_tracks, key=lambda c: c.dRel)
+      closest_track = low_speed_tracks[np.argmin(tracks.dRel[low_speed_tracks])]
 
       # Only choose new track if it is actually closer than the previous one
-      if (not lead_dict['status']) or (closest_track.dRel < lead_dict['dRel']):
-        lead_dict = closest_track.get_RadarState()
+      if (not lead_dict['status']) or (tracks.dRel[closest_track] < lead_dict['dRel']):
+        lead_dict = tracks.get_RadarState(closest_track)
 
   return lead_dict
 
@@ -203,8 +222,8 @@ class RadarD:
 
     self.current_time = 0.0
 
-    self.tracks: dict[int, Track] = {}
     self.kalman_params = KalmanParams(DT_MDL)
+    self.tracks = Tracks(self.kalman_params)
 
     self.v_ego = 0.0
     self.v_ego_hist = deque([0.0], maxlen=int(round(delay / DT_MDL))+1)
@@ -226,22 +245,9 @@ class RadarD:
 
     ar_pts = {pt.trackId: [pt.dRel, pt.yRel, pt.vRel, pt.measured] for pt in rr.points}
 
-    # *** remove missing points from meta data ***
-    for ids in list(self.tracks.keys()):
-      if ids not in ar_pts:
-        self.tracks.pop(ids, None)
-
     # *** compute the tracks ***
-    for ids in ar_pts:
-      rpt = ar_pts[ids]
-
-      # align v_ego by a fixed time to align it with the radar measurement
-      v_lead = rpt[2] + self.v_ego_hist[0]
-
-      # create the track if it doesn't exist or it's a new track
-      if ids not in self.tracks:
-        self.tracks[ids] = Track(ids, v_lead, self.kalman_params)
-      self.tracks[ids].update(rpt[0], rpt[1], rpt[2], v_lead, rpt[3])
+    self.tracks.update(np.fromiter(ar_pts.keys(), dtype=np.int64, count=len(ar_pts)),
+                       np.array(list(ar_pts.values()), dtype=np.float64).reshape(-1, 4), self.v_ego_hist[0])
 
     # *** publish radarState ***
     self.radar_state_valid = sm.all_checks()
@@ -0,0 +1,39 @@
+import numpy as np
+
+from openpilot.common.filter_simple import FirstOrderFilter
+from openpilot.common.realtime import DT_MDL
+from openpilot.common.simple_kalman import KF1D
+from openpilot.selfdrive.controls.radard import KalmanParams, Tracks, _LEAD_ACCEL_TAU
+
+
+class TestTracks:
+  def test_matches_scalar_filters(self):
+    # every track matches its own KF1D and aLeadTau filter, and tracks are kept in order of appearance
+    rng = np.random.default_rng(0)
+    kalman_params = KalmanParams(DT_MDL)
+    tracks = Tracks(kalman_params)
+    reference = {}
+    for _ in range(200):
+      identifier = rng.permutation(12)[:rng.integers(0, 12)]
+      pts = np.column_stack((rng.uniform(0, 100, len(identifier)), rng.uniform(-3, 3, len(identifier)),
+                             rng.uniform(-10, 10, len(identifier)), np.ones(len(identifier))))
+      v_ego = rng.uniform(0, 30)
+      tracks.update(identifier, pts, v_ego)
+
+      reference = {i: reference[i] for i in reference if i in identifier}
+      for i, (_, _, v_rel, _) in zip(identifier.tolist(), pts, strict=True):
+        v_lead = v_rel + v_ego
+        if i not in reference:
+          reference[i] = (KF1D([[v_lead], [0.0]], kalman_params.A, kalman_params.C, kalman_params.K), FirstOrderFilter(_LEAD_ACCEL_TAU, 0.45, DT_MDL))
+        else:
+          reference[i][0].update(v_lead)
+        kf, a_lead_tau = reference[i]
+        if abs(kf.x[1][0]) < 0.5:
+          a_lead_tau.x = _LEAD_ACCEL_TAU
+        else:
+          a_lead_tau.update(0.0)
+
+      assert tracks.identifier.tolist() == list(reference)
+      assert tracks.vLeadK.tolist() == [kf.x[0][0] for kf, _ in reference.values()]
+      assert tracks.aLeadK.tolist() == [kf.x[1][0] for kf, _ in reference.values()]
+      assert tracks.aLeadTau.tolist() == [f.x for _, f in reference.values()]
@@ -52,27 +52,85 @@ def rotate_std(rot_matrix, std_in):
 
 
 class NPQueue:
-  def __init__(self, maxlen: int, rowsize: int) -> None:
+  """ Queue of up to maxlen rows, dropping the oldest once full. Stored in a preallocated (or given) circular buffer """
+  def __init__(self, maxlen: int, rowsize: int, buf: np.ndarray | None = None) -> None:
     self.maxlen = maxlen
-    self.arr = np.empty((0, rowsize))
+    self.buf = np.empty((maxlen, rowsize)) if buf is None else buf
+    self.start = 0
+    self.size = 0
 
   def __len__(self) -> int:
-    return len(self.arr)
+    return self.size
 
   def append(self, pt: list[float]) -> None:
-    if len(self.arr) < self.maxlen:
-      self.arr = np.append(self.arr, [pt], axis=0)
+    if self.size < self.maxlen:
+      self.buf[(self.start + self.size) % self.maxlen] = pt
+      self.size += 1
     else:
-      self.arr[:-1] = self.arr[1:]
-      self.arr[-1] = pt
+      self.buf[self.start] = pt
+      self.start = (self.start + 1) % self.maxlen
+
+  @property
+  def arr(self) -> np.ndarray:
+    # rows oldest first, a view unless the rows wrap around the end of the buffer
+    end = self.start + self.size
+    if end <= self.maxlen:
+      return self.buf[self.start:end]
+    return np.concatenate((self.buf[self.start:], self.buf[:end - self.maxlen]))
+
+
+class SignalBuffer:
+  """
+    Last maxlen samples of ncols signals sharing increasing timestamps. Samples are written twice into buffers of 2 * maxlen,
+    so the timestamps and each signal are always contiguous, ordered views that np.interp takes without a copy.
+  """
+  def __init__(self, maxlen: int, ncols: int = 1) -> None:
+    self.maxlen = maxlen
+    self.t_buf = np.empty(2 * maxlen)
+    self.x_buf = np.empty((ncols, 2 * maxlen))
+    self.start = 0
+    self.size = 0
+
+  def __len__(self) -> int:
+    return self.size
+
+  def append(self, t: float, *x: float) -> None:
+    if self.size < self.maxlen:
+      idx = self.start + self.size
+      self.size += 1
+    else:
+      idx = self.start
+      self.start = (self.start + 1) % self.maxlen
+    self.t_buf[idx] = self.t_buf[idx + self.maxlen] = t
+    for col, val in enumerate(x):
+      self.x_buf[col, idx] = self.x_buf[col, idx + self.maxlen] = val
+
+  @property
+  def t(self) -> np.ndarray:
+    return self.t_buf[self.start:self.start + self.size]
+
+  def x(self, col: int = 0) -> np.ndarray:
+    return self.x_buf[col, self.start:self.start + self.size]
+
+  def interp(self, t: float | np.ndarray, col: int = 0) -> Any:
+    return np.interp(t, self.t, self.x(col))
 
 
 class PointBuckets:
+  """
+    Buckets share one preallocated points array, bucket i owning rows [i * points_per_bucket, (i + 1) * points_per_bucket).
+    A bucket only starts overwriting its oldest rows once full, so its points are always the first len(bucket) rows of its range.
+  """
   def __init__(self, x_bounds: list[tuple[float, float]], min_points: list[float], min_points_total: int, points_per_bucket: int, rowsize: int) -> None:
     self.x_bounds = x_bounds
-    self.buckets = {bounds: NPQueue(maxlen=points_per_bucket, rowsize=rowsize) for bounds in x_bounds}
+    self.points_per_bucket = points_per_bucket
+    self.points = np.empty((len(x_bounds) * points_per_bucket, rowsize))
+    self.buckets = {bounds: NPQueue(maxlen=points_per_bucket, rowsize=rowsize, buf=self.points[i * points_per_bucket:(i + 1) * points_per_bucket])
+                    for i, bounds in enumerate(x_bounds)}
     self.buckets_min_points = dict(zip(x_bounds, min_points, strict=True))
     self.min_points_total = min_points_total
+    # seeded from the global state, so np.random.seed still makes sampling reproducible
+    self.rng = np.random.default_rng(np.random.randint(2**32, dtype=np.uint64))
 
   def __len__(self) -> int:
     return sum([len(v) for v in self.buckets.values()])
@@ -95,10 +153,19 @@ class PointBuckets:
     raise NotImplementedError
 
   def get_points(self, num_points: int = None) -> Any:
-    points = np.vstack([x.arr for x in self.buckets.values()])
     if num_points is None:
-      return points
-    return points[np.random.choice(np.arange(len(points)), min(len(points), num_points), replace=False)]
+      # oldest first within each bucket, so restoring these points keeps the order they're dropped in
+      return np.vstack([x.arr for x in self.buckets.values()])
+
+    counts = np.array([len(v) for v in self.buckets.values()])
+    total = counts.sum()
+    # uniform draw without replacement over the valid rows, mapped from [0, total) onto each bucket's filled prefix
+    idxs = self.rng.choice(total, min(total, num_points), replace=False)
+    if total < len(self.points):
+      ends = np.cumsum(counts)
+      bucket_idxs = np.searchsorted(ends, idxs, side='right')
+      idxs += bucket_idxs * self.points_per_bucket - (ends - counts)[bucket_idxs]
+    return self.points.take(idxs, axis=0)
 
   def load_points(self, points: list[list[float]]) -> None:
     for point in points:
@@ -2,8 +2,6 @@
 import os
 import numpy as np
 import capnp
-from collections import deque
-from functools import partial
 
 import cereal.messaging as messaging
 from cereal import car, log
@@ -33,86 +31,123 @@ CORR_BORDER_OFFSET = 5
 LAG_CANDIDATE_CORR_THRESHOLD = 0.9
 
 
-def masked_normalized_cross_correlation(expected_sig: np.ndarray, actual_sig: np.ndarray, mask: np.ndarray, n: int):
+class MaskedNCC:
   """
+  Masked normalized cross-correlation of real signals, keeping the rfft scratch buffers for the last window geometry
+  and the mask spectra for the last mask, which rarely changes between consecutive estimates.
+
   References:
     D. Padfield. "Masked FFT registration". In Proc. Computer Vision and
     Pattern Recognition, pp. 2918-2925 (2010).
     :DOI:`10.1109/CVPR.2010.5540032`
   """
+  def __init__(self):
+    self.sig_len = -1
+    self.n = -1
+    self.mask = np.zeros(0, dtype=bool)
+
+  def _setup(self, sig_len: int, n: int):
+    self.sig_len, self.n = sig_len, n
+    # actual, rotated expected, and their squares
+    self.sigs = np.empty((4, sig_len))
+    self.sigs_fft = np.empty((4, n // 2 + 1), dtype=np.complex128)
+    # masked actual, masked expected, numerator, actual denominator, expected denominator
+    self.products = np.empty((5, n // 2 + 1), dtype=np.complex128)
+    self.correlations = np.empty((5, n))
+    self.mask = np.zeros(0, dtype=bool)
+
+  def _update_mask(self, mask: np.ndarray):
+    self.mask = mask.copy()
+    actual_mask_fft, rotated_mask_fft = np.fft.rfft(np.stack((mask, mask[::-1])).astype(np.float64), n=self.n)
+    self.actual_mask_fft, self.rotated_mask_fft = actual_mask_fft, rotated_mask_fft
+
+    number_overlap_masked_samples = np.fft.irfft(rotated_mask_fft * actual_mask_fft, n=self.n)
+    number_overlap_masked_samples[:] = np.round(number_overlap_masked_samples)
+    number_overlap_masked_samples[:] = np.fmax(number_overlap_masked_samples, np.finfo(np.float64).eps)
+    self.number_overlap_masked_samples = number_overlap_masked_samples
+
+  def __call__(self, expected_sig: np.ndarray, actual_sig: np.ndarray, mask: np.ndarray, n: int) -> np.ndarray:
+    eps = np.finfo(np.float64).eps
+    mask = np.asarray(mask, dtype=bool)
+    if len(mask) != self.sig_len or n != self.n:
+      self._setup(len(mask), n)
+    if not np.array_equal(mask, self.mask):
+      self._update_mask(mask)
+
+    actual, rotated_expected, actual_squared, rotated_expected_squared = self.sigs
+    self.sigs[:2] = 0.0
+    np.copyto(actual, actual_sig, where=mask)
+    np.copyto(rotated_expected, np.asarray(expected_sig)[::-1], where=mask[::-1])
+    np.square(actual, out=actual_squared)
+    np.square(rotated_expected, out=rotated_expected_squared)
+    actual_sig_fft, rotated_expected_sig_fft, actual_squared_fft, rotated_expected_squared_fft = np.fft.rfft(self.sigs, n=n, out=self.sigs_fft)
+
+    np.multiply(self.rotated_mask_fft, actual_sig_fft, out=self.products[0])
+    np.multiply(self.actual_mask_fft, rotated_expected_sig_fft, out=self.products[1])
+    np.multiply(rotated_expected_sig_fft, actual_sig_fft, out=self.products[2])
+    np.multiply(self.rotated_mask_fft, actual_squared_fft, out=self.products[3])
+    np.multiply(self.actual_mask_fft, rotated_expected_squared_fft, out=self.products[4])
+    masked_correlated_actual, masked_correlated_expected, numerator, actual_sig_denom, expected_sig_denom = \
+      np.fft.irfft(self.products, n=n, out=self.correlations)
+
+    number_overlap_masked_samples = self.number_overlap_masked_samples
+    numerator -= masked_correlated_actual * masked_correlated_expected / number_overlap_masked_samples
+
+    actual_sig_denom -= masked_correlated_actual ** 2 / number_overlap_masked_samples
+    actual_sig_denom[:] = np.fmax(actual_sig_denom, 0.0)
+
+    expected_sig_denom -= masked_correlated_expected ** 2 / number_overlap_masked_samples
+    expected_sig_denom[:] = np.fmax(expected_sig_denom, 0.0)
+
+    denom = np.sqrt(actual_sig_denom * expected_sig_denom)
+
+    # zero-out samples with very small denominators
+    tol = 1e3 * eps * np.max(np.abs(denom), keepdims=True)
+    nonzero_indices = denom > tol
+
+    ncc = np.zeros_like(denom, dtype=np.float64)
+    ncc[nonzero_indices] = numerator[nonzero_indices] / denom[nonzero_indices]
+    np.clip(ncc, -1, 1, out=ncc)
+
+    return ncc
 
-  eps = np.finfo(np.float64).eps
-  expected_sig = np.asarray(expected_sig, dtype=np.float64)
-  actual_sig = np.asarray(actual_sig, dtype=np.float64)
-
-  expected_sig[~mask] = 0.0
-  actual_sig[~mask] = 0.0
-
-  rotated_expected_sig = expected_sig[::-1]
-  rotated_mask = mask[::-1]
-
-  fft = partial(np.fft.fft, n=n)
-
-  actual_sig_fft = fft(actual_sig)
-  rotated_expected_sig_fft = fft(rotated_expected_sig)
-  actual_mask_fft = fft(mask.astype(np.float64))
-  rotated_mask_fft = fft(rotated_mask.astype(np.float64))
-
-  number_overlap_masked_samples = np.fft.ifft(rotated_mask_fft * actual_mask_fft).real
-  number_overlap_masked_samples[:] = np.round(number_overlap_masked_samples)
-  number_overlap_masked_samples[:] = np.fmax(number_overlap_masked_samples, eps)
-  masked_correlated_actual_fft = np.fft.ifft(rotated_mask_fft * actual_sig_fft).real
-  masked_correlated_expected_fft = np.fft.ifft(actual_mask_fft * rotated_expected_sig_fft).real
-
-  numerator = np.fft.ifft(rotated_expected_sig_fft * actual_sig_fft).real
-  numerator -= masked_correlated_actual_fft * masked_correlated_expected_fft / number_overlap_masked_samples
 
-  actual_squared_fft = fft(actual_sig ** 2)
-  actual_sig_denom = np.fft.ifft(rotated_mask_fft * actual_squared_fft).real
-  actual_sig_denom -= masked_correlated_actual_fft ** 2 / number_overlap_masked_samples
-  actual_sig_denom[:] = np.fmax(actual_sig_denom, 0.0)
-
-  rotated_expected_squared_fft = fft(rotated_expected_sig ** 2)
-  expected_sig_denom = np.fft.ifft(actual_mask_fft * rotated_expected_squared_fft).real
-  expected_sig_denom -= masked_correlated_expected_fft ** 2 / number_overlap_masked_samples
-  expected_sig_denom[:] = np.fmax(expected_sig_denom, 0.0)
-
-  denom = np.sqrt(actual_sig_denom * expected_sig_denom)
-
-  # zero-out samples with very small denominators
-  tol = 1e3 * eps * np.max(np.abs(denom), keepdims=True)
-  nonzero_indices = denom > tol
-
-  ncc = np.zeros_like(denom, dtype=np.float64)
-  ncc[nonzero_indices] = numerator[nonzero_indices] / denom[nonzero_indices]
-  np.clip(ncc, -1, 1, out=ncc)
-
-  return ncc
+def masked_normalized_cross_correlation(expected_sig: np.ndarray, actual_sig: np.ndarray, mask: np.ndarray, n: int):
+  return MaskedNCC()(expected_sig, actual_sig, mask, n)
 
 
 class Points:
+  """
+  Last num_points samples, starting out as zeros. Every sample is written twice into arrays of 2 * num_points,
+  so the window is always available as contiguous, ordered views.
+  """
   def __init__(self, num_points: int):
-    self.times = deque[float]([0.0] * num_points, maxlen=num_points)
-    self.okay = deque[bool]([False] * num_points, maxlen=num_points)
-    self.desired = deque[float]([0.0] * num_points, maxlen=num_points)
-    self.actual = deque[float]([0.0] * num_points, maxlen=num_points)
+    self.maxlen = num_points
+    self.start = 0
+    self.times = np.zeros(2 * num_points)
+    self.okay = np.zeros(2 * num_points, dtype=bool)
+    self.desired = np.zeros(2 * num_points)
+    self.actual = np.zeros(2 * num_points)
 
   @property
   def num_points(self):
-    return len(self.desired)
+    return self.maxlen
 
   @property
   def num_okay(self):
-    return np.count_nonzero(self.okay)
+    return np.count_nonzero(self.okay[self.start:self.start + self.maxlen])
 
   def update(self, t: float, desired: float, actual: float, okay: bool):
-    self.times.append(t)
-    self.okay.append(okay)
-    self.desired.append(desired)
-    self.actual.append(actual)
+    idx, mirror_idx = self.start, self.start + self.maxlen
+    self.times[idx] = self.times[mirror_idx] = t
+    self.okay[idx] = self.okay[mirror_idx] = okay
+    self.desired[idx] = self.desired[mirror_idx] = desired
+    self.actual[idx] = self.actual[mirror_idx] = actual
+    self.start = (self.start + 1) % self.maxlen
 
   def get(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
-    return np.array(self.times), np.array(self.desired), np.array(self.actual), np.array(self.okay)
+    window = np.s_[self.start:self.start + self.maxlen]
+    return self.times[window], self.desired[window], self.actual[window], self.okay[window]
 
 
 class BlockAverage:
@@ -122,8 +157,9 @@ class BlockAverage:
     self.block_idx = valid_blocks % num_blocks
     self.idx = 0
 
-    self.values = np.tile(initial_value, (num_blocks, 1))
+    self.values = np.full(num_blocks, initial_value, dtype=np.float64)
     self.valid_blocks = valid_blocks
+    self.block_ids = np.arange(num_blocks)
 
   def update(self, value: float):
     self.values[self.block_idx] = (self.idx * self.values[self.block_idx] + value) / (self.idx + 1)
@@ -133,18 +169,18 @@ class BlockAverage:
       self.valid_blocks = min(self.valid_blocks + 1, self.num_blocks)
 
   def get(self) -> tuple[float, float, float, float]:
-    valid_block_idx = [i for i in range(self.valid_blocks) if i != self.block_idx]
-    valid_and_current_idx = valid_block_idx + ([self.block_idx] if self.idx > 0 else [])
+    valid_block_mask = (self.block_ids < self.valid_blocks) & (self.block_ids != self.block_idx)
+    valid_and_current_mask = valid_block_mask | ((self.block_ids == self.block_idx) & (self.idx > 0))
 
-    if len(valid_block_idx) > 0:
-      valid_mean = float(np.mean(self.values[valid_block_idx], axis=0).item())
-      valid_std = float(np.std(self.values[valid_block_idx], axis=0).item())
+    if valid_block_mask.any():
+      valid_values = self.values[valid_block_mask]
+      valid_mean, valid_std = float(np.mean(valid_values)), float(np.std(valid_values))
     else:
       valid_mean, valid_std = float('nan'), float('nan')
 
-    if len(valid_and_current_idx) > 0:
-      current_mean = float(np.mean(self.values[valid_and_current_idx], axis=0).item())
-      current_std = float(np.std(self.values[valid_and_current_idx], axis=0).item())
+    if valid_and_current_mask.any():
+      current_values = self.values[valid_and_current_mask]
+      current_mean, current_std = float(np.mean(current_values)), float(np.std(current_values))
     else:
       current_mean, current_std = float('nan'), float('nan')
 
@@ -191,6 +227,7 @@ class LateralLagEstimator:
     self.last_estimate_t = 0.0
 
     self.calibrator = PoseCalibrator()
+    self.correlator = MaskedNCC()
 
     self.reset(self.initial_lag, 0)
 
@@ -296,10 +333,10 @@ class LateralLagEstimator:
     # check if there are any new valid data points since the last update
     is_valid = self.points_valid()
     if self.last_estimate_t != 0 and times[0] <= self.last_estimate_t:
-      new_values_start_idx = next(-i for i, t in enumerate(reversed(times)) if t <= self.last_estimate_t)
+      new_values_start_idx = -(len(times) - np.searchsorted(times, self.last_estimate_t, side='right'))
       is_valid = is_valid and not (new_values_start_idx == 0 or not np.any(okay[new_values_start_idx:]))
 
-    delay, corr, confidence = self.actuator_delay(desired, actual, okay, self.dt, MAX_LAG)
+    delay, corr, confidence = self.actuator_delay(desired, actual, okay, self.dt, MAX_LAG, self.correlator)
     if corr < self.min_ncc or confidence < self.min_confidence or not is_valid:
       return
 
@@ -307,12 +344,13 @@ class LateralLagEstimator:
     self.last_estimate_t = self.t
 
   @staticmethod
-  def actuator_delay(expected_sig: np.ndarray, actual_sig: np.ndarray, mask: np.ndarray, dt: float, max_lag: float) -> tuple[float, float, float]:
+  def actuator_delay(expected_sig: np.ndarray, actual_sig: np.ndarray, mask: np.ndarray, dt: float, max_lag: float,
+                     correlator: MaskedNCC | None = None) -> tuple[float, float, float]:
     assert len(expected_sig) == len(actual_sig)
     max_lag_samples = int(max_lag / dt)
     padded_size = fft_next_good_size(len(expected_sig) + max_lag_samples)
 
-    ncc = masked_normalized_cross_correlation(expected_sig, actual_sig, mask, padded_size)
+    ncc = (correlator or MaskedNCC())(expected_sig, actual_sig, mask, padded_size)
 
     # only consider lags from 0 to max_lag
     roi = np.s_[len(expected_sig) - 1: len(expected_sig) - 1 + max_lag_samples]
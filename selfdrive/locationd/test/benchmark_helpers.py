@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+import numpy as np
+
+from cereal import car
+from openpilot.selfdrive.locationd.helpers import NPQueue, SignalBuffer
+from openpilot.selfdrive.locationd.lagd import LateralLagEstimator, MaskedNCC, MAX_LAG, MOVING_WINDOW_SEC
+from openpilot.selfdrive.locationd.torqued import TorqueEstimator, STEER_BUCKET_BOUNDS, POINTS_PER_BUCKET
+
+
+def time_appends(maxlen: int, n: int) -> float:
+  q = NPQueue(maxlen=maxlen, rowsize=3)
+  pts = np.random.rand(n, 3).tolist()
+  st = time.monotonic()
+  for pt in pts:
+    q.append(pt)
+  return (time.monotonic() - st) / n
+
+
+def time_interp(maxlen: int, n: int) -> float:
+  buf = SignalBuffer(maxlen=maxlen, ncols=2)
+  for i in range(maxlen):
+    buf.append(i * 0.01, np.random.rand(), 1.0)
+  query_ts = np.arange(0, maxlen * 0.01, 0.05)
+  st = time.monotonic()
+  for _ in range(n):
+    buf.interp(query_ts)
+    buf.interp(query_ts[-1], col=1)
+  return (time.monotonic() - st) / n
+
+
+def time_estimate_params(n: int) -> float:
+  est = TorqueEstimator(car.CarParams())
+  for bound_min, bound_max in STEER_BUCKET_BOUNDS:
+    for x in np.random.uniform(bound_min, bound_max, POINTS_PER_BUCKET):
+      est.filtered_points.add_point(x, 2 * x + np.random.normal(scale=0.3))
+  st = time.monotonic()
+  for _ in range(n):
+    est.estimate_params()
+  return (time.monotonic() - st) / n
+
+
+def time_lag_estimate(n: int, reuse: bool) -> float:
+  dt = 0.05
+  t = np.arange(int(MOVING_WINDOW_SEC / dt)) * dt
+  desired, actual = np.cos(10 * t), np.cos(10 * (t - 0.2))
+  mask = np.ones(len(t), dtype=bool)
+  correlator = MaskedNCC()
+  st = time.monotonic()
+  for _ in range(n):
+    LateralLagEstimator.actuator_delay(desired, actual, mask, dt, MAX_LAG, correlator if reuse else None)
+  return (time.monotonic() - st) / n
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Per call cost of the locationd estimator helpers")
+  parser.add_argument("-n", type=int, default=20000, help="number of calls")
+  args = parser.parse_args()
+
+  print(f"NPQueue.append, {args.n} appends")
+  for maxlen in (100, 1000, 10000):
+    print(f"  maxlen {maxlen:>5}: {time_appends(maxlen, args.n) * 1e6:.2f} us per append")
+
+  print(f"SignalBuffer.interp, {args.n} window and point lookups")
+  for maxlen in (100, 1000):
+    print(f"  maxlen {maxlen:>5}: {time_interp(maxlen, args.n) * 1e6:.2f} us per lookup pair")
+
+  print(f"TorqueEstimator.estimate_params with full buckets, {args.n // 10} calls")
+  print(f"  {time_estimate_params(args.n // 10) * 1e6:.2f} us per call")
+
+  print(f"LateralLagEstimator.actuator_delay over a {MOVING_WINDOW_SEC:.0f}s window, {args.n // 10} calls")
+  for reuse in (False, True):
+    print(f"  {'reused' if reuse else 'fresh':>6} correlator: {time_lag_estimate(args.n // 10, reuse) * 1e6:.2f} us per call")
@@ -0,0 +1,59 @@
+import numpy as np
+
+from openpilot.selfdrive.locationd.helpers import NPQueue, PointBuckets, SignalBuffer
+
+
+def test_npqueue():
+  q = NPQueue(maxlen=5, rowsize=2)
+  assert len(q) == 0 and q.arr.shape == (0, 2)
+
+  for i in range(12):
+    q.append([i, -i])
+    n = min(i + 1, 5)
+    assert len(q) == n
+    np.testing.assert_array_equal(q.arr, [[j, -j] for j in range(i + 1 - n, i + 1)])
+
+
+def test_signal_buffer_interp():
+  rng = np.random.default_rng(0)
+  buf = SignalBuffer(maxlen=20, ncols=2)
+  ts, xs = [], []
+  for i in range(50):
+    ts.append(i * 0.01 + rng.uniform(0, 0.005))
+    xs.append([rng.normal(), float(rng.integers(2))])
+    buf.append(ts[-1], *xs[-1])
+
+    xp, fp = np.array(ts[-20:]), np.array(xs[-20:])
+    np.testing.assert_array_equal(buf.t, xp)
+    query_ts = rng.uniform(xp[0] - 0.1, xp[-1] + 0.1, 30)
+    for col in range(2):
+      np.testing.assert_array_equal(buf.interp(query_ts, col), np.interp(query_ts, xp, fp[:, col]))
+      assert buf.interp(query_ts[0], col) == np.interp(query_ts[0], xp, fp[:, col])
+
+
+class XBuckets(PointBuckets):
+  def add_point(self, x, y):
+    for bound_min, bound_max in self.x_bounds:
+      if bound_min <= x < bound_max:
+        self.buckets[(bound_min, bound_max)].append([x, y])
+        break
+
+
+def test_point_buckets_get_points():
+  pb = XBuckets(x_bounds=[(0, 1), (1, 2), (2, 3)], min_points=[1, 1, 1], min_points_total=3, points_per_bucket=10, rowsize=2)
+  pb.load_points([[0.5, i] for i in range(15)] + [[2.5, i] for i in range(4)])
+  expected = [[0.5, i] for i in range(5, 15)] + [[2.5, i] for i in range(4)]
+  np.testing.assert_array_equal(pb.get_points(), expected)
+
+  for num_points in (1, 7, 14, 100):
+    sample = pb.get_points(num_points)
+    assert len(sample) == min(num_points, len(expected))
+    assert len({tuple(pt) for pt in sample}) == len(sample)
+    assert all(list(pt) in expected for pt in sample)
+
+  # every point is drawn equally often
+  counts = {tuple(pt): 0 for pt in expected}
+  for _ in range(2000):
+    for pt in pb.get_points(5):
+      counts[tuple(pt)] += 1
+  assert np.allclose(list(counts.values()), 2000 * 5 / len(expected), rtol=0.15)
@@ -5,7 +5,7 @@ import pytest
 
 from cereal import messaging, log, car
 from openpilot.selfdrive.locationd.lagd import LateralLagEstimator, retrieve_initial_lag, masked_normalized_cross_correlation, \
-                                               BLOCK_NUM_NEEDED, BLOCK_SIZE, MIN_OKAY_WINDOW_SEC
+                                               MaskedNCC, Points, BLOCK_NUM_NEEDED, BLOCK_SIZE, MIN_OKAY_WINDOW_SEC
 from openpilot.selfdrive.test.process_replay.migration import migrate, migrate_carParams
 from openpilot.selfdrive.locationd.test.test_locationd_scenarios import TEST_ROUTE
 from openpilot.common.params import Params
@@ -43,6 +43,37 @@ def process_messages(estimator, lag_frames, n_frames, vego=20.0, rejection_thres
     estimator.update_estimate()
 
 
+def reference_masked_ncc(expected_sig, actual_sig, mask, n):
+  # complex fft version MaskedNCC replaced, it computes the same correlation
+  eps = np.finfo(np.float64).eps
+  expected_sig = np.where(mask, expected_sig, 0.0)
+  actual_sig = np.where(mask, actual_sig, 0.0)
+  rotated_expected_sig, rotated_mask = expected_sig[::-1], mask[::-1].astype(np.float64)
+
+  def fft(x):
+    return np.fft.fft(x, n=n)
+
+  def ifft(x):
+    return np.fft.ifft(x).real
+
+  actual_sig_fft, rotated_expected_sig_fft = fft(actual_sig), fft(rotated_expected_sig)
+  actual_mask_fft, rotated_mask_fft = fft(mask.astype(np.float64)), fft(rotated_mask)
+
+  overlap = np.fmax(np.round(ifft(rotated_mask_fft * actual_mask_fft)), eps)
+  masked_correlated_actual = ifft(rotated_mask_fft * actual_sig_fft)
+  masked_correlated_expected = ifft(actual_mask_fft * rotated_expected_sig_fft)
+
+  numerator = ifft(rotated_expected_sig_fft * actual_sig_fft) - masked_correlated_actual * masked_correlated_expected / overlap
+  actual_denom = np.fmax(ifft(rotated_mask_fft * fft(actual_sig ** 2)) - masked_correlated_actual ** 2 / overlap, 0.0)
+  expected_denom = np.fmax(ifft(actual_mask_fft * fft(rotated_expected_sig ** 2)) - masked_correlated_expected ** 2 / overlap, 0.0)
+  denom = np.sqrt(actual_denom * expected_denom)
+
+  nonzero = denom > 1e3 * eps * np.max(np.abs(denom))
+  ncc = np.zeros_like(denom)
+  ncc[nonzero] = numerator[nonzero] / denom[nonzero]
+  return np.clip(ncc, -1, 1)
+
+
 class TestLagd:
   def test_read_saved_params(self):
     params = Params()
@@ -86,6 +117,33 @@ class TestLagd:
     corr = masked_normalized_cross_correlation(desired_sig, actual_sig, mask, 200)[len(desired_sig) - 1:len(desired_sig) + 20]
     assert np.argmax(corr) in range(lag_frames - MAX_ERR_FRAMES, lag_frames + MAX_ERR_FRAMES + 1)
 
+  def test_ncc_reuse(self):
+    correlator = MaskedNCC()
+    # odd padded sizes, windows with masked out samples and a masked out stretch, and geometry changes back and forth
+    for sig_len, n, mask_prob in [(100, 200, 1.0), (100, 200, 1.0), (100, 200, 0.6), (100, 225, 0.6), (150, 200, 0.6), (100, 200, 1.0),
+                                  (101, 243, 0.9), (101, 243, 0.9), (99, 199, 0.3), (100, 201, 1.0)]:
+      desired_sig = np.random.normal(0, 1, sig_len)
+      actual_sig = np.roll(desired_sig, 3) + np.random.normal(0, 0.1, sig_len)
+      mask = np.random.uniform(0, 1, sig_len) < mask_prob
+      if mask_prob < 1.0:
+        mask[sig_len // 3:sig_len // 2] = False
+      expected = reference_masked_ncc(desired_sig, actual_sig, mask, n)
+      assert np.allclose(masked_normalized_cross_correlation(desired_sig, actual_sig, mask, n), expected)
+      assert np.allclose(correlator(desired_sig, actual_sig, mask, n), expected)
+
+  def test_points(self):
+    points = Points(10)
+    times, desired, actual, okay = points.get()
+    assert np.all(times == 0) and not np.any(okay) and len(times) == points.num_points == 10
+
+    for i in range(25):
+      points.update(i * DT, i, -i, i % 3 == 0)
+      times, desired, actual, okay = points.get()
+      expected = np.clip(np.arange(i - 9, i + 1), 0, None)
+      assert np.allclose(times, expected * DT) and np.array_equal(desired, expected) and np.array_equal(actual, -expected)
+      assert np.array_equal(okay, (np.arange(i - 9, i + 1) >= 0) & (expected % 3 == 0))
+      assert points.num_okay == np.count_nonzero(okay)
+
   def test_empty_estimator(self):
     mocked_CP = car.CarParams(steerActuatorDelay=0.8)
     estimator = LateralLagEstimator(mocked_CP, DT)
@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 import os
 import numpy as np
-from collections import deque, defaultdict
 
 import cereal.messaging as messaging
 from cereal import car, log
@@ -10,7 +9,7 @@ from openpilot.common.params import Params
 from openpilot.common.realtime import config_realtime_process, DT_MDL
 from openpilot.common.filter_simple import FirstOrderFilter
 from openpilot.common.swaglog import cloudlog
-from openpilot.selfdrive.locationd.helpers import PointBuckets, ParameterEstimator, PoseCalibrator, Pose
+from openpilot.selfdrive.locationd.helpers import PointBuckets, ParameterEstimator, PoseCalibrator, Pose, SignalBuffer
 from openpilot.sunnypilot.livedelay.helpers import get_lat_delay
 from openpilot.sunnypilot.selfdrive.locationd.torqued_ext import TorqueEstimatorExt
 
@@ -142,7 +141,11 @@ class TorqueEstimator(ParameterEstimator, TorqueEstimatorExt):
   def reset(self):
     self.resets += 1.0
     self.decay = MIN_FILTER_DECAY
-    self.raw_points = defaultdict(lambda: deque(maxlen=self.hist_len))
+    self.raw_points = {
+      'carControl': SignalBuffer(self.hist_len),  # latActive
+      'carOutput': SignalBuffer(self.hist_len),  # steer torque
+      'carState': SignalBuffer(self.hist_len, 2),  # vEgo, steeringPressed
+    }
     self.filtered_points = TorqueBuckets(x_bounds=STEER_BUCKET_BOUNDS,
                                          min_points=self.min_bucket_points,
                                          min_points_total=self.min_points_total,
@@ -154,9 +157,10 @@ class TorqueEstimator(ParameterEstimator, TorqueEstimatorExt):
     points = self.filtered_points.get_points(self.fit_points)
     # total least square solution as both x and y are noisy observations
     # this is empirically the slope of the hysteresis parallelogram as opposed to the line through the diagonals
+    # the right singular vector with the smallest singular value is the eigenvector of points.T @ points with the smallest eigenvalue
     try:
-      _, _, v = np.linalg.svd(points, full_matrices=False)
-      slope, offset = -v.T[0:2, 2] / v.T[2, 2]
+      _, v = np.linalg.eigh(points.T @ points)
+      slope, offset = -v[0:2, 0] / v[2, 0]
       _, spread = np.matmul(points[:, [0, 2]], slope2rot(slope)).T
       friction_coeff = np.std(spread) * FRICTION_FACTOR
     except np.linalg.LinAlgError as e:
@@ -172,23 +176,19 @@ class TorqueEstimator(ParameterEstimator, TorqueEstimatorExt):
 
   def handle_log(self, t, which, msg):
     if which == "carControl":
-      self.raw_points["carControl_t"].append(t + self.lag)
-      self.raw_points["lat_active"].append(msg.latActive)
+      self.raw_points["carControl"].append(t + self.lag, msg.latActive)
     elif which == "carOutput":
-      self.raw_points["carOutput_t"].append(t + self.lag)
-      self.raw_points["steer_torque"].append(-msg.actuatorsOutput.torque)
+      self.raw_points["carOutput"].append(t + self.lag, -msg.actuatorsOutput.torque)
     elif which == "carState":
-      self.raw_points["carState_t"].append(t + self.lag)
       # TODO: check if high aEgo affects resulting lateral accel
-      self.raw_points["vego"].append(msg.vEgo)
-      self.raw_points["steer_override"].append(msg.steeringPressed)
+      self.raw_points["carState"].append(t + self.lag, msg.vEgo, msg.steeringPressed)
     elif which == "liveCalibration":
       self.calibrator.feed_live_calib(msg)
     elif which == "liveDelay":
       self.lag = get_lat_delay(self.params, msg.lateralDelay)
     # calculate lateral accel from past steering torque
     elif which == "livePose":
-      if len(self.raw_points['steer_torque']) == self.hist_len:
+      if len(self.raw_points['carOutput']) == self.hist_len:
         device_pose = Pose.from_live_pose(msg)
         calibrated_pose = self.calibrator.build_calibrated_pose(device_pose)
         angular_velocity_calibrated = calibrated_pose.angular_velocity
@@ -196,12 +196,11 @@ class TorqueEstimator(ParameterEstimator, TorqueEstimatorExt):
         yaw_rate = angular_velocity_calibrated.yaw
         roll = device_pose.orientation.roll
         # check lat active up to now (without lag compensation)
-        lat_active = np.interp(np.arange(t - MIN_ENGAGE_BUFFER, t + self.lag, DT_MDL),
-                               self.raw_points['carControl_t'], self.raw_points['lat_active']).astype(bool)
-        steer_override = np.interp(np.arange(t - MIN_ENGAGE_BUFFER, t + self.lag, DT_MDL),
-                                   self.raw_points['carState_t'], self.raw_points['steer_override']).astype(bool)
-        vego = np.interp(t, self.raw_points['carState_t'], self.raw_points['vego'])
-        steer = np.interp(t, self.raw_points['carOutput_t'], self.raw_points['steer_torque']).item()
+        engage_ts = np.arange(t - MIN_ENGAGE_BUFFER, t + self.lag, DT_MDL)
+        lat_active = self.raw_points['carControl'].interp(engage_ts).astype(bool)
+        steer_override = self.raw_points['carState'].interp(engage_ts, col=1).astype(bool)
+        vego = self.raw_points['carState'].interp(t)
+        steer = self.raw_points['carOutput'].interp(t).item()
         lateral_acc = (vego * yaw_rate) - (np.sin(roll) * ACCELERATION_DUE_TO_GRAVITY).item()
         if all(lat_active) and not any(steer_override) and (vego > MIN_VEL) and (abs(steer) > STEER_MIN_THRESHOLD):
           if abs(lateral_acc) <= LAT_ACC_THRESHOLD:
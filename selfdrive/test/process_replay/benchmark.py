@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import tempfile
+import time
+from typing import Any
+
+import numpy as np
+
+from openpilot.common.git import get_commit
+from openpilot.selfdrive.test.process_replay.process_replay import CONFIGS, get_process_config, replay_process
+from openpilot.selfdrive.test.process_replay.profiler import load_collapsed_stacks
+from openpilot.selfdrive.test.process_replay.test_processes import get_log_data, segments
+from openpilot.tools.lib.logreader import LogReader
+
+# processes that need camera frames aren't benchmarked
+DEFAULT_PROCS = [cfg.proc_name for cfg in CONFIGS if len(cfg.vision_pubs) == 0]
+# cycle latency histogram bin edges, in ms
+LATENCY_BINS_MS = [0, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+PROFILE_TOP_N = 30
+
+
+def load_segment(segment: str) -> list:
+  if os.path.exists(segment):
+    lr = LogReader(segment)
+  else:
+    _, dat = get_log_data(segment)
+    lr = LogReader.from_bytes(dat)
+  return sorted(lr, key=lambda m: m.logMonoTime)
+
+
+def summarize_profile(path: str) -> dict[str, Any]:
+  stacks = load_collapsed_stacks(path)
+  self_counts: dict[str, int] = {}
+  for stack, count in stacks.items():
+    leaf = stack.rsplit(";", 1)[-1]
+    self_counts[leaf] = self_counts.get(leaf, 0) + count
+  total = sum(stacks.values())
+  return {
+    "samples": total,
+    "top_self": [{"function": f, "samples": c, "share": c / total} for f, c in sorted(self_counts.items(), key=lambda x: -x[1])[:PROFILE_TOP_N]],
+    "stacks": dict(stacks.most_common()),
+  }
+
+
+def benchmark_process(proc_name: str, msgs: list, profile_dir: str | None = None) -> dict[str, Any]:
+  cfg = get_process_config(proc_name)
+  num_inputs = sum(m.which() in cfg.pubs for m in msgs)
+
+  stats: dict[str, dict[str, Any]] = {}
+  st = time.monotonic()
+  replay_process(cfg, msgs, disable_progress=True, stats_store=stats, profile_dir=profile_dir)
+  elapsed = time.monotonic() - st
+
+  latencies_ms = np.array(stats[proc_name]["cycle_latencies"]) * 1e3
+  hist, _ = np.histogram(latencies_ms, bins=LATENCY_BINS_MS + [np.inf])
+  result = {
+    "inputs": num_inputs,
+    "cycles": stats[proc_name]["cycles"],
+    "wall_time": elapsed,
+    "msgs_per_sec": num_inputs / elapsed,
+    "cpu_time": stats[proc_name]["cpu_time"],
+    "latency_ms": {
+      "bins": LATENCY_BINS_MS,
+      "counts": hist.tolist(),
+      **{f"p{p}": float(np.percentile(latencies_ms, p)) if len(latencies_ms) else None for p in (50, 90, 99)},
+      "max": float(latencies_ms.max()) if len(latencies_ms) else None,
+    },
+  }
+  if profile_dir is not None:
+    result["profile"] = summarize_profile(os.path.join(profile_dir, f"{proc_name}.txt"))
+  return result
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Measure how fast each replayed process handles its inputs")
+  parser.add_argument("--procs", type=lambda s: s.split(","), default=DEFAULT_PROCS,
+                      help="Comma-separated processes to replay (e.g. plannerd,radard)")
+  parser.add_argument("--profile", action="store_true", help="Sample Python stacks of the replayed processes")
+  parser.add_argument("--output", help="Write results as JSON to this file")
+  parser.add_argument("segment", nargs="?", default=segments[0][1], help="CI segment or local log to replay (default: %(default)s)")
+  args = parser.parse_args()
+
+  msgs = load_segment(args.segment)
+  results: dict[str, Any] = {"commit": get_commit(), "segment": args.segment, "processes": {}}
+  with tempfile.TemporaryDirectory() as profile_dir:
+    for proc_name in args.procs:
+      res = benchmark_process(proc_name, msgs, profile_dir if args.profile else None)
+      results["processes"][proc_name] = res
+
+      cpu_time = f"{res['cpu_time']:.2f}s" if res['cpu_time'] is not None else "n/a"
+      p99 = f"{res['latency_ms']['p99']:.2f}ms" if res['latency_ms']['p99'] is not None else "n/a"
+      print(f"{proc_name}: {res['inputs']} msgs in {res['wall_time']:.2f}s, {res['msgs_per_sec']:.1f} msgs/s, cpu {cpu_time}, p99 cycle {p99}")
+
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump(results, f, indent=2)
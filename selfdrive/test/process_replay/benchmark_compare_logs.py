@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+from openpilot.selfdrive.test.process_replay.compare_logs import EPSILON, compare_logs, diff_msgs
+from openpilot.tools.lib.logreader import LogReader
+
+
+def compare_logs_per_message(log1, log2, ignore_fields, tolerance):
+  # compare_logs without the column-wise pass, every message goes through the structural diff
+  return [d for m1, m2 in zip(log1, log2, strict=True) for d in diff_msgs(m1, m2, ignore_fields, tolerance)]
+
+
+def best_of(repeat, func, *args):
+  times = []
+  for _ in range(repeat):
+    st = time.monotonic()
+    ret = func(*args)
+    times.append(time.monotonic() - st)
+  return min(times), ret
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Time compare_logs against a structural diff of every message")
+  parser.add_argument("log1", help="log file or segment")
+  parser.add_argument("log2", nargs="?", help="log file or segment to compare against, defaults to log1")
+  parser.add_argument("--ignore-fields", nargs="*", default=["logMonoTime"])
+  parser.add_argument("--tolerance", type=float, default=None)
+  parser.add_argument("--repeat", type=int, default=3)
+  args = parser.parse_args()
+
+  log1 = list(LogReader(args.log1))
+  log2 = list(LogReader(args.log2)) if args.log2 else log1
+  print(f"comparing {len(log1)} messages")
+
+  tolerance = EPSILON if args.tolerance is None else args.tolerance
+  per_message, expected = best_of(args.repeat, compare_logs_per_message, log1, log2, args.ignore_fields, tolerance)
+  column_wise, diff = best_of(args.repeat, compare_logs, log1, log2, args.ignore_fields, None, tolerance)
+  assert diff == expected, "compare_logs reported different diffs"
+
+  print(f"  per message:  {per_message:.2f} s")
+  print(f"  compare_logs: {column_wise:.2f} s")
+  print(f"  speedup: {per_message / column_wise:.1f}x, {len(diff)} differences")
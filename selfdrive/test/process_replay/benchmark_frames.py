@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import time
+
+import numpy as np
+
+from openpilot.selfdrive.test.process_replay.process_replay import FramePrefetcher
+from openpilot.tools.lib.framereader import FrameReader, get_video_index
+
+DEMO_VIDEO = "https://commadataci.blob.core.windows.net/openpilotci/0375fdf7b1ce594d/2019-06-13--08-32-25/3/fcamera.hevc"
+
+
+def replay_frames(fn: str, index_data: dict, frames: int, handle_time: float, prefetch: bool) -> float:
+  fr = FrameReader(fn, index_data, pix_fmt="nv12")
+  frame_ids = list(range(min(frames, fr.frame_count)))
+  # stands in for the VisionIPC buffer the frame is copied into
+  buf = np.empty(fr.w * fr.h * 3 // 2, dtype=np.uint8)
+  prefetcher = FramePrefetcher(fr, frame_ids) if prefetch else None
+  try:
+    st = time.monotonic()
+    for frame_id in frame_ids:
+      frame = prefetcher.get(frame_id) if prefetcher is not None else fr.get(frame_id)
+      buf[:] = frame
+      # the replayed process handles the frame in its own process, replay waits for its outputs
+      time.sleep(handle_time)
+    return time.monotonic() - st
+  finally:
+    if prefetcher is not None:
+      prefetcher.stop()
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Time feeding camera frames to a replayed vision process, with and without prefetching")
+  parser.add_argument("video", nargs="?", default=DEMO_VIDEO, help="hevc file or url")
+  parser.add_argument("--frames", type=int, default=600, help="number of frames to feed")
+  parser.add_argument("--handle-ms", type=float, default=20., help="time the replayed process takes per frame")
+  args = parser.parse_args()
+
+  # keep downloads out of the measurement
+  os.environ["FILEREADER_CACHE"] = "1"
+  index_data = get_video_index(args.video)
+  handle_time = args.handle_ms / 1e3
+
+  decode_only = replay_frames(args.video, index_data, args.frames, 0., prefetch=False)
+  inline = replay_frames(args.video, index_data, args.frames, handle_time, prefetch=False)
+  prefetched = replay_frames(args.video, index_data, args.frames, handle_time, prefetch=True)
+
+  n = min(args.frames, FrameReader(args.video, index_data).frame_count)
+  print(f"feeding {n} frames, {args.handle_ms:.1f} ms of processing per frame")
+  print(f"  decode only:       {decode_only / n * 1e3:6.2f} ms/frame")
+  print(f"  decoded inline:    {inline / n * 1e3:6.2f} ms/frame")
+  print(f"  prefetched:        {prefetched / n * 1e3:6.2f} ms/frame")
+  print(f"  speedup: {inline / prefetched:.2f}x")
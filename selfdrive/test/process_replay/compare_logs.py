@@ -1,12 +1,16 @@
 #!/usr/bin/env python3
 import sys
+import copy
 import math
 import capnp
 import numbers
 import dictdiffer
-from collections import Counter
+import numpy as np
+from collections import Counter, defaultdict
 
-from openpilot.tools.lib.logreader import LogReader
+from cereal import log
+from openpilot.tools.lib.logreader import CachedEventReader, LogReader
+from openpilot.tools.lib.log_time_series import data_section_columns, event_layouts, msgs_to_columns
 
 EPSILON = sys.float_info.epsilon
 
@@ -39,6 +43,248 @@ def remove_ignored_fields(msg, ignore):
   return msg
 
 
+def diff_msgs(msg1, msg2, ignore_fields, tolerance):
+  msg1 = remove_ignored_fields(msg1, ignore_fields)
+  msg2 = remove_ignored_fields(msg2, ignore_fields)
+
+  if msg1.to_bytes() == msg2.to_bytes():
+    return []
+
+  msg1_dict = msg1.as_reader().to_dict(verbose=True)
+  msg2_dict = msg2.as_reader().to_dict(verbose=True)
+
+  dd = dictdiffer.diff(msg1_dict, msg2_dict, ignore=ignore_fields)
+
+  # Dictdiffer only supports relative tolerance, we also want to check for absolute
+  # TODO: add this to dictdiffer
+  def outside_tolerance(diff):
+    try:
+      if diff[0] == "change":
+        a, b = diff[2]
+        finite = math.isfinite(a) and math.isfinite(b)
+        if finite and isinstance(a, numbers.Number) and isinstance(b, numbers.Number):
+          return abs(a - b) > max(tolerance, tolerance * max(abs(a), abs(b)))
+    except TypeError:
+      pass
+    return True
+
+  return list(filter(outside_tolerance, dd))
+
+
+NO_DISCRIMINANT = 0xFFFF
+IGNORABLE_TYPES = {'bool', 'int8', 'int16', 'int32', 'int64', 'uint8', 'uint16', 'uint32', 'uint64', 'float32', 'float64', 'list'}
+
+
+def ignored_paths(msg_type, ignore_fields):
+  """Field paths of msg_type to ignore and whether logMonoTime and valid are ignored, None if they can't be expressed as columns"""
+  paths, event_fields = [], set()
+  for key in ignore_fields:
+    keys = key.split(".")
+    if len(keys) == 1:
+      if key not in ("logMonoTime", "valid"):
+        return None
+      event_fields.add(key)
+    elif keys[0] == msg_type:
+      paths.append(keys[1:])
+  return paths, event_fields
+
+
+def clearable(schema, path):
+  """Whether remove_ignored_fields can clear path in every message of schema, which holds without list indices or union members on the way"""
+  for i, k in enumerate(path):
+    field = schema.fields.get(k)
+    if field is None or field.proto.discriminantValue != NO_DISCRIMINANT:
+      return False
+    last = i == len(path) - 1
+    if field.proto.which() == 'group':
+      if last:
+        return False
+      schema = field.schema
+      continue
+
+    typ = field.proto.slot.type.which()
+    if last:
+      return typ in IGNORABLE_TYPES
+    if typ != 'struct':
+      return False
+    schema = field.schema
+  return False
+
+
+def ignorable(column):
+  # remove_ignored_fields can only clear bools, numbers and lists
+  if isinstance(column, list):
+    return all(isinstance(v, list) for v in column)
+  return column.dtype.kind in "biuf"
+
+
+def without_ignored(value, paths):
+  """A copy of a to_dict value of a list field with the ignored paths left out, None if one can't be cleared"""
+  value = copy.deepcopy(value)
+  for path in paths:
+    attr = value
+    try:
+      for k in path[:-1]:
+        attr = attr[int(k)] if k.isdigit() else attr[k]
+      if path[-1].isdigit() or not isinstance(attr[path[-1]], (bool, numbers.Number, list)):
+        return None
+      del attr[path[-1]]
+    except (KeyError, IndexError, TypeError):
+      return None
+  return value
+
+
+def column_differs(a, b, tolerance):
+  if isinstance(a, list):
+    return np.array([x != y for x, y in zip(a, b, strict=True)], dtype=bool)
+  if a.dtype == np.float64 and b.dtype == np.float64:
+    with np.errstate(invalid='ignore', over='ignore'):
+      within = np.isfinite(a) & np.isfinite(b) & (np.abs(a - b) <= np.maximum(tolerance, tolerance * np.maximum(np.abs(a), np.abs(b))))
+    return ~((a == b) | within)
+  if a.dtype != b.dtype:
+    return np.ones(len(a), dtype=bool)
+  return np.asarray(a != b, dtype=bool).reshape(len(a))
+
+
+def masked_column_differs(a, b, paths):
+  differs = np.zeros(len(a), dtype=bool)
+  for i, (x, y) in enumerate(zip(a, b, strict=True)):
+    x, y = without_ignored(x, paths), without_ignored(y, paths)
+    # a path that can't be cleared makes remove_ignored_fields raise, leave that to the structural diff
+    differs[i] = x is None or y is None or x != y
+  return differs
+
+
+def columns_may_differ(msgs1, msgs2, paths, event_fields, tolerance):
+  """Flags message pairs of a single service by comparing all of their fields column-wise, None if it can't tell for any pair"""
+  msg_type = msgs1[0].which()
+  columns1, columns2 = msgs_to_columns(msgs1, msg_type), msgs_to_columns(msgs2, msg_type)
+  if columns1 is None or columns2 is None or columns1.keys() != columns2.keys():
+    return None
+
+  # ignored fields are skipped, paths into the elements of a list field are masked out of its values
+  skipped, masked = set(), defaultdict(list)
+  for path in paths:
+    for n in range(len(path), 0, -1):
+      name = "/".join(path[:n])
+      if name in columns1:
+        break
+    else:
+      return None
+    if n == len(path):
+      if not (ignorable(columns1[name]) and ignorable(columns2[name])):
+        return None
+      skipped.add(name)
+    elif isinstance(columns1[name], list):
+      masked[name].append(path[n:])
+    else:
+      return None
+
+  differs = np.zeros(len(msgs1), dtype=bool)
+  if "logMonoTime" not in event_fields:
+    differs |= np.array([m1.logMonoTime != m2.logMonoTime for m1, m2 in zip(msgs1, msgs2, strict=True)], dtype=bool)
+  if "valid" not in event_fields:
+    differs |= np.array([m1.valid != m2.valid for m1, m2 in zip(msgs1, msgs2, strict=True)], dtype=bool)
+
+  for name in columns1:
+    if name in skipped:
+      continue
+    if name in masked:
+      differs |= masked_column_differs(columns1[name], columns2[name], masked[name])
+    else:
+      differs |= column_differs(columns1[name], columns2[name], tolerance)
+  return differs
+
+
+def serialized(msgs):
+  # LogReader events carry their serialized bytes, anything else is copied out of capnp
+  return [m._dat if isinstance(m, CachedEventReader) and m._dat is not None else m.as_builder().to_bytes() for m in msgs]
+
+
+def data_rows(buf, starts, pos, size, row_size):
+  """The data section at pos of each event as one row of row_size bytes, shorter sections (older schemas) padded with defaults"""
+  idxs = (starts + pos)[:, None] + np.arange(row_size)
+  if (size >= row_size).all():
+    return buf[idxs]
+  present = np.arange(row_size) < size[:, None]
+  return np.where(present, buf[np.where(present, idxs, 0)], 0).astype(np.uint8)
+
+
+def data_section_differs(schema, rows1, rows2, skipped, tolerance):
+  columns1, columns2 = data_section_columns(schema, rows1), data_section_columns(schema, rows2)
+  differs = np.zeros(len(rows1), dtype=bool)
+  for name, (values, active) in columns1.items():
+    if name in skipped:
+      continue
+    # union members only count where they're set, a different discriminant is a difference in _which
+    column = column_differs(values, columns2[name][0], tolerance)
+    differs |= column if active is None else column & active
+  return differs
+
+
+def msgs_may_differ(msgs1, msgs2, ignore_fields, tolerance):
+  """
+    Flags message pairs of a single service that may have differences outside of ignore_fields and tolerance.
+    Pairs that aren't flagged have none. None if it can't tell for any pair.
+
+    The serialized events are compared as raw bytes, except for the data sections of the Event and the service struct.
+    Their fields are decoded into typed columns, ignored ones are skipped and floats compared with tolerance. Anything
+    behind a pointer that isn't byte-identical is compared with every field in columns.
+  """
+  msg_type = msgs1[0].which()
+  ignored = ignored_paths(msg_type, ignore_fields)
+  if ignored is None:
+    return None
+  paths, event_fields = ignored
+
+  field = log.Event.schema.fields[msg_type]
+  schema = field.schema if field.proto.slot.type.which() == 'struct' else None
+  if not all(schema is not None and clearable(schema, path) for path in paths):
+    return columns_may_differ(msgs1, msgs2, paths, event_fields, tolerance)
+
+  # pairs of different lengths can't be byte-identical, leave them out so both logs line up byte for byte
+  dats1, dats2 = serialized(msgs1), serialized(msgs2)
+  same_length = np.array([len(d1) == len(d2) for d1, d2 in zip(dats1, dats2, strict=True)], dtype=bool)
+  dats1 = [d if same else b"" for d, same in zip(dats1, same_length, strict=True)]
+  dats2 = [d if same else b"" for d, same in zip(dats2, same_length, strict=True)]
+  lengths = np.array([len(d) for d in dats1], dtype=np.int64)
+  starts = np.cumsum(lengths) - lengths
+  buf1, buf2 = np.frombuffer(b"".join(dats1), dtype=np.uint8), np.frombuffer(b"".join(dats2), dtype=np.uint8)
+
+  ok1, *layout1 = event_layouts(buf1, starts, lengths, field.proto.slot.offset)
+  ok2, *layout2 = event_layouts(buf2, starts, lengths, field.proto.slot.offset)
+  ok = same_length & ok1 & ok2
+  for a, b in zip(layout1, layout2, strict=True):
+    ok &= a == b
+  event_pos, event_size, service_pos, service_size = layout1
+
+  # bytes outside of the two data sections
+  pointers_differ = np.zeros(len(msgs1), dtype=bool)
+  mismatches = np.flatnonzero(buf1 != buf2)
+  rows = np.searchsorted(starts + lengths, mismatches, side='right')
+  offsets = mismatches - starts[rows]
+  in_event = (offsets >= event_pos[rows]) & (offsets < event_pos[rows] + event_size[rows])
+  in_service = (offsets >= service_pos[rows]) & (offsets < service_pos[rows] + service_size[rows])
+  pointers_differ[rows[~(in_event | in_service)]] = True
+
+  differs = np.zeros(len(msgs1), dtype=bool)
+  idxs = np.flatnonzero(ok)
+  event_row_size = log.Event.schema.node.struct.dataWordCount * 8
+  differs[idxs] = data_section_differs(log.Event.schema, data_rows(buf1, starts[idxs], event_pos[idxs], event_size[idxs], event_row_size),
+                                       data_rows(buf2, starts[idxs], event_pos[idxs], event_size[idxs], event_row_size), event_fields, tolerance)
+  if schema is not None:
+    service_row_size = schema.node.struct.dataWordCount * 8
+    differs[idxs] |= data_section_differs(schema, data_rows(buf1, starts[idxs], service_pos[idxs], service_size[idxs], service_row_size),
+                                          data_rows(buf2, starts[idxs], service_pos[idxs], service_size[idxs], service_row_size),
+                                          {"/".join(path) for path in paths}, tolerance)
+
+  uncertain = np.flatnonzero(~differs & (~ok | pointers_differ))
+  if len(uncertain):
+    columns = columns_may_differ([msgs1[i] for i in uncertain], [msgs2[i] for i in uncertain], paths, event_fields, tolerance)
+    differs[uncertain] = True if columns is None else columns
+  return differs
+
+
 def compare_logs(log1, log2, ignore_fields=None, ignore_msgs=None, tolerance=None,):
   if ignore_fields is None:
     ignore_fields = []
@@ -47,7 +293,7 @@ def compare_logs(log1, log2, ignore_fields=None, ignore_msgs=None, tolerance=Non
   tolerance = EPSILON if tolerance is None else tolerance
 
   log1, log2 = (
-    [m for m in log if m.which() not in ignore_msgs]
+    [m for m in log if m.which() not in ignore_msgs] if ignore_msgs else list(log)
     for log in (log1, log2)
   )
 
@@ -56,36 +302,22 @@ def compare_logs(log1, log2, ignore_fields=None, ignore_msgs=None, tolerance=Non
     cnt2 = Counter(m.which() for m in log2)
     raise Exception(f"logs are not same length: {len(log1)} VS {len(log2)}\n\t\t{cnt1}\n\t\t{cnt2}")
 
-  diff = []
-  for msg1, msg2 in zip(log1, log2, strict=True):
-    if msg1.which() != msg2.which():
+  service_idxs = defaultdict(list)
+  for i, (msg1, msg2) in enumerate(zip(log1, log2, strict=True)):
+    msg_type = msg1.which()
+    if msg_type != msg2.which():
       raise Exception("msgs not aligned between logs")
+    service_idxs[msg_type].append(i)
 
-    msg1 = remove_ignored_fields(msg1, ignore_fields)
-    msg2 = remove_ignored_fields(msg2, ignore_fields)
-
-    if msg1.to_bytes() != msg2.to_bytes():
-      msg1_dict = msg1.as_reader().to_dict(verbose=True)
-      msg2_dict = msg2.as_reader().to_dict(verbose=True)
+  # each service is compared at once, only the messages that may differ go through the structural diff
+  may_differ = np.zeros(len(log1), dtype=bool)
+  for idxs in service_idxs.values():
+    differs = msgs_may_differ([log1[i] for i in idxs], [log2[i] for i in idxs], ignore_fields, tolerance)
+    may_differ[idxs] = True if differs is None else differs
 
-      dd = dictdiffer.diff(msg1_dict, msg2_dict, ignore=ignore_fields)
-
-      # Dictdiffer only supports relative tolerance, we also want to check for absolute
-      # TODO: add this to dictdiffer
-      def outside_tolerance(diff):
-        try:
-          if diff[0] == "change":
-            a, b = diff[2]
-            finite = math.isfinite(a) and math.isfinite(b)
-            if finite and isinstance(a, numbers.Number) and isinstance(b, numbers.Number):
-              return abs(a - b) > max(tolerance, tolerance * max(abs(a), abs(b)))
-        except TypeError:
-          pass
-        return True
-
-      dd = list(filter(outside_tolerance, dd))
-
-      diff.extend(dd)
+  diff = []
+  for i in np.flatnonzero(may_differ):
+    diff.extend(diff_msgs(log1[i], log2[i], ignore_fields, tolerance))
   return diff
 
 
@@ -76,13 +76,12 @@ def migrate(lr: LogIterable, migration_funcs: list[MigrationFunc]):
     add_ops.extend(a_ops)
     del_ops.extend(d_ops)
 
-  for index, msg in replace_ops:
-    lr[index] = msg
-  for index in sorted(del_ops, reverse=True):
-    del lr[index]
-  for msg in add_ops:
-    lr.append(msg)
-  lr = sorted(lr, key=lambda x: x.logMonoTime)
+  # apply all ops in one rebuild of the list, deleting entries one by one is quadratic on long routes
+  replaced = dict(replace_ops)
+  deleted = set(del_ops)
+  lr = [replaced.get(i, msg) for i, msg in enumerate(lr) if i not in deleted]
+  lr.extend(add_ops)
+  lr.sort(key=lambda x: x.logMonoTime)
 
   return lr
 
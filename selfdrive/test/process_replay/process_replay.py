@@ -1,16 +1,21 @@
 #!/usr/bin/env python3
 import os
 import time
+import contextlib
 import copy
 import heapq
+import queue
 import signal
-from collections import Counter
+import threading
+import weakref
+from collections import Counter, deque
 from dataclasses import dataclass, field
 from itertools import islice
 from typing import Any
 from collections.abc import Callable, Iterable
 from tqdm import tqdm
 import capnp
+import psutil
 from openpilot.system.hardware.hw import Paths
 
 import cereal.messaging as messaging
@@ -24,16 +29,22 @@ from openpilot.common.prefix import OpenpilotPrefix
 from openpilot.common.timeout import Timeout
 from openpilot.common.realtime import DT_CTRL
 from openpilot.selfdrive.car.card import convert_to_capnp
+from openpilot.system.manager.process import PythonProcess
 from openpilot.system.manager.process_config import managed_processes
 from openpilot.selfdrive.test.process_replay.vision_meta import meta_from_camera_state, available_streams
 from openpilot.selfdrive.test.process_replay.migration import migrate_all
 from openpilot.selfdrive.test.process_replay.capture import ProcessOutputCapture
+from openpilot.selfdrive.test.process_replay.profiler import LauncherWithProfiler
 from openpilot.tools.lib.logreader import LogIterable
 from openpilot.tools.lib.framereader import FrameReader
 
 # Numpy gives different results based on CPU features after version 19
 NUMPY_TOLERANCE = 1e-2
 PROC_REPLAY_DIR = os.path.dirname(os.path.abspath(__file__))
+# Max number of cycles a pipelined process may be ahead of the other pipelined processes
+PIPELINE_WINDOW = 50
+# Time a profiled process gets to write out its samples before it's killed
+PROFILE_FLUSH_TIMEOUT = 2.0
 FAKEDATA = os.path.join(PROC_REPLAY_DIR, "fakedata/")
 
 
@@ -131,6 +142,8 @@ class ProcessConfig:
   main_pub_drained: bool = False
   vision_pubs: list[str] = field(default_factory=list)
   ignore_alive_pubs: list[str] = field(default_factory=list)
+  # Can be fed its inputs at its own pace in pipelined replay, when no other replayed process publishes to it or subscribes to it
+  pipelined: bool = False
 
   def __post_init__(self):
     # If the process is polling a service, we can just lock that one to speed up replay
@@ -138,6 +151,57 @@ class ProcessConfig:
       self.main_pub = self.should_recv_callback.trigger_msg_type
 
 
+class FramePrefetcher:
+  """
+    Decodes the frames of one camera in the order replay will send them, on a background thread and at most
+    depth frames ahead, so decoding the next frame overlaps with the process handling the current one.
+  """
+  _decode_locks: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+  def __init__(self, fr: FrameReader, frame_ids: list[int], depth: int = 2):
+    self.fr = fr
+    self.frames: queue.Queue = queue.Queue(maxsize=depth)
+    self.done = False
+    self._stop = threading.Event()
+    self._lock = FramePrefetcher._decode_locks.setdefault(fr, threading.Lock())
+    self._thread = threading.Thread(target=self._decode, args=(frame_ids,), daemon=True)
+    self._thread.start()
+
+  def _put(self, item) -> bool:
+    while not self._stop.is_set():
+      try:
+        self.frames.put(item, timeout=0.1)
+        return True
+      except queue.Full:
+        pass
+    return False
+
+  def _decode(self, frame_ids: list[int]):
+    try:
+      for frame_id in frame_ids:
+        with self._lock:
+          frame = self.fr.get(frame_id)
+        if not self._put((frame_id, frame)):
+          return
+    finally:
+      self._put(None)
+
+  def get(self, frame_id: int):
+    # frames replay didn't ask for are skipped, frames that weren't prefetched are decoded here once the thread is done
+    while not self.done:
+      item = self.frames.get()
+      if item is None:
+        self.done = True
+      elif item[0] == frame_id:
+        return item[1]
+    with self._lock:
+      return self.fr.get(frame_id)
+
+  def stop(self):
+    self._stop.set()
+    self._thread.join()
+
+
 class ProcessContainer:
   def __init__(self, cfg: ProcessConfig):
     self.prefix = OpenpilotPrefix(create_dirs_on_enter=False, clean_dirs_on_exit=False)
@@ -149,8 +213,13 @@ class ProcessContainer:
     self.sockets: list[messaging.SubSocket] | None = None
     self.rc: ReplayContext | None = None
     self.vipc_server: VisionIpcServer | None = None
+    self.frame_prefetchers: dict[str, FramePrefetcher] = {}
     self.environ_config: dict[str, Any] | None = None
     self.capture: ProcessOutputCapture | None = None
+    self.profile_path: str | None = None
+    # time from sending a cycle's inputs until the process is waiting on the next ones
+    self.cycle_latencies: list[float] = []
+    self._cycle_start: float | None = None
 
   @property
   def has_empty_queue(self) -> bool:
@@ -160,6 +229,12 @@ class ProcessContainer:
   def pubs(self) -> list[str]:
     return self.cfg.pubs
 
+  @property
+  def cycle_ready(self) -> bool:
+    # the process is waiting on its next inputs, so run_step won't block
+    assert self.rc
+    return any(ev.peek() for ev in self.rc.all_recv_called_events)
+
   @property
   def subs(self) -> list[str]:
     return self.cfg.subs
@@ -209,17 +284,22 @@ class ProcessContainer:
 
     self.vipc_server = vipc_server
     self.cfg.vision_pubs = [meta.camera_state for meta in streams_metas if meta.camera_state in self.cfg.vision_pubs]
+    for camera_state in self.cfg.vision_pubs:
+      frame_ids = [getattr(m, camera_state).frameId for m in all_msgs if m.which() == camera_state]
+      self.frame_prefetchers[camera_state] = FramePrefetcher(frs[camera_state], frame_ids)
 
   def _start_process(self):
     if self.capture is not None:
       self.process.launcher = LauncherWithCapture(self.capture, self.process.launcher)
+    if self.profile_path is not None and isinstance(self.process, PythonProcess):
+      self.process.launcher = LauncherWithProfiler(self.profile_path, self.process.launcher)
     self.process.prepare()
     self.process.start()
 
   def start(
     self, params_config: dict[str, Any], environ_config: dict[str, Any],
     all_msgs: LogIterable, frs: dict[str, FrameReader] | None,
-    fingerprint: str | None, capture_output: bool
+    fingerprint: str | None, capture_output: bool, profile_path: str | None = None
   ):
     with self.prefix as p:
       self.prefix.create_dirs()
@@ -242,16 +322,31 @@ class ProcessContainer:
 
       if capture_output:
         self.capture = ProcessOutputCapture(self.cfg.proc_name, p.prefix)
+      self.profile_path = profile_path
 
       self._start_process()
 
       if self.cfg.init_callback is not None:
         self.cfg.init_callback(self.rc, self.pm, all_msgs, fingerprint)
 
+  def get_stats(self) -> dict[str, Any]:
+    cpu_time = None
+    if self.process.proc is not None and self.process.proc.is_alive():
+      with contextlib.suppress(psutil.Error):
+        cpu_times = psutil.Process(self.process.proc.pid).cpu_times()
+        cpu_time = cpu_times.user + cpu_times.system
+    return {"cycles": self.cnt, "cycle_latencies": self.cycle_latencies, "cpu_time": cpu_time}
+
   def stop(self):
     with self.prefix:
+      if self.profile_path is not None and isinstance(self.process, PythonProcess) and self.process.proc is not None:
+        # the profiler writes out its last samples and exits on SIGTERM
+        self.process.signal(signal.SIGTERM)
+        self.process.proc.join(PROFILE_FLUSH_TIMEOUT)
       self.process.signal(signal.SIGKILL)
       self.process.stop()
+      for prefetcher in self.frame_prefetchers.values():
+        prefetcher.stop()
       self.rc.close_context()
       self.prefix.clean_dirs()
       self._clean_env()
@@ -261,6 +356,9 @@ class ProcessContainer:
 
     output_msgs = []
     self.rc.wait_for_recv_called()
+    if self._cycle_start is not None:
+      self.cycle_latencies.append(time.monotonic() - self._cycle_start)
+      self._cycle_start = None
     for socket in self.sockets:
       ms = messaging.drain_sock(socket)
       for m in ms:
@@ -299,25 +397,101 @@ class ProcessContainer:
           if self.vipc_server is not None and m.which() in self.cfg.vision_pubs:
             camera_state = getattr(m, m.which())
             camera_meta = meta_from_camera_state(m.which())
-            assert frs is not None
-            img = frs[m.which()].get(camera_state.frameId)
-            self.vipc_server.send(camera_meta.stream, img.flatten().tobytes(),
+            img = self.frame_prefetchers[m.which()].get(camera_state.frameId)
+            # the decoded frame is copied straight into the VisionIPC buffer
+            self.vipc_server.send(camera_meta.stream, img.data,
                                   camera_state.frameId, camera_state.timestampSof, camera_state.timestampEof)
         self.msg_queue = []
 
         self.rc.unlock_sockets()
         if trigger_empty_recv:
           self.rc.unlock_sockets()
+        self._cycle_start = time.monotonic()
         self.cnt += 1
     assert self.process.proc.is_alive()
 
     return output_msgs
 
 
+class ReplayScheduler:
+  """
+    Merges log messages (already sorted by logMonoTime) with messages generated by processes during replay.
+    A log message goes first only if it's strictly older than every pending generated message, and generated
+    messages with the same logMonoTime keep the order they were produced in.
+  """
+  def __init__(self, external_msgs: Iterable[capnp._DynamicStructReader]):
+    # external queue for messages taken from logs; internal heap for messages generated by processes, which will be republished
+    self.external_queue: deque[capnp._DynamicStructReader] = deque(external_msgs)
+    # each element: (logMonoTime, order of arrival, msg)
+    self.internal_heap: list[tuple[int, int, capnp._DynamicStructReader]] = []
+    self.internal_cnt = 0
+
+  @property
+  def external_remaining(self) -> int:
+    return len(self.external_queue)
+
+  @property
+  def internal_remaining(self) -> int:
+    return len(self.internal_heap)
+
+  def push(self, msg: capnp._DynamicStructReader):
+    heapq.heappush(self.internal_heap, (msg.logMonoTime, self.internal_cnt, msg))
+    self.internal_cnt += 1
+
+  def pop(self) -> tuple[capnp._DynamicStructReader, bool]:
+    """Returns the next message to publish, and whether it came from the logs"""
+    if len(self.internal_heap) == 0 or (len(self.external_queue) != 0 and self.external_queue[0].logMonoTime < self.internal_heap[0][0]):
+      return self.external_queue.popleft(), True
+    return heapq.heappop(self.internal_heap)[2], False
+
+
+class PipelinedFeeder:
+  """
+    Feeds a process, whose inputs all come from the logs, at its own pace instead of in lockstep with the
+    other replayed processes. It may run up to window cycles ahead of the slowest other pipelined process.
+  """
+  def __init__(self, container: ProcessContainer, msgs: Iterable[capnp._DynamicStructReader]):
+    self.container = container
+    self.queue: deque[capnp._DynamicStructReader] = deque(m for m in msgs if m.which() in container.pubs)
+    self.output_msgs: list[capnp._DynamicStructReader] = []
+
+  @property
+  def done(self) -> bool:
+    return len(self.queue) == 0
+
+  def advance(self, frs: dict[str, FrameReader] | None, max_cnt: int) -> int:
+    """Feeds inputs while the process is ready for them, returns how many were fed"""
+    fed = 0
+    while not self.done and self.container.cnt < max_cnt and self.container.cycle_ready:
+      # messages that don't end a cycle are only queued, keep going until one does
+      cnt = self.container.cnt
+      while not self.done and self.container.cnt == cnt:
+        self.output_msgs.extend(self.container.run_step(self.queue.popleft(), frs))
+        fed += 1
+    return fed
+
+
+def _advance_pipelined(feeders: list[PipelinedFeeder], frs: dict[str, FrameReader] | None, window: int, block: bool) -> int:
+  """Feeds every pipelined process that's ready. With block, waits for one to be ready if none is"""
+  while True:
+    active = [f for f in feeders if not f.done]
+    if len(active) == 0:
+      return 0
+
+    max_cnt = min(f.container.cnt for f in active) + window
+    fed = sum(f.advance(frs, max_cnt) for f in active)
+    if fed != 0 or not block:
+      return fed
+
+    # only the processes that aren't too far ahead can be fed next
+    ready_events = [ev for f in active if f.container.cnt < max_cnt for ev in f.container.rc.all_recv_called_events]
+    messaging.wait_for_one_event(ready_events)
+
+
 def card_fingerprint_callback(rc, pm, msgs, fingerprint):
   print("start fingerprinting")
   params = Params()
-  canmsgs = list(islice((m for m in msgs if m.which() == "can"), 300))
+  canmsgs = deque(islice((m for m in msgs if m.which() == "can"), 300))
 
   # card expects one arbitrary can and pandaState
   rc.send_sync(pm, "can", messaging.new_message("can", 1))
@@ -330,7 +504,7 @@ def card_fingerprint_callback(rc, pm, msgs, fingerprint):
     if len(canmsgs) == 0:
       raise ValueError("Fingerprinting failed. Run out of can msgs")
 
-    m = canmsgs.pop(0)
+    m = canmsgs.popleft()
     rc.send_sync(pm, "can", m.as_builder().to_bytes())
     rc.wait_for_next_recv(True)
 
@@ -465,6 +639,7 @@ CONFIGS = [
     ignore=["logMonoTime"],
     init_callback=get_car_params_callback,
     should_recv_callback=MessageBasedRcvCallback("modelV2"),
+    pipelined=True,
   ),
   ProcessConfig(
     proc_name="plannerd",
@@ -474,6 +649,7 @@ CONFIGS = [
     init_callback=get_car_params_callback,
     should_recv_callback=MessageBasedRcvCallback("modelV2"),
     tolerance=NUMPY_TOLERANCE,
+    pipelined=True,
   ),
   ProcessConfig(
     proc_name="calibrationd",
@@ -482,6 +658,7 @@ CONFIGS = [
     ignore=["logMonoTime"],
     init_callback=get_car_params_callback,
     should_recv_callback=MessageBasedRcvCallback("cameraOdometry", True),
+    pipelined=True,
   ),
   ProcessConfig(
     proc_name="dmonitoringd",
@@ -490,6 +667,7 @@ CONFIGS = [
     ignore=["logMonoTime"],
     should_recv_callback=MessageBasedRcvCallback("driverStateV2"),
     tolerance=NUMPY_TOLERANCE,
+    pipelined=True,
   ),
   ProcessConfig(
     proc_name="locationd",
@@ -500,6 +678,7 @@ CONFIGS = [
     ignore=["logMonoTime"],
     should_recv_callback=MessageBasedRcvCallback("cameraOdometry"),
     tolerance=NUMPY_TOLERANCE,
+    pipelined=True,
   ),
   ProcessConfig(
     proc_name="paramsd",
@@ -510,6 +689,7 @@ CONFIGS = [
     should_recv_callback=MessageBasedRcvCallback("livePose"),
     tolerance=NUMPY_TOLERANCE,
     processing_time=0.004,
+    pipelined=True,
   ),
   ProcessConfig(
     proc_name="lagd",
@@ -519,12 +699,14 @@ CONFIGS = [
     init_callback=get_car_params_callback,
     should_recv_callback=MessageBasedRcvCallback("livePose"),
     tolerance=NUMPY_TOLERANCE,
+    pipelined=True,
   ),
   ProcessConfig(
     proc_name="ubloxd",
     pubs=["ubloxRaw"],
     subs=["ubloxGnss", "gpsLocationExternal"],
     ignore=["logMonoTime"],
+    pipelined=True,
   ),
   ProcessConfig(
     proc_name="torqued",
@@ -534,6 +716,7 @@ CONFIGS = [
     init_callback=get_car_params_callback,
     should_recv_callback=MessageBasedRcvCallback("livePose", True),
     tolerance=NUMPY_TOLERANCE,
+    pipelined=True,
   ),
   ProcessConfig(
     proc_name="modeld",
@@ -570,6 +753,19 @@ def get_process_config(name: str) -> ProcessConfig:
     raise Exception(f"Cannot find process config with name: {name}") from ex
 
 
+def get_first_msgs(lr: LogIterable, msg_types: Iterable[str], last: bool = False) -> dict[str, capnp._DynamicStructReader]:
+  """First (or last) message of each of msg_types found in the logs, in a single pass"""
+  msg_types = set(msg_types)
+  found: dict[str, capnp._DynamicStructReader] = {}
+  for msg in lr:
+    which = msg.which()
+    if which in msg_types and (last or which not in found):
+      found[which] = msg
+      if not last and len(found) == len(msg_types):
+        break
+  return found
+
+
 def get_custom_params_from_lr(lr: LogIterable, initial_state: str = "first") -> dict[str, Any]:
   """
   Use this to get custom params dict based on provided logs.
@@ -577,27 +773,22 @@ def get_custom_params_from_lr(lr: LogIterable, initial_state: str = "first") ->
   The params may be based on first or last message of given type (carParams, liveCalibration, liveParameters, liveTorqueParameters) in the logs.
   """
 
-  car_params = [m for m in lr if m.which() == "carParams"]
-  live_calibration = [m for m in lr if m.which() == "liveCalibration"]
-  live_parameters = [m for m in lr if m.which() == "liveParameters"]
-  live_torque_parameters = [m for m in lr if m.which() == "liveTorqueParameters"]
-
   assert initial_state in ["first", "last"]
-  msg_index = 0 if initial_state == "first" else -1
+  msgs = get_first_msgs(lr, ["carParams", "liveCalibration", "liveParameters", "liveTorqueParameters"], last=initial_state == "last")
 
-  assert len(car_params) > 0, "carParams required for initial state of liveParameters and CarParamsPrevRoute"
-  CP = car_params[msg_index].carParams
+  assert "carParams" in msgs, "carParams required for initial state of liveParameters and CarParamsPrevRoute"
+  CP = msgs["carParams"].carParams
 
   custom_params = {
     "CarParamsPrevRoute": CP.as_builder().to_bytes()
   }
 
-  if len(live_calibration) > 0:
-    custom_params["CalibrationParams"] = live_calibration[msg_index].as_builder().to_bytes()
-  if len(live_parameters) > 0:
-    custom_params["LiveParametersV2"] = live_parameters[msg_index].as_builder().to_bytes()
-  if len(live_torque_parameters) > 0:
-    custom_params["LiveTorqueParameters"] = live_torque_parameters[msg_index].as_builder().to_bytes()
+  if "liveCalibration" in msgs:
+    custom_params["CalibrationParams"] = msgs["liveCalibration"].as_builder().to_bytes()
+  if "liveParameters" in msgs:
+    custom_params["LiveParametersV2"] = msgs["liveParameters"].as_builder().to_bytes()
+  if "liveTorqueParameters" in msgs:
+    custom_params["LiveTorqueParameters"] = msgs["liveTorqueParameters"].as_builder().to_bytes()
 
   return custom_params
 
@@ -616,7 +807,8 @@ def replay_process_with_name(name: str | Iterable[str], lr: LogIterable, *args,
 def replay_process(
   cfg: ProcessConfig | Iterable[ProcessConfig], lr: LogIterable, frs: dict[str, FrameReader] = None,
   fingerprint: str = None, return_all_logs: bool = False, custom_params: dict[str, Any] = None,
-  captured_output_store: dict[str, dict[str, str]] = None, disable_progress: bool = False
+  captured_output_store: dict[str, dict[str, str]] = None, disable_progress: bool = False, pipelined: bool = False,
+  stats_store: dict[str, dict[str, Any]] = None, profile_dir: str = None
 ) -> list[capnp._DynamicStructReader]:
   if isinstance(cfg, Iterable):
     cfgs = list(cfg)
@@ -627,7 +819,8 @@ def replay_process(
                          manager_states=True,
                          panda_states=any("pandaStates" in cfg.pubs for cfg in cfgs),
                          camera_states=any(len(cfg.vision_pubs) != 0 for cfg in cfgs))
-  process_logs = _replay_multi_process(cfgs, all_msgs, frs, fingerprint, custom_params, captured_output_store, disable_progress)
+  process_logs = _replay_multi_process(cfgs, all_msgs, frs, fingerprint, custom_params, captured_output_store, disable_progress, pipelined,
+                                       stats_store, profile_dir)
 
   if return_all_logs:
     keys = {m.which() for m in process_logs}
@@ -643,7 +836,8 @@ def replay_process(
 
 def _replay_multi_process(
   cfgs: list[ProcessConfig], lr: LogIterable, frs: dict[str, FrameReader] | None, fingerprint: str | None,
-  custom_params: dict[str, Any] | None, captured_output_store: dict[str, dict[str, str]] | None, disable_progress: bool
+  custom_params: dict[str, Any] | None, captured_output_store: dict[str, dict[str, str]] | None, disable_progress: bool,
+  pipelined: bool = False, stats_store: dict[str, dict[str, Any]] | None = None, profile_dir: str | None = None
 ) -> list[capnp._DynamicStructReader]:
   if fingerprint is not None:
     params_config = generate_params_config(lr=lr, fingerprint=fingerprint, custom_params=custom_params)
@@ -669,44 +863,65 @@ def _replay_multi_process(
     for cfg in cfgs:
       container = ProcessContainer(cfg)
       containers.append(container)
-      container.start(params_config, env_config, all_msgs, frs, fingerprint, captured_output_store is not None)
+      profile_path = os.path.join(profile_dir, f"{cfg.proc_name}.txt") if profile_dir is not None else None
+      container.start(params_config, env_config, all_msgs, frs, fingerprint, captured_output_store is not None, profile_path)
 
     all_pubs = {pub for container in containers for pub in container.pubs}
     all_subs = {sub for container in containers for sub in container.subs}
     lr_pubs = all_pubs - all_subs
-    pubs_to_containers = {pub: [container for container in containers if pub in container.pubs] for pub in all_pubs}
-
-    pub_msgs = [msg for msg in all_msgs if msg.which() in lr_pubs]
-    # external queue for messages taken from logs; internal queue for messages generated by processes, which will be republished
-    external_pub_queue: list[capnp._DynamicStructReader] = pub_msgs.copy()
-    internal_pub_queue: list[capnp._DynamicStructReader] = []
-    # heap for maintaining the order of messages generated by processes, where each element: (logMonoTime, index in internal_pub_queue)
-    internal_pub_index_heap: list[tuple[int, int]] = []
-
-    pbar = tqdm(total=len(external_pub_queue), disable=disable_progress)
-    while len(external_pub_queue) != 0 or (len(internal_pub_index_heap) != 0 and not all(c.has_empty_queue for c in containers)):
-      if len(internal_pub_index_heap) == 0 or (len(external_pub_queue) != 0 and external_pub_queue[0].logMonoTime < internal_pub_index_heap[0][0]):
-        msg = external_pub_queue.pop(0)
+
+    # in pipelined mode, processes that don't exchange messages with the others are fed on their own
+    feeders: list[PipelinedFeeder] = []
+    if pipelined:
+      for container in containers:
+        other_pubs = {pub for c in containers if c is not container for pub in c.pubs}
+        if container.cfg.pipelined and not (set(container.pubs) & all_subs) and not (set(container.subs) & other_pubs):
+          feeders.append(PipelinedFeeder(container, all_msgs))
+    pipelined_containers = [f.container for f in feeders]
+    lockstep_containers = [c for c in containers if c not in pipelined_containers]
+
+    lockstep_pubs = {pub for container in lockstep_containers for pub in container.pubs}
+    pubs_to_containers = {pub: [container for container in lockstep_containers if pub in container.pubs] for pub in lockstep_pubs}
+
+    # log messages are fed in order, messages generated by processes are republished in between by logMonoTime
+    scheduler = ReplayScheduler(msg for msg in all_msgs if msg.which() in lr_pubs & lockstep_pubs)
+
+    pbar = tqdm(total=scheduler.external_remaining + sum(len(f.queue) for f in feeders), disable=disable_progress)
+    while scheduler.external_remaining != 0 or \
+          (scheduler.internal_remaining != 0 and not all(c.has_empty_queue for c in lockstep_containers)):
+      pbar.update(_advance_pipelined(feeders, frs, PIPELINE_WINDOW, block=False))
+
+      msg, external = scheduler.pop()
+      if external:
         pbar.update(1)
-      else:
-        _, index = heapq.heappop(internal_pub_index_heap)
-        msg = internal_pub_queue[index]
 
       target_containers = pubs_to_containers[msg.which()]
       for container in target_containers:
         output_msgs = container.run_step(msg, frs)
         for m in output_msgs:
           if m.which() in all_pubs:
-            internal_pub_queue.append(m)
-            heapq.heappush(internal_pub_index_heap, (m.logMonoTime, len(internal_pub_queue) - 1))
+            scheduler.push(m)
         log_msgs.extend(output_msgs)
 
+    while not all(f.done for f in feeders):
+      pbar.update(_advance_pipelined(feeders, frs, PIPELINE_WINDOW, block=True))
+
     # flush last set of messages from each process
-    for container in containers:
+    for container in lockstep_containers:
       last_time = log_msgs[-1].logMonoTime if len(log_msgs) > 0 else int(time.monotonic() * 1e9)
       log_msgs.extend(container.get_output_msgs(last_time))
+
+    if len(feeders) != 0:
+      for feeder in feeders:
+        last_time = feeder.output_msgs[-1].logMonoTime if len(feeder.output_msgs) > 0 else int(time.monotonic() * 1e9)
+        feeder.output_msgs.extend(feeder.container.get_output_msgs(last_time))
+        log_msgs.extend(feeder.output_msgs)
+      # outputs were collected per process, restore their order across processes
+      log_msgs.sort(key=lambda m: m.logMonoTime)
   finally:
     for container in containers:
+      if stats_store is not None:
+        stats_store[container.cfg.proc_name] = container.get_stats()
       container.stop()
       if captured_output_store is not None:
         assert container.capture is not None
@@ -726,10 +941,9 @@ def generate_params_config(lr=None, CP=None, fingerprint=None, custom_params=Non
   if custom_params is not None:
     params_dict.update(custom_params)
   if lr is not None:
-    has_ublox = any(msg.which() == "ubloxGnss" for msg in lr)
-    params_dict["UbloxAvailable"] = has_ublox
-    is_rhd = next((msg.driverMonitoringState.isRHD for msg in lr if msg.which() == "driverMonitoringState"), False)
-    params_dict["IsRhdDetected"] = is_rhd
+    msgs = get_first_msgs(lr, ["ubloxGnss", "driverMonitoringState"])
+    params_dict["UbloxAvailable"] = "ubloxGnss" in msgs
+    params_dict["IsRhdDetected"] = msgs["driverMonitoringState"].driverMonitoringState.isRHD if "driverMonitoringState" in msgs else False
 
   if CP is not None:
     if fingerprint is None:
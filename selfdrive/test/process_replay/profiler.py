@@ -0,0 +1,82 @@
+import os
+import select
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from collections.abc import Callable
+
+from openpilot.common.utils import atomic_write
+
+
+class StackSampler:
+  """
+    Samples the Python stacks of every other thread of the current process at a fixed interval. Counts are kept
+    per collapsed stack ("outer;...;inner") and rewritten to path every flush_interval. Replay sends SIGTERM before
+    it kills a profiled process, and the sampler flushes and exits on it, so the last interval isn't lost.
+  """
+  def __init__(self, path: str, interval: float = 0.005, flush_interval: float = 1.0):
+    self.path = path
+    self.interval = interval
+    self.flush_interval = flush_interval
+    self.counts: Counter[str] = Counter()
+    self._wakeup_fd: int | None = None
+
+  def start(self) -> None:
+    # must be called from the main thread. the signal is handled by the sampler thread through the wakeup fd,
+    # since the main thread can be blocked in a C call when it arrives
+    r, w = os.pipe()
+    os.set_blocking(w, False)
+    signal.signal(signal.SIGTERM, lambda *args: None)
+    signal.set_wakeup_fd(w)
+    self._wakeup_fd = r
+    threading.Thread(target=self._run, daemon=True).start()
+
+  def sample(self) -> None:
+    me = threading.get_ident()
+    for tid, frame in sys._current_frames().items():
+      if tid == me:
+        continue
+      stack = []
+      while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+      self.counts[";".join(reversed(stack))] += 1
+
+  def flush(self) -> None:
+    with atomic_write(self.path, overwrite=True) as f:
+      f.writelines(f"{stack} {count}\n" for stack, count in self.counts.most_common())
+
+  def _run(self) -> None:
+    last_flush = time.monotonic()
+    while True:
+      ready, _, _ = select.select([self._wakeup_fd], [], [], self.interval)
+      if ready and signal.SIGTERM in os.read(self._wakeup_fd, 64):
+        self.flush()
+        os._exit(128 + signal.SIGTERM)
+      self.sample()
+      if time.monotonic() - last_flush > self.flush_interval:
+        self.flush()
+        last_flush = time.monotonic()
+
+
+def load_collapsed_stacks(path: str) -> Counter[str]:
+  counts: Counter[str] = Counter()
+  if os.path.exists(path):
+    with open(path) as f:
+      for line in f:
+        stack, count = line.rstrip("\n").rsplit(" ", 1)
+        counts[stack] += int(count)
+  return counts
+
+
+class LauncherWithProfiler:
+  def __init__(self, path: str, launcher: Callable):
+    self.path = path
+    self.launcher = launcher
+
+  def __call__(self, *args, **kwargs):
+    StackSampler(self.path).start()
+    self.launcher(*args, **kwargs)
@@ -0,0 +1,134 @@
+from cereal import log
+from openpilot.selfdrive.test.process_replay import compare_logs as compare_logs_module
+from openpilot.selfdrive.test.process_replay.compare_logs import EPSILON, compare_logs, diff_msgs
+from openpilot.tools.lib.logreader import LogReader, save_log
+
+
+def make_log(n=100, changes=None):
+  changes = changes or {}
+  msgs = []
+  for i in range(n):
+    msg = log.Event.new_message(logMonoTime=i * 10**7, valid=True)
+    if i % 3 == 0:
+      cs = msg.init('carState')
+      cs.vEgo = i / 3
+      cs.cumLagMs = i
+      cs.gearShifter = 'drive'
+      cs.buttonEvents = [{'type': 'accelCruise', 'pressed': bool(i % 2)}]
+      cs.wheelSpeeds.fl = i
+      cs.wheelSpeeds.fr = i + 1
+    elif i % 3 == 1:
+      ls = msg.init('longitudinalPlan')
+      ls.aTarget = i * 0.1
+      ls.processingDelay = i * 0.01
+      ls.speeds = [i, i + 1.]
+    else:
+      msg.init('sendcan', 1)[0].dat = bytes([i % 256])
+    if i in changes:
+      changes[i](msg)
+    msgs.append(msg.to_bytes())
+  return list(log.Event.read_multiple_bytes(b''.join(msgs)))
+
+
+def reference_diff(log1, log2, ignore_fields, tolerance):
+  return [d for m1, m2 in zip(log1, log2, strict=True) for d in diff_msgs(m1, m2, ignore_fields, tolerance)]
+
+
+class TestCompareLogs:
+  def test_matches_structural_diff(self):
+    changes = {
+      0: lambda m: setattr(m.carState, 'vEgo', 1.),
+      3: lambda m: setattr(m.carState, 'cumLagMs', 5.),  # ignored
+      4: lambda m: setattr(m.longitudinalPlan, 'aTarget', 0.4 + 1e-9),  # within tolerance
+      6: lambda m: setattr(m.carState, 'gearShifter', 'park'),
+      7: lambda m: setattr(m.longitudinalPlan, 'speeds', [7, 9.]),
+      9: lambda m: setattr(m, 'valid', False),
+      11: lambda m: setattr(m.sendcan[0], 'dat', b'\x00'),
+      12: lambda m: setattr(m, 'logMonoTime', 1),  # ignored
+      13: lambda m: setattr(m.longitudinalPlan, 'processingDelay', float('nan')),  # ignored
+      15: lambda m: setattr(m.carState.buttonEvents[0], 'pressed', False),
+    }
+    log1, log2 = make_log(), make_log(changes=changes)
+    ignore = ["logMonoTime", "carState.cumLagMs", "longitudinalPlan.processingDelay"]
+
+    for tolerance in (None, 1e-2):
+      diff = compare_logs(log1, log2, ignore, tolerance=tolerance)
+      assert diff == reference_diff(log1, log2, ignore, EPSILON if tolerance is None else tolerance)
+      assert len(diff) >= 6
+
+    assert compare_logs(log1, make_log(), ignore) == []
+
+  def test_nested_and_indexed_ignores(self):
+    changes = {
+      0: lambda m: setattr(m.carState.wheelSpeeds, 'fl', -1.),  # ignored
+      3: lambda m: setattr(m.carState.wheelSpeeds, 'fr', -1.),
+      6: lambda m: setattr(m.carState.buttonEvents[0], 'pressed', True),  # ignored
+      9: lambda m: setattr(m.carState.buttonEvents[0], 'type', 'decelCruise'),
+      12: lambda m: setattr(m.carState.wheelSpeeds, 'fl', 12 + 1e-9),  # ignored, and within tolerance
+      15: lambda m: setattr(m.carState.wheelSpeeds, 'fr', 16 + 1e-9),  # within tolerance
+      7: lambda m: setattr(m.longitudinalPlan, 'speeds', [0., 1.]),  # ignored
+      10: lambda m: m.longitudinalPlan.speeds.__setitem__(0, 0.),
+      11: lambda m: setattr(m.sendcan[0], 'dat', b'\x00'),
+    }
+    log1, log2 = make_log(), make_log(changes=changes)
+
+    for ignore in (["carState.wheelSpeeds.fl"], ["carState.buttonEvents.0.pressed"], ["longitudinalPlan.speeds"],
+                   ["logMonoTime", "carState.wheelSpeeds.fl", "carState.buttonEvents.0.pressed", "longitudinalPlan.speeds"]):
+      for tolerance in (None, 1e-6):
+        diff = compare_logs(log1, log2, ignore, tolerance=tolerance)
+        assert diff == reference_diff(log1, log2, ignore, EPSILON if tolerance is None else tolerance)
+        paths = {str(d[1]) for d in diff}
+        assert "carState.wheelSpeeds.fr" in paths
+        assert ("carState.wheelSpeeds.fl" in paths) == ("carState.wheelSpeeds.fl" not in ignore)
+
+  def test_unions(self):
+    def make_controls_log(changes=None):
+      changes = changes or {}
+      msgs = []
+      for i in range(30):
+        msg = log.Event.new_message(logMonoTime=i * 10**7, valid=True)
+        cs = msg.init('controlsState')
+        cs.curvature = i * 0.01
+        cs.lateralControlState.init('pidState').steeringAngleDeg = i
+        if i in changes:
+          changes[i](msg)
+        msgs.append(msg.to_bytes())
+      return list(log.Event.read_multiple_bytes(b''.join(msgs)))
+
+    changes = {
+      3: lambda m: m.controlsState.lateralControlState.init('angleState'),  # a different union member
+      6: lambda m: setattr(m.controlsState.lateralControlState.init('angleState'), 'steeringAngleDeg', 6),
+      9: lambda m: setattr(m.controlsState.lateralControlState.pidState, 'steeringAngleDeg', 9 + 1e-5),
+      12: lambda m: setattr(m.controlsState, 'curvature', 0.12 + 1e-9),  # within tolerance
+    }
+    log1, log2 = make_controls_log(), make_controls_log(changes=changes)
+    for tolerance in (None, 1e-3):
+      diff = compare_logs(log1, log2, ["logMonoTime"], tolerance=tolerance)
+      assert diff == reference_diff(log1, log2, ["logMonoTime"], EPSILON if tolerance is None else tolerance)
+      assert len(diff) >= 2
+
+  def test_serialized_events(self, tmp_path, mocker):
+    # ref logs are read back with their serialized bytes, new ones are replay outputs
+    changes = {
+      0: lambda m: setattr(m.carState, 'vEgo', 1e-9),  # within tolerance
+      3: lambda m: setattr(m.carState, 'cumLagMs', 5.),  # ignored
+      6: lambda m: setattr(m.carState, 'vEgo', 1.),
+      9: lambda m: setattr(m.carState.wheelSpeeds, 'fr', 1.),
+      11: lambda m: setattr(m.sendcan[0], 'dat', b'\x00'),
+    }
+    ref_path = str(tmp_path / "ref.zst")
+    save_log(ref_path, make_log())
+    log1 = list(LogReader(ref_path))
+    log2 = [m.as_builder().as_reader() for m in make_log(changes=changes)]
+    ignore = ["logMonoTime", "carState.cumLagMs"]
+
+    columns_spy = mocker.spy(compare_logs_module, "columns_may_differ")
+    diff = compare_logs(log1, log2, ignore, tolerance=1e-6)
+    assert diff == reference_diff(log1, log2, ignore, 1e-6)
+    assert {str(d[1]) for d in diff} == {"carState.vEgo", "carState.wheelSpeeds.fr", "['sendcan', 0, 'dat']"}
+    # only messages with differences behind a pointer need every field in columns
+    assert sum(len(call.args[0]) for call in columns_spy.call_args_list) == 2
+
+    columns_spy.reset_mock()
+    assert compare_logs(log1, [m.as_builder().as_reader() for m in make_log()], ignore) == []
+    assert columns_spy.call_count == 0
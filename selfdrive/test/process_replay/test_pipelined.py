@@ -0,0 +1,31 @@
+from parameterized import parameterized
+
+from openpilot.selfdrive.test.process_replay.compare_logs import compare_logs
+from openpilot.selfdrive.test.process_replay.process_replay import CONFIGS, replay_process
+from openpilot.selfdrive.test.process_replay.test_processes import get_log_data, segments
+from openpilot.tools.lib.logreader import LogReader
+
+TESTED_SEGMENT = segments[0][1]
+PIPELINED_CONFIGS = [(cfg.proc_name, cfg) for cfg in CONFIGS if cfg.pipelined]
+
+
+class TestPipelinedReplay:
+  @classmethod
+  def setup_class(cls):
+    _, dat = get_log_data(TESTED_SEGMENT)
+    cls.lr = list(LogReader.from_bytes(dat))
+
+  @parameterized.expand(PIPELINED_CONFIGS)
+  def test_matches_lockstep(self, proc_name, cfg):
+    lockstep_msgs = replay_process(cfg, self.lr, disable_progress=True)
+    pipelined_msgs = replay_process(cfg, self.lr, disable_progress=True, pipelined=True)
+    assert compare_logs(lockstep_msgs, pipelined_msgs, cfg.ignore) == [], f"pipelined {proc_name} differs from lockstep"
+
+  def test_independent_processes(self):
+    # fed side by side, each process' outputs are the same as when replayed on its own
+    cfgs = [cfg for _, cfg in PIPELINED_CONFIGS if cfg.proc_name in ("radard", "dmonitoringd")]
+    pipelined_msgs = replay_process(cfgs, self.lr, disable_progress=True, pipelined=True)
+    for cfg in cfgs:
+      lockstep_msgs = replay_process(cfg, self.lr, disable_progress=True)
+      own_msgs = [m for m in pipelined_msgs if m.which() in cfg.subs]
+      assert compare_logs(lockstep_msgs, own_msgs, cfg.ignore) == [], f"pipelined {cfg.proc_name} differs from lockstep"
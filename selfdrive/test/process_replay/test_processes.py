@@ -3,7 +3,10 @@ import argparse
 import concurrent.futures
 import os
 import sys
+import tempfile
+import time
 from collections import defaultdict
+from functools import lru_cache
 from tqdm import tqdm
 from typing import Any
 
@@ -94,10 +97,10 @@ def handle_output_file(cur_log_fn, local):
 
 
 def run_test_process(data):
-  segment, cfg, args, cur_log_fn, ref_log_path, lr_dat = data
+  segment, cfg, args, cur_log_fn, ref_log_path, log_path = data
   res = None
   if not args.upload_only:
-    lr = LogReader.from_bytes(lr_dat)
+    lr = load_log(log_path)
     res, log_msgs = test_process(cfg, lr, segment, ref_log_path, cur_log_fn, args.ignore_fields, args.ignore_msgs)
     # save logs so we can upload when updating refs
     save_log(cur_log_fn, log_msgs)
@@ -115,6 +118,21 @@ def get_log_data(segment):
     return (segment, f.read())
 
 
+def download_log(segment, outdir):
+  segment, dat = get_log_data(segment)
+  path = os.path.join(outdir, f"{segment}.zst")
+  with open(path, "wb") as f:
+    f.write(dat)
+  return (segment, path)
+
+
+@lru_cache(maxsize=4)
+def load_log(path):
+  # pool workers replay several processes on the same segments, only parse each one once per worker.
+  # every task in the worker gets the same object, so it can't be a list one of them could change
+  return tuple(LogReader(path))
+
+
 def test_process(cfg, lr, segment, ref_log_path, new_log_path, ignore_fields=None, ignore_msgs=None):
   if ignore_fields is None:
     ignore_fields = []
@@ -233,14 +251,16 @@ if __name__ == "__main__":
     untested = (set(interface_names) - set(excluded_interfaces)) - {c.lower() for c in tested_cars}
     assert len(untested) == 0, f"Cars missing routes: {str(untested)}"
 
+  st = time.monotonic()
   log_paths: defaultdict[str, dict[str, dict[str, str]]] = defaultdict(lambda: defaultdict(dict))
-  with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
+  # logs are handed to the workers as local files rather than pickled with every (segment, process) pair
+  with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool, tempfile.TemporaryDirectory() as log_dir:
     if not args.upload_only:
       download_segments = [seg for car, seg in segments if car in tested_cars]
-      log_data: dict[str, LogReader] = {}
-      p1 = pool.map(get_log_data, download_segments)
-      for segment, lr in tqdm(p1, desc="Getting Logs", total=len(download_segments)):
-        log_data[segment] = lr
+      log_data: dict[str, str] = {}
+      p1 = pool.map(download_log, download_segments, [log_dir] * len(download_segments))
+      for segment, log_path in tqdm(p1, desc="Getting Logs", total=len(download_segments)):
+        log_data[segment] = log_path
 
     pool_args: Any = []
     for car_brand, segment in segments:
@@ -274,6 +294,7 @@ if __name__ == "__main__":
       if not args.upload_only:
         results[segment][proc] = result
 
+  print(f"Ran {len(pool_args)} process replays with {args.jobs} jobs in {time.monotonic() - st:.1f}s")
   diff_short, diff_long, failed = format_diff(results, log_paths, ref_commit)
   if not upload:
     with open(os.path.join(PROC_REPLAY_DIR, "diff.txt"), "w") as f:
@@ -0,0 +1,48 @@
+import multiprocessing
+import os
+import signal
+import time
+
+from openpilot.selfdrive.test.process_replay.profiler import StackSampler, load_collapsed_stacks
+
+
+def profiled_spin(path: str, ready):
+  StackSampler(path, flush_interval=60.).start()
+  ready.set()
+  while True:
+    sum(range(1000))
+
+
+def profiled_block(path: str, ready):
+  StackSampler(path, flush_interval=60.).start()
+  ready.set()
+  # blocked in a C call, the signal still gets to the sampler thread
+  multiprocessing.Event().wait()
+
+
+class TestStackSampler:
+  def run_until_sigterm(self, tmp_path, target):
+    path = str(tmp_path / "profile.txt")
+    ready = multiprocessing.Event()
+    proc = multiprocessing.Process(target=target, args=(path, ready))
+    proc.start()
+    try:
+      assert ready.wait(10)
+      # long before the first periodic flush
+      time.sleep(0.2)
+      assert not os.path.exists(path)
+      os.kill(proc.pid, signal.SIGTERM)
+      proc.join(10)
+      assert proc.exitcode == 128 + signal.SIGTERM
+    finally:
+      proc.kill()
+      proc.join()
+    return load_collapsed_stacks(path)
+
+  def test_flush_on_sigterm(self, tmp_path):
+    stacks = self.run_until_sigterm(tmp_path, profiled_spin)
+    assert sum(count for stack, count in stacks.items() if "profiled_spin" in stack) > 0
+
+  def test_flush_on_sigterm_blocked(self, tmp_path):
+    stacks = self.run_until_sigterm(tmp_path, profiled_block)
+    assert sum(count for stack, count in stacks.items() if "profiled_block" in stack) > 0
@@ -17,11 +17,11 @@ TESTED_SEGMENTS = [
 def ci_setup_data_readers(route, sidx):
   lr = LogReader(get_url(route, sidx, "rlog.bz2"))
   frs = {
-    'roadCameraState': FrameReader(get_url(route, sidx, "fcamera.hevc")),
-    'driverCameraState': FrameReader(get_url(route, sidx, "fcamera.hevc")),
+    'roadCameraState': FrameReader(get_url(route, sidx, "fcamera.hevc"), pix_fmt="nv12"),
+    'driverCameraState': FrameReader(get_url(route, sidx, "fcamera.hevc"), pix_fmt="nv12"),
   }
   if next((True for m in lr if m.which() == "wideRoadCameraState"), False):
-    frs["wideRoadCameraState"] = FrameReader(get_url(route, sidx, "ecamera.hevc"))
+    frs["wideRoadCameraState"] = FrameReader(get_url(route, sidx, "ecamera.hevc"), pix_fmt="nv12")
 
   return lr, frs
 
@@ -34,10 +34,13 @@ def available_streams(lr=None):
   if lr is None:
     return [VideoStreamMeta(*meta) for meta in VIPC_STREAM_METADATA]
 
-  result = []
-  for meta in VIPC_STREAM_METADATA:
-    has_cam_state = next((True for m in lr if m.which() == meta[0]), False)
-    if has_cam_state:
-      result.append(VideoStreamMeta(*meta))
-
-  return result
+  # one pass over the logs for all camera states
+  camera_states = {meta[0] for meta in VIPC_STREAM_METADATA}
+  seen = set()
+  for m in lr:
+    if m.which() in camera_states:
+      seen.add(m.which())
+      if len(seen) == len(camera_states):
+        break
+
+  return [VideoStreamMeta(*meta) for meta in VIPC_STREAM_METADATA if meta[0] in seen]
@@ -4,50 +4,65 @@ Copyright (c) 2021-, Haibin Wen, sunnypilot, and a number of other contributors.
 This file is part of sunnypilot and is licensed under the MIT License.
 See the LICENSE.md file in the root directory for more details.
 """
+import hashlib
+import json
 import os
 import tomllib
 from difflib import SequenceMatcher
 
 from opendbc.car import structs
 from openpilot.common.basedir import BASEDIR
+from openpilot.common.utils import atomic_write
+from openpilot.system.hardware.hw import Paths
 
 TORQUE_NN_MODEL_PATH = os.path.join(BASEDIR, "sunnypilot", "neural_network_data", "neural_network_lateral_control")
 TORQUE_NN_MODEL_SUBSTITUTE_PATH = os.path.join(BASEDIR, "opendbc", "car", "torque_data/substitute.toml")
 MOCK_MODEL_PATH = os.path.join(TORQUE_NN_MODEL_PATH, "MOCK.json")
+NN_MODEL_INDEX_FILE = "model_index.json"
 
 
 def similarity(s1: str, s2: str) -> float:
   return SequenceMatcher(None, s1, s2).ratio()
 
 
-def get_nn_model_path(CP: structs.CarParams) -> tuple[str, str, bool]:
-  car_fingerprint = CP.carFingerprint
-  eps_fw = str(next((fw.fwVersion for fw in CP.carFw if fw.ecu == "eps"), ""))
+def get_nn_model_names() -> list[str]:
+  return [os.path.splitext(f)[0] for f in os.listdir(TORQUE_NN_MODEL_PATH) if f.endswith(".json")]
+
+
+def find_nn_model(candidate: str, model_names: list[str]) -> tuple[str | None, float]:
+  """ Most similar model to candidate, the first one on ties. Same as comparing similarity() against every model """
+  if candidate in model_names:
+    return os.path.join(TORQUE_NN_MODEL_PATH, f"{candidate}.json"), 1.0
+
+  matcher = SequenceMatcher(None)
+  matcher.set_seq2(candidate)
+  best_model, max_similarity = None, -1.0
+  for model in model_names:
+    matcher.set_seq1(model)
+    # ratio() is bounded by these cheap estimates, so models that can't beat the best so far are skipped
+    if matcher.real_quick_ratio() <= max_similarity or matcher.quick_ratio() <= max_similarity:
+      continue
+    similarity_score = matcher.ratio()
+    if similarity_score > max_similarity:
+      best_model, max_similarity = model, similarity_score
 
-  def check_nn_path(_nn_candidate):
-    _model_path = None
-    _max_similarity = -1.0
-    for f in os.listdir(TORQUE_NN_MODEL_PATH):
-      if f.endswith(".json"):
-        model = os.path.splitext(f)[0]
-        similarity_score = similarity(model, _nn_candidate)
-        if similarity_score > _max_similarity:
-          _max_similarity = similarity_score
-          _model_path = os.path.join(TORQUE_NN_MODEL_PATH, f)
-    return _model_path, _max_similarity
+  model_path = os.path.join(TORQUE_NN_MODEL_PATH, f"{best_model}.json") if best_model is not None else None
+  return model_path, max_similarity
 
+
+def resolve_nn_model(car_fingerprint: str, eps_fw: str, model_names: list[str]) -> tuple[str, bool]:
   if len(eps_fw) > 3:
     eps_fw = eps_fw.replace("\\", "")
     nn_candidate = f"{car_fingerprint} {eps_fw}"
   else:
     nn_candidate = car_fingerprint
 
-  model_path, max_similarity = check_nn_path(nn_candidate)
+  model_path, max_similarity = find_nn_model(nn_candidate, model_names)
   exact_match = max_similarity >= 0.99
 
   if car_fingerprint not in model_path or 0.0 <= max_similarity < 0.9:
     nn_candidate = car_fingerprint
-    model_path, max_similarity = check_nn_path(nn_candidate)
+    model_path, max_similarity = find_nn_model(nn_candidate, model_names)
     exact_match = max_similarity >= 0.99
 
     if 0.0 <= max_similarity < 0.9:
@@ -56,10 +71,67 @@ def get_nn_model_path(CP: structs.CarParams) -> tuple[str, str, bool]:
       sub_candidate = sub.get(car_fingerprint, car_fingerprint)
 
       for candidate in [car_fingerprint, sub_candidate]:
-        model_path, max_similarity = check_nn_path(candidate)
+        model_path, max_similarity = find_nn_model(candidate, model_names)
 
       exact_match = False
 
+  return model_path, exact_match
+
+
+def nn_model_index_signature(model_names: list[str]) -> str:
+  # the index is stale once a model or substitution is added, removed or changed
+  try:
+    st = os.stat(TORQUE_NN_MODEL_SUBSTITUTE_PATH)
+    substitutes = [st.st_mtime_ns, st.st_size]
+  except OSError:
+    substitutes = None
+  key = [TORQUE_NN_MODEL_PATH, sorted(model_names), substitutes]
+  return hashlib.sha256(json.dumps(key).encode()).hexdigest()
+
+
+def load_nn_model_index(signature: str) -> dict[str, list]:
+  try:
+    with open(os.path.join(Paths.nnlc_cache_root(), NN_MODEL_INDEX_FILE)) as f:
+      index = json.load(f)
+    if index["signature"] == signature:
+      return index["models"]
+  except (OSError, ValueError, KeyError):
+    pass
+  return {}
+
+
+def save_nn_model_index(signature: str, models: dict[str, list]) -> None:
+  cache_root = Paths.nnlc_cache_root()
+  try:
+    os.makedirs(cache_root, exist_ok=True)
+    with atomic_write(os.path.join(cache_root, NN_MODEL_INDEX_FILE), overwrite=True) as f:
+      json.dump({"signature": signature, "models": models}, f)
+  except OSError:
+    pass
+
+
+def lookup_nn_model(car_fingerprint: str, eps_fw: str) -> tuple[str, bool]:
+  """ resolve_nn_model, through an index of previous lookups kept in the nnlc cache """
+  model_names = get_nn_model_names()
+  signature = nn_model_index_signature(model_names)
+  models = load_nn_model_index(signature)
+
+  key = f"{car_fingerprint}|{eps_fw}"
+  if key not in models:
+    model_path, exact_match = resolve_nn_model(car_fingerprint, eps_fw, model_names)
+    models[key] = [os.path.basename(model_path), exact_match]
+    save_nn_model_index(signature, models)
+
+  model_file, exact_match = models[key]
+  return os.path.join(TORQUE_NN_MODEL_PATH, model_file), exact_match
+
+
+def get_nn_model_path(CP: structs.CarParams) -> tuple[str, str, bool]:
+  car_fingerprint = CP.carFingerprint
+  eps_fw = str(next((fw.fwVersion for fw in CP.carFw if fw.ecu == "eps"), ""))
+
+  model_path, exact_match = lookup_nn_model(car_fingerprint, eps_fw)
+
   if CP.steerControlType == structs.CarParams.SteerControlType.angle:
     model_path = MOCK_MODEL_PATH
 
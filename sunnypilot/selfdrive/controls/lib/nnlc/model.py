@@ -4,38 +4,84 @@ Copyright (c) 2021-, Haibin Wen, sunnypilot, and a number of other contributors.
 This file is part of sunnypilot and is licensed under the MIT License.
 See the LICENSE.md file in the root directory for more details.
 """
+import os
 from json import load
 import numpy as np
 
+from openpilot.common.utils import atomic_write
 from openpilot.selfdrive.modeld.parse_model_outputs import safe_exp
+from openpilot.system.hardware.hw import Paths
 
 # dict used to rename activation functions whose names aren't valid python identifiers
 ACTIVATION_FUNCTION_NAMES = {'σ': 'sigmoid'}
 
 
+def load_model_params(params_file):
+  """
+  Model params with the weights as float32 arrays. Read from a binary copy in the nnlc cache while it's
+  up to date with the json, otherwise parsed from the json and cached again.
+  """
+  cache_file = os.path.join(Paths.nnlc_cache_root(), os.path.splitext(os.path.basename(params_file))[0] + ".npz")
+  st = os.stat(params_file)
+  source = np.array([os.path.abspath(params_file), str(st.st_mtime_ns), str(st.st_size)])
+
+  # a missing, stale or unreadable cache (truncated, not a zip, bad members) is parsed again and overwritten
+  try:
+    with open(cache_file, "rb") as f, np.load(f, allow_pickle=False) as cache:
+      if np.array_equal(cache["source"], source):
+        return {k: cache[k] for k in cache.files}
+  except Exception:
+    pass
+
+  with open(params_file) as f:
+    params = load(f)
+
+  arrays = {
+    "source": source,
+    "input_size": np.array(params["input_size"]),
+    "output_size": np.array(params["output_size"]),
+    "input_mean": np.array(params["input_mean"], dtype=np.float32).T,
+    "input_std": np.array(params["input_std"], dtype=np.float32).T,
+    "activations": np.array([layer_params["activation"] for layer_params in params["layers"]]),
+  }
+  for i, layer_params in enumerate(params["layers"]):
+    arrays[f"W_{i}"] = np.array(layer_params[next(key for key in layer_params.keys() if key.endswith('_W'))], dtype=np.float32).T
+    arrays[f"b_{i}"] = np.array(layer_params[next(key for key in layer_params.keys() if key.endswith('_b'))], dtype=np.float32).T
+
+  try:
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    with atomic_write(cache_file, mode="wb", overwrite=True) as f:
+      np.savez(f, **arrays)
+  except OSError:
+    pass
+
+  return arrays
+
+
 class NNTorqueModel:
   def __init__(self, params_file, zero_bias=False):
-    with open(params_file) as f:
-      params = load(f)
+    params = load_model_params(params_file)
 
-    self.input_size = params["input_size"]
-    self.output_size = params["output_size"]
-    self.input_mean = np.array(params["input_mean"], dtype=np.float32).T
-    self.input_std = np.array(params["input_std"], dtype=np.float32).T
+    self.input_size = int(params["input_size"])
+    self.output_size = int(params["output_size"])
+    self.input_mean = params["input_mean"]
+    self.input_std = params["input_std"]
     self.layers = []
     self.friction_override = False
 
-    for layer_params in params["layers"]:
-      W = np.array(layer_params[next(key for key in layer_params.keys() if key.endswith('_W'))], dtype=np.float32).T
-      b = np.array(layer_params[next(key for key in layer_params.keys() if key.endswith('_b'))], dtype=np.float32).T
+    for i, activation in enumerate(params["activations"].tolist()):
+      W = params[f"W_{i}"]
+      b = params[f"b_{i}"]
       if zero_bias:
         b = np.zeros_like(b)
-      activation = layer_params["activation"]
       for k, v in ACTIVATION_FUNCTION_NAMES.items():
         activation = activation.replace(k, v)
       self.layers.append((W, b, activation))
 
     self.validate_layers()
+    # resolve activations and lay out weights once, forward is then just matmuls on preloaded contiguous arrays
+    self.compiled_layers = [(np.ascontiguousarray(W), np.ascontiguousarray(b), getattr(self, activation)) for W, b, activation in self.layers]
+    self.input_buffer = np.zeros((0, self.input_size), dtype=np.float32)
     self.check_for_friction_override()
 
   # Begin activation functions.
@@ -50,28 +96,34 @@ class NNTorqueModel:
   # End activation functions
 
   def forward(self, x):
-    for W, b, activation in self.layers:
-      x = getattr(self, activation)(x.dot(W) + b)
+    for W, b, activation in self.compiled_layers:
+      x = activation(x.dot(W) + b)
     return x
 
   def evaluate(self, input_array):
-    in_len = len(input_array)
-    if in_len != self.input_size:
+    return float(self.evaluate_batch([input_array])[0])
+
+  def evaluate_batch(self, input_arrays):
+    """ Evaluates a list of inputs in a single forward pass, returning the first output of each """
+    if len(self.input_buffer) < len(input_arrays):
+      self.input_buffer = np.zeros((len(input_arrays), self.input_size), dtype=np.float32)
+    batch = self.input_buffer[:len(input_arrays)]
+
+    for row, input_array in zip(batch, input_arrays, strict=True):
+      in_len = len(input_array)
       # If the input is length 2-4, then it's a simplified evaluation.
       # In that case, need to add on zeros to fill out the input array to match the correct length.
-      if 2 <= in_len:
-        input_array = input_array + [0] * (self.input_size - in_len)
-      else:
-        raise ValueError(f"Input array length {len(input_array)} must be length 2 or greater")
-
-    input_array = np.array(input_array, dtype=np.float32)
+      if in_len < 2:
+        raise ValueError(f"Input array length {in_len} must be length 2 or greater")
+      if in_len > self.input_size:
+        raise ValueError(f"Input array length {in_len} must be at most {self.input_size}")
+      row[:in_len] = input_array
+      row[in_len:] = 0.0
 
     # Rescale the input array using the input_mean and input_std
-    input_array = (input_array - self.input_mean) / self.input_std
-
-    output_array = self.forward(input_array)
+    output_array = self.forward((batch - self.input_mean) / self.input_std)
 
-    return float(output_array[0, 0])
+    return output_array[:, 0]
 
   def validate_layers(self):
     for _, _, activation in self.layers:
@@ -130,9 +130,6 @@ class NeuralNetworkLateralControl(LatControlTorqueExtBase):
     nnff_measurement_input = [CS.vEgo, self._measurement, self.lateral_jerk_measurement, roll] \
                              + [self._measurement] * self.past_future_len \
                              + past_rolls + future_rolls
-    torque_from_setpoint = self.model.evaluate(nnff_setpoint_input)
-    torque_from_measurement = self.model.evaluate(nnff_measurement_input)
-    self._pid_log.error = torque_from_setpoint - torque_from_measurement
 
     # The "pure" NNLC error response can be too weak for cars whose models were trained
     # with a lack of high-magnitude lateral acceleration data, for which the NNLC model
@@ -143,19 +140,27 @@ class NeuralNetworkLateralControl(LatControlTorqueExtBase):
     # accuracy for cars that don't have this issue, but it's necessary until a better NNLC model
     # structure is used that doesn't create this issue when high-magnitude data is missing.
     error_blend_factor = float(np.interp(abs(self._desired_lateral_accel), [1.0, 2.0], [0.0, 1.0]))
-    if error_blend_factor > 0.0:  # blend in stronger error response when in high lat accel
-      # NNFF inputs 5+ are optional, and if left out are replaced with 0.0 inside the NNFF class
-      nnff_error_input = [CS.vEgo, self._setpoint - self._measurement, self.lateral_jerk_setpoint - self.lateral_jerk_measurement, 0.0]
-      torque_from_error = self.model.evaluate(nnff_error_input)
-      if sign(self._pid_log.error) == sign(torque_from_error) and abs(self._pid_log.error) < abs(torque_from_error):
-        self._pid_log.error = self._pid_log.error * (1.0 - error_blend_factor) + torque_from_error * error_blend_factor
+    # NNFF inputs 5+ are optional, and if left out are replaced with 0.0 inside the NNFF class
+    nnff_error_input = [CS.vEgo, self._setpoint - self._measurement, self.lateral_jerk_setpoint - self.lateral_jerk_measurement, 0.0]
 
     # compute feedforward (same as nn setpoint output)
     friction_input = self.update_friction_input(self._setpoint, self._measurement)
     nn_input = [CS.vEgo, self._desired_lateral_accel, friction_input, roll] \
                + past_lateral_accels_desired + future_planned_lateral_accels \
                + past_rolls + future_rolls
-    self._ff = self.model.evaluate(nn_input)
+
+    # all model queries of this frame in a single forward pass
+    model_inputs = [nnff_setpoint_input, nnff_measurement_input, nn_input]
+    if error_blend_factor > 0.0:  # blend in stronger error response when in high lat accel
+      model_inputs.append(nnff_error_input)
+    torques = self.model.evaluate_batch(model_inputs).tolist()
+    torque_from_setpoint, torque_from_measurement, self._ff = torques[:3]
+
+    self._pid_log.error = torque_from_setpoint - torque_from_measurement
+    if error_blend_factor > 0.0:
+      torque_from_error = torques[3]
+      if sign(self._pid_log.error) == sign(torque_from_error) and abs(self._pid_log.error) < abs(torque_from_error):
+        self._pid_log.error = self._pid_log.error * (1.0 - error_blend_factor) + torque_from_error * error_blend_factor
 
     # apply friction override for cars with low NN friction response
     if self.model.friction_override:
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from openpilot.sunnypilot.selfdrive.controls.lib.nnlc.model import NNTorqueModel
+from openpilot.sunnypilot.selfdrive.controls.lib.nnlc.tests.test_model import write_model
+
+
+def time_tick(model: NNTorqueModel, inputs: list[list[float]], n: int, batched: bool) -> float:
+  st = time.monotonic()
+  for _ in range(n):
+    if batched:
+      model.evaluate_batch(inputs)
+    else:
+      for input_array in inputs:
+        model.evaluate(input_array)
+  return (time.monotonic() - st) / n
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Per control tick cost of the NNLC torque model")
+  parser.add_argument("-n", type=int, default=10000, help="number of ticks")
+  args = parser.parse_args()
+
+  with tempfile.TemporaryDirectory() as tmp:
+    model = NNTorqueModel(write_model(f"{tmp}/model.json"))
+
+  # setpoint, measurement, feedforward and error inputs of one update_neural_network_feedforward call
+  inputs = [np.random.rand(model.input_size).tolist() for _ in range(3)] + [np.random.rand(4).tolist()]
+  for batched in (False, True):
+    print(f"{'batched' if batched else 'one by one':>10}: {time_tick(model, inputs, args.n, batched) * 1e6:.2f} us per tick")
@@ -1,3 +1,5 @@
+import os
+
 from parameterized import parameterized
 
 from opendbc.car.car_helpers import interfaces
@@ -8,6 +10,9 @@ from opendbc.car.toyota.values import CAR as TOYOTA
 from opendbc.car.tesla.values import CAR as TESLA
 from openpilot.common.params import Params
 from openpilot.sunnypilot.selfdrive.car import interfaces as sunnypilot_interfaces
+from openpilot.sunnypilot.selfdrive.controls.lib.nnlc.helpers import NN_MODEL_INDEX_FILE, find_nn_model, lookup_nn_model, \
+                                                                   resolve_nn_model, get_nn_model_names, similarity
+from openpilot.system.hardware.hw import Paths
 
 
 FINGERPRINT_EXACT_MATCH = [HONDA.HONDA_CIVIC_BOSCH, TOYOTA.TOYOTA_RAV4_TSS2_2022, HYUNDAI.HYUNDAI_IONIQ_5]
@@ -42,3 +47,22 @@ class TestNNLCFingerprintBase:
   def test_no_fingerprint(self, car_name):
     CI = self._setup_platform(car_name)
     assert CI.CP_SP.neuralNetworkLateralControl.model.name == "MOCK"
+
+
+def test_find_nn_model():
+  model_names = ["TOYOTA_RAV4_TSS2", "TOYOTA_RAV4_TSS2_2022", "HYUNDAI_IONIQ_5", "HYUNDAI_IONIQ_6", "KIA_EV6",
+                 "HONDA_CIVIC_BOSCH b'39990-TGG-A120'", "HONDA_CIVIC_BOSCH", "GENESIS_G70"]
+  for candidate in ["TOYOTA_RAV4_TSS2_2023", "HYUNDAI_IONIQ_5", "HONDA_CIVIC_BOSCH b'39990-TGG-A020'", "KIA_EV9", "GENESIS_G70_2020", ""]:
+    scores = [similarity(model, candidate) for model in model_names]
+    model_path, max_similarity = find_nn_model(candidate, model_names)
+    assert max_similarity == max(scores)
+    assert model_path.endswith(f"/{model_names[scores.index(max(scores))]}.json")
+
+
+def test_model_index_cache_root(tmp_path, monkeypatch):
+  # the index goes wherever the nnlc cache is at lookup time
+  monkeypatch.setattr(Paths, "nnlc_cache_root", staticmethod(lambda: str(tmp_path)))
+  expected = resolve_nn_model(HONDA.HONDA_CIVIC_BOSCH, "", get_nn_model_names())
+  assert lookup_nn_model(HONDA.HONDA_CIVIC_BOSCH, "") == expected
+  assert os.listdir(tmp_path) == [NN_MODEL_INDEX_FILE]
+  assert lookup_nn_model(HONDA.HONDA_CIVIC_BOSCH, "") == expected
@@ -0,0 +1,87 @@
+import io
+import json
+import os
+
+import numpy as np
+import pytest
+
+from openpilot.system.hardware.hw import Paths
+from openpilot.sunnypilot.selfdrive.controls.lib.nnlc.model import NNTorqueModel
+
+
+def write_model(path, layer_sizes=(18, 32, 32, 32, 1), seed=0):
+  rng = np.random.default_rng(seed)
+  layers = []
+  for i, (n_in, n_out) in enumerate(zip(layer_sizes[:-1], layer_sizes[1:], strict=True)):
+    layers.append({
+      f"dense_{i}_W": rng.normal(0, 1 / np.sqrt(n_in), (n_out, n_in)).tolist(),
+      f"dense_{i}_b": rng.normal(0, 0.1, (n_out, 1)).tolist(),
+      "activation": "identity" if i == len(layer_sizes) - 2 else "σ",
+    })
+  params = {
+    "input_size": layer_sizes[0],
+    "output_size": layer_sizes[-1],
+    "input_mean": rng.normal(0, 1, (layer_sizes[0], 1)).tolist(),
+    "input_std": rng.uniform(0.5, 2, (layer_sizes[0], 1)).tolist(),
+    "layers": layers,
+  }
+  with open(path, "w") as f:
+    json.dump(params, f)
+  return path
+
+
+def reference_evaluate(model, input_array):
+  # unbatched evaluation, one input at a time
+  input_array = np.array(input_array + [0] * (model.input_size - len(input_array)), dtype=np.float32)
+  x = ((input_array - model.input_mean) / model.input_std)
+  for W, b, activation in model.layers:
+    x = getattr(model, activation)(x.dot(W) + b)
+  return float(x[0, 0])
+
+
+class TestNNTorqueModel:
+  def test_batch_matches_single(self, tmp_path):
+    model = NNTorqueModel(write_model(tmp_path / "model.json"))
+    rng = np.random.default_rng(1)
+    inputs = [rng.normal(0, 2, n).tolist() for n in (18, 18, 18, 4, 2)]
+
+    outputs = model.evaluate_batch(inputs)
+    assert outputs.shape == (len(inputs),)
+    for input_array, output in zip(inputs, outputs, strict=True):
+      assert np.isclose(output, reference_evaluate(model, input_array), rtol=1e-5, atol=1e-6)
+      assert np.isclose(model.evaluate(input_array), output, rtol=1e-5, atol=1e-6)
+
+  def test_weight_cache(self, tmp_path):
+    model_file = write_model(tmp_path / "cached_model.json")
+    cache_file = os.path.join(Paths.nnlc_cache_root(), "cached_model.npz")
+    inputs = [[1.0] * 18, [0.5, -0.5]]
+
+    expected = NNTorqueModel(model_file).evaluate_batch(inputs)
+    assert os.path.isfile(cache_file)
+    cache_mtime = os.stat(cache_file).st_mtime_ns
+    assert np.array_equal(NNTorqueModel(model_file).evaluate_batch(inputs), expected)
+    assert os.stat(cache_file).st_mtime_ns == cache_mtime
+
+    # changing the json regenerates the cache
+    write_model(model_file, seed=1)
+    updated = NNTorqueModel(model_file).evaluate_batch(inputs)
+    assert not np.allclose(updated, expected)
+    assert np.allclose(updated, [reference_evaluate(NNTorqueModel(model_file), x) for x in inputs], rtol=1e-5, atol=1e-6)
+
+  @pytest.mark.parametrize("contents", [b"", b"PK\x05\x06" + bytes(18), b"not an npz", None])
+  def test_corrupt_weight_cache(self, tmp_path, contents):
+    model_file = write_model(tmp_path / "corrupt_model.json")
+    cache_file = os.path.join(Paths.nnlc_cache_root(), "corrupt_model.npz")
+    inputs = [[1.0] * 18, [0.5, -0.5]]
+    expected = NNTorqueModel(model_file).evaluate_batch(inputs)
+
+    with open(cache_file, "rb") as f:
+      cached = f.read()
+    with open(cache_file, "wb") as f:
+      # None truncates a valid cache
+      f.write(cached[:len(cached) // 2] if contents is None else contents)
+
+    assert np.array_equal(NNTorqueModel(model_file).evaluate_batch(inputs), expected)
+    # and the cache is rewritten
+    with np.load(cache_file) as cache:
+      assert set(cache.files) == set(np.load(io.BytesIO(cached)).files)
@@ -2,12 +2,31 @@ import numpy as np
 import threading
 import multiprocessing
 import bisect
+import contextlib
+import hashlib
+import json
+import math
+import mmap
+import os
+import struct
+import zipfile
 from collections import defaultdict
+from functools import partial
 from tqdm import tqdm
+from cereal import CEREAL_PATH
 from openpilot.common.swaglog import cloudlog
+from openpilot.common.utils import atomic_write
+from openpilot.selfdrive.test.process_replay import migration
 from openpilot.selfdrive.test.process_replay.migration import migrate_all
+from openpilot.tools.lib.cache import DEFAULT_CACHE_DIR
 from openpilot.tools.lib.logreader import _LogFileReader, LogReader
 
+SEGMENT_CACHE_DIR = os.path.join(DEFAULT_CACHE_DIR, "jotpluggler")
+SEGMENT_CACHE_FORMAT = 2
+# cache size limit in MB, least recently used segments are evicted past it. Override with JOTPLUGGLER_CACHE_SIZE
+SEGMENT_CACHE_SIZE = 5 * 1000
+NPY_HEADER_READERS = {(1, 0): np.lib.format.read_array_header_1_0, (2, 0): np.lib.format.read_array_header_2_0}
+
 
 def flatten_dict(d: dict, sep: str = "/", prefix: str = None) -> dict:
   result = {}
@@ -197,18 +216,181 @@ def msgs_to_time_series(msgs):
   return final_result, min_time or 0.0, max_time or 0.0
 
 
-def _process_segment(segment_identifier: str):
+def _segment_cache_version() -> bytes:
+  # anything that changes the parsed output invalidates the cache: the capnp schema, the migrations and this parser
+  h = hashlib.sha256(str(SEGMENT_CACHE_FORMAT).encode())
+  for fn in (os.path.join(CEREAL_PATH, "log.capnp"), os.path.join(CEREAL_PATH, "car.capnp"), os.path.join(CEREAL_PATH, "custom.capnp"),
+             migration.__file__, __file__):
+    with open(fn, "rb") as f:
+      h.update(f.read())
+  return h.digest()
+
+
+def segment_cache_path(segment_identifier: str, version: bytes, cache_dir: str = SEGMENT_CACHE_DIR) -> str:
+  if os.path.isfile(segment_identifier):
+    st = os.stat(segment_identifier)
+    key = f"{os.path.abspath(segment_identifier)}:{st.st_size}:{st.st_mtime_ns}"
+  else:
+    # signed URLs change on every request, the path identifies the file
+    key = segment_identifier.split("?")[0]
+  return os.path.join(cache_dir, hashlib.sha256(version + key.encode()).hexdigest() + ".npz")
+
+
+def _encode_objects(values: np.ndarray) -> tuple[str, np.ndarray, np.ndarray]:
+  # text, data and enum columns are stored as one byte blob with offsets, so loading never unpickles anything
+  items = values.tolist()
+  if all(isinstance(v, str) for v in items):
+    kind, encoded = "str", [v.encode() for v in items]
+  elif all(isinstance(v, bytes) for v in items):
+    kind, encoded = "bytes", items
+  else:
+    kind, encoded = "json", [json.dumps(v).encode() for v in items]
+  offsets = np.cumsum([0] + [len(b) for b in encoded], dtype=np.int64)
+  return kind, np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def _decode_objects(kind: str, blob: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+  dat = blob.tobytes()
+  bounds = offsets.tolist()
+  items = [dat[start:end] for start, end in zip(bounds[:-1], bounds[1:], strict=True)]
+  if kind == "str":
+    items = [b.decode() for b in items]
+  elif kind == "json":
+    items = [json.loads(b) for b in items]
+  elif kind != "bytes":
+    raise ValueError(f"unknown object column kind {kind}")
+  return np.fromiter(items, dtype=object, count=len(items))
+
+
+def save_segment_cache(path: str, segment_data: dict, start_time: float, end_time: float) -> None:
+  """
+    Saves a segment as an uncompressed npz, one entry per array named "<msg type>:<field>:<part>", so
+    load_segment_cache can map the numeric arrays in place
+  """
+  arrays = {":times": np.array([start_time, end_time], dtype=np.float64)}
+  for typ, typ_data in segment_data.items():
+    for field, field_data in typ_data.items():
+      if field == 't':
+        arrays[f"{typ}:t"] = field_data
+        continue
+      values = field_data['values']
+      if values.dtype == object:
+        kind, blob, offsets = _encode_objects(values)
+        arrays[f"{typ}:{field}:{kind}"] = blob
+        arrays[f"{typ}:{field}:offsets"] = offsets
+      else:
+        arrays[f"{typ}:{field}:values"] = values
+      if field_data['sparse']:
+        arrays[f"{typ}:{field}:t_index"] = field_data['t_index']
+
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with atomic_write(path, mode="wb", overwrite=True) as f:
+    np.savez(f, **arrays)
+
+
+def _map_npz(path: str) -> dict[str, np.ndarray]:
+  """Maps the arrays of an uncompressed npz as read-only views into the file, np.load would read them into memory"""
+  arrays = {}
+  with open(path, "rb") as f, zipfile.ZipFile(f) as zf:
+    buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    for info in zf.infolist():
+      if info.compress_type != zipfile.ZIP_STORED or not info.filename.endswith(".npy"):
+        raise ValueError(f"Unexpected entry {info.filename} in segment cache {path}")
+      name_len, extra_len = struct.unpack_from("<HH", buf, info.header_offset + 26)
+      data_start = info.header_offset + 30 + name_len + extra_len
+      f.seek(data_start)
+      read_header = NPY_HEADER_READERS[np.lib.format.read_magic(f)]
+      shape, fortran_order, dtype = read_header(f)
+      count = math.prod(shape)
+      if dtype.hasobject or f.tell() + count * dtype.itemsize > data_start + info.file_size:
+        raise ValueError(f"Invalid entry {info.filename} in segment cache {path}")
+      arr = np.frombuffer(buf, dtype=dtype, count=count, offset=f.tell()) if count else np.empty(shape, dtype=dtype)
+      arrays[info.filename[:-4]] = arr.reshape(shape, order='F' if fortran_order else 'C')
+  return arrays
+
+
+def load_segment_cache(path: str) -> tuple[dict, float, float]:
+  """Maps a segment saved by save_segment_cache, numeric arrays are read-only views into the file"""
+  arrays = _map_npz(path)
+  start_time, end_time = arrays.pop(":times").tolist()
+
+  segment_data: dict[str, dict] = {}
+  for name, arr in arrays.items():
+    typ, field, *part = name.split(":")
+    typ_data = segment_data.setdefault(typ, {})
+    if not part:
+      typ_data[field] = arr
+      continue
+    field_data = typ_data.setdefault(field, {'sparse': False})
+    if part[0] == "t_index":
+      field_data['sparse'] = True
+      field_data['t_index'] = arr
+    elif part[0] == "values":
+      field_data['values'] = arr
+    elif part[0] != "offsets":
+      field_data['values'] = _decode_objects(part[0], arr, arrays[f"{typ}:{field}:offsets"])
+
+  # mark as recently used for eviction
+  os.utime(path)
+  return segment_data, start_time, end_time
+
+
+def _segment_cache_entries(cache_dir: str) -> list[tuple[str, int, float]]:
+  entries = []
+  with os.scandir(cache_dir) as it:
+    for entry in it:
+      # skip segments still being written by atomic_write
+      if not entry.name.endswith(".npz"):
+        continue
+      try:
+        st = entry.stat()
+      except FileNotFoundError:
+        continue
+      entries.append((entry.path, st.st_size, st.st_mtime))
+  return entries
+
+
+def evict_segment_cache(cache_dir: str = SEGMENT_CACHE_DIR, max_size: float | None = None) -> None:
+  """Removes the least recently used segments until the cache is at most max_size MB"""
+  if max_size is None:
+    max_size = float(os.environ.get("JOTPLUGGLER_CACHE_SIZE", SEGMENT_CACHE_SIZE))
+  entries = sorted(_segment_cache_entries(cache_dir), key=lambda e: e[2])
+  usage = sum(size for _, size, _ in entries)
+  for path, size, _ in entries:
+    if usage <= max_size * 1000 * 1000:
+      break
+    with contextlib.suppress(FileNotFoundError):
+      os.unlink(path)
+    usage -= size
+
+
+def _process_segment(segment_identifier: str, cache_version: bytes | None = None):
+  cache_path = segment_cache_path(segment_identifier, cache_version) if cache_version is not None else None
+  if cache_path is not None and os.path.exists(cache_path):
+    return cache_path
+
   try:
     lr = _LogFileReader(segment_identifier, sort_by_time=True)
     migrated_msgs = migrate_all(lr)
-    return msgs_to_time_series(migrated_msgs)
+    segment_data, start_time, end_time = msgs_to_time_series(migrated_msgs)
   except Exception as e:
     cloudlog.warning(f"Warning: Failed to process segment {segment_identifier}: {e}")
     return {}, 0.0, 0.0
 
+  if cache_path is not None and segment_data:
+    try:
+      save_segment_cache(cache_path, segment_data, start_time, end_time)
+      evict_segment_cache(os.path.dirname(cache_path))
+      # hand back the path so the caller maps the arrays instead of getting a pickled copy
+      return cache_path
+    except (OSError, TypeError, ValueError) as e:
+      cloudlog.warning(f"Warning: Failed to cache segment {segment_identifier}: {e}")
+  return segment_data, start_time, end_time
+
 
 class DataManager:
-  def __init__(self):
+  def __init__(self, cache: bool = True):
+    self._cache = cache
     self._segments = []
     self._segment_starts = []
     self._start_time = 0.0
@@ -320,10 +502,21 @@ class DataManager:
       for callback in observers:
         callback({'metadata_loaded': True, 'total_segments': total_segments})
 
+      cache_version = _segment_cache_version() if self._cache else None
       num_processes = max(1, multiprocessing.cpu_count() // 2)
       with multiprocessing.Pool(processes=num_processes) as pool, tqdm(total=len(lr.logreader_identifiers), desc="Processing Segments") as pbar:
-        for segment_result, start_time, end_time in pool.imap(_process_segment, lr.logreader_identifiers):
+        results = pool.imap(partial(_process_segment, cache_version=cache_version), lr.logreader_identifiers)
+        for segment_identifier, result in zip(lr.logreader_identifiers, results, strict=True):
           pbar.update(1)
+          if isinstance(result, str):
+            try:
+              result = load_segment_cache(result)
+            except Exception:
+              cloudlog.exception(f"Failed to load cached segment {result}, reprocessing")
+              with contextlib.suppress(FileNotFoundError):
+                os.remove(result)
+              result = _process_segment(segment_identifier)
+          segment_result, start_time, end_time = result
           if segment_result:
             self._add_segment(segment_result, start_time, end_time)
     except Exception:
@@ -0,0 +1,81 @@
+import os
+import struct
+import zipfile
+import numpy as np
+import pytest
+
+from openpilot.tools.jotpluggler.data import evict_segment_cache, load_segment_cache, save_segment_cache, segment_cache_path
+
+
+def make_segment():
+  t = np.arange(100, dtype=np.float64) * 0.01
+  return {
+    'carState': {
+      't': t,
+      'vEgo': {'values': np.linspace(0, 10, 100, dtype=np.float32), 'sparse': False},
+      'gearShifter': {'values': np.array(['drive'] * 100, dtype=object), 'sparse': False},
+      'buttonEvents/0/pressed': {'values': np.array([True, False]), 'sparse': True, 't_index': np.array([3, 50], dtype=np.uint16)},
+    },
+    'can': {
+      't': t[:2],
+      '0/dat': {'values': np.array([b'\x00\x01', b''], dtype=object), 'sparse': False},
+      '0/src': {'values': np.array([1, 2.5], dtype=object), 'sparse': False},
+      '1/dat': {'values': np.array([], dtype=np.float64), 'sparse': True, 't_index': np.array([], dtype=np.uint16)},
+    },
+  }
+
+
+class TestSegmentCache:
+  def test_round_trip(self, tmp_path):
+    path = str(tmp_path / "segment.npz")
+    segment = make_segment()
+    save_segment_cache(path, segment, 1.0, 2.0)
+
+    loaded, start_time, end_time = load_segment_cache(path)
+    assert (start_time, end_time) == (1.0, 2.0)
+    assert loaded.keys() == segment.keys()
+    for typ, fields in segment.items():
+      assert loaded[typ].keys() == fields.keys()
+      assert np.array_equal(loaded[typ]['t'], fields['t'])
+      for field, data in fields.items():
+        if field == 't':
+          continue
+        cached = loaded[typ][field]
+        assert cached['sparse'] == data['sparse']
+        assert cached['values'].dtype == data['values'].dtype
+        assert cached['values'].tolist() == data['values'].tolist()
+        if data['sparse']:
+          assert cached['t_index'].dtype == data['t_index'].dtype
+          assert np.array_equal(cached['t_index'], data['t_index'])
+
+    # numeric arrays are views into the file, and nothing in it needs unpickling
+    assert not loaded['carState']['vEgo']['values'].flags.writeable
+    with np.load(path, allow_pickle=False) as npz:
+      assert len(npz.files) > 0
+
+  def test_corrupt(self, tmp_path):
+    path = tmp_path / "segment.npz"
+    save_segment_cache(str(path), make_segment(), 1.0, 2.0)
+    dat = path.read_bytes()
+
+    for contents in (b"", dat[:len(dat) // 2], b"JPSEGMNT" + bytes(100)):
+      path.write_bytes(contents)
+      with pytest.raises((zipfile.BadZipFile, ValueError, struct.error)):
+        load_segment_cache(str(path))
+
+  def test_cache_path(self, tmp_path):
+    url = "https://commadata2.blob.core.windows.net/commadata2/a2a0ccea32023010/2023-07-27--13-01-19/0/rlog.zst"
+    assert segment_cache_path(f"{url}?se=1&sig=a", b"v1", str(tmp_path)) == segment_cache_path(f"{url}?se=2&sig=b", b"v1", str(tmp_path))
+    assert segment_cache_path(url, b"v1", str(tmp_path)) != segment_cache_path(url, b"v2", str(tmp_path))
+
+  def test_eviction(self, tmp_path):
+    paths = [str(tmp_path / f"{i}.npz") for i in range(5)]
+    for i, path in enumerate(paths):
+      save_segment_cache(path, make_segment(), 1.0, 2.0)
+      os.utime(path, (i, i))
+    size = os.path.getsize(paths[0])
+
+    # loading a segment marks it as recently used
+    load_segment_cache(paths[0])
+    evict_segment_cache(str(tmp_path), max_size=2.5 * size / 1e6)
+    assert sorted(os.listdir(tmp_path)) == ["0.npz", "4.npz"]
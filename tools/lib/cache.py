@@ -12,3 +12,15 @@ def cache_path_for_file_path(fn, cache_dir=DEFAULT_CACHE_DIR):
   else:
     cache_fn = f'{fn_parsed.hostname}_{fn_parsed.path.replace("/", "_")}'
   return os.path.join(dir_, cache_fn)
+
+
+def cache_path_for_log_index(key, cache_dir=DEFAULT_CACHE_DIR):
+  dir_ = os.path.join(cache_dir, "log_index")
+  os.makedirs(dir_, exist_ok=True)
+  return os.path.join(dir_, f"{key}.npz")
+
+
+def cache_path_for_video_index(key, cache_dir=DEFAULT_CACHE_DIR):
+  dir_ = os.path.join(cache_dir, "video_index")
+  os.makedirs(dir_, exist_ok=True)
+  return os.path.join(dir_, f"{key}.npz")
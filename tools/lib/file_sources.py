@@ -1,4 +1,6 @@
 from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
 
 from openpilot.tools.lib.comma_car_segments import get_url as get_comma_segments_url
 from openpilot.tools.lib.openpilotci import get_url
@@ -11,9 +13,18 @@ Source = Callable[[SegmentRange, list[int], FileNames], dict[int, str]]
 
 InternalUnavailableException = Exception("Internal source not available")
 
+# Max number of files probed at once by a source
+SOURCE_PROBE_WORKERS = 16
+
+
+@cache
+def get_comma_api_route(route_name: str) -> Route:
+  # the route's file listing is fetched once per process
+  return Route(route_name)
+
 
 def comma_api_source(sr: SegmentRange, seg_idxs: list[int], fns: FileNames) -> dict[int, str]:
-  route = Route(sr.route_name)
+  route = get_comma_api_route(sr.route_name)
 
   # comma api will have already checked if the file exists
   if fns == FileName.RLOG:
@@ -42,16 +53,19 @@ def comma_car_segments_source(sr: SegmentRange, seg_idxs: list[int], fns: FileNa
 
 def eval_source(files: dict[int, list[str] | str]) -> dict[int, str]:
   # Returns valid file URLs given a list of possible file URLs for each segment (e.g. rlog.bz2, rlog.zst)
+  candidates = {seg_idx: [urls] if isinstance(urls, str) else urls for seg_idx, urls in files.items()}
   valid_files: dict[int, str] = {}
 
-  for seg_idx, urls in files.items():
-    if isinstance(urls, str):
-      urls = [urls]
-
-    # Add first valid file URL
-    for url in urls:
-      if file_exists(url):
-        valid_files[seg_idx] = url
+  # Probe every segment's first choice at once, then the next choice only for the segments still missing
+  with ThreadPoolExecutor(max_workers=SOURCE_PROBE_WORKERS) as pool:
+    choice = 0
+    while True:
+      probes = {seg_idx: urls[choice] for seg_idx, urls in candidates.items() if seg_idx not in valid_files and choice < len(urls)}
+      if not probes:
         break
+      for (seg_idx, url), exists in zip(probes.items(), pool.map(file_exists, probes.values()), strict=True):
+        if exists:
+          valid_files[seg_idx] = url
+      choice += 1
 
-  return valid_files
+  return {seg_idx: valid_files[seg_idx] for seg_idx in files if seg_idx in valid_files}
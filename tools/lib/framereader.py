@@ -1,10 +1,15 @@
 import os
 import subprocess
 import json
+import threading
 from collections.abc import Iterator
+from contextlib import suppress
 from collections import OrderedDict
+from hashlib import sha256
 
 import numpy as np
+from openpilot.common.utils import atomic_write
+from openpilot.tools.lib.cache import cache_path_for_video_index
 from openpilot.tools.lib.filereader import FileReader, resolve_name
 from openpilot.tools.lib.exceptions import DataUnreadableError
 from openpilot.tools.lib.vidindex import hevc_index
@@ -14,24 +19,39 @@ HEVC_SLICE_B = 0
 HEVC_SLICE_P = 1
 HEVC_SLICE_I = 2
 
+# bump when the cached index format changes
+VIDEO_INDEX_VERSION = 1
+# video index cache size limit in MB, least recently used indexes are evicted past it. Override with FRAMEREADER_INDEX_CACHE_SIZE
+VIDEO_INDEX_CACHE_SIZE = 100
+
 
 class LRUCache:
-  def __init__(self, capacity: int):
+  """LRU cache bounded by entry count and optionally by the total nbytes of its values"""
+  def __init__(self, capacity: int, max_bytes: int | None = None):
     self._cache: OrderedDict = OrderedDict()
     self.capacity = capacity
+    self.max_bytes = max_bytes
+    self.nbytes = 0
 
   def __getitem__(self, key):
     self._cache.move_to_end(key)
     return self._cache[key]
 
   def __setitem__(self, key, value):
+    if key in self._cache:
+      self.nbytes -= self._cache.pop(key).nbytes
     self._cache[key] = value
-    if len(self._cache) > self.capacity:
-        self._cache.popitem(last=False)
+    self.nbytes += value.nbytes
+    # always keep the newest entry, even if it's over the byte limit on its own
+    while len(self._cache) > 1 and (len(self._cache) > self.capacity or (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+      self.nbytes -= self._cache.popitem(last=False)[1].nbytes
 
   def __contains__(self, key):
     return key in self._cache
 
+  def __len__(self):
+    return len(self._cache)
+
 
 def assert_hvec(fn: str) -> None:
   with FileReader(fn) as f:
@@ -42,9 +62,9 @@ def assert_hvec(fn: str) -> None:
     if 'hevc' not in fn:
       raise NotImplementedError(fn)
 
-def decompress_video_data(rawdat, w, h, pix_fmt="rgb24", vid_fmt='hevc') -> np.ndarray:
+def ffmpeg_decode_args(pix_fmt="rgb24", vid_fmt='hevc') -> list[str]:
   threads = os.getenv("FFMPEG_THREADS", "0")
-  args = ["ffmpeg", "-v", "quiet",
+  return ["ffmpeg", "-v", "quiet",
           "-threads", threads,
           "-c:v", "hevc",
           "-vsync", "0",
@@ -54,7 +74,53 @@ def decompress_video_data(rawdat, w, h, pix_fmt="rgb24", vid_fmt='hevc') -> np.n
           "-f", "rawvideo",
           "-pix_fmt", pix_fmt,
           "-"]
-  dat = subprocess.check_output(args, input=rawdat)
+
+def frame_size(w, h, pix_fmt="rgb24") -> int:
+  if pix_fmt == "rgb24":
+    return h*w*3
+  elif pix_fmt in ["nv12", "yuv420p"]:
+    return h*w*3//2
+  raise NotImplementedError(f"Unsupported pixel format: {pix_fmt}")
+
+def yuv_to_rgb(frame: np.ndarray, w: int, h: int, pix_fmt: str = "nv12") -> np.ndarray:
+  """Converts a limited range BT.601 NV12 or YUV420P frame to RGB24. Close to ffmpeg's conversion, but not bit exact"""
+  y = frame[:w*h].reshape(h, w).astype(np.float32) - 16
+  if pix_fmt == "nv12":
+    uv = frame[w*h:].reshape(h//2, w//2, 2)
+    u, v = uv[..., 0], uv[..., 1]
+  elif pix_fmt == "yuv420p":
+    u = frame[w*h:w*h + w*h//4].reshape(h//2, w//2)
+    v = frame[w*h + w*h//4:].reshape(h//2, w//2)
+  else:
+    raise NotImplementedError(f"Unsupported pixel format: {pix_fmt}")
+  u = u.astype(np.float32).repeat(2, axis=0).repeat(2, axis=1) - 128
+  v = v.astype(np.float32).repeat(2, axis=0).repeat(2, axis=1) - 128
+
+  y *= 1.164
+  rgb = np.empty((h, w, 3), dtype=np.float32)
+  rgb[..., 0] = y + 1.596 * v
+  rgb[..., 1] = y - 0.392 * u - 0.813 * v
+  rgb[..., 2] = y + 2.017 * u
+  return np.rint(rgb, out=rgb).clip(0, 255).astype(np.uint8)
+
+def write_all(f, dat: bytes) -> None:
+  view = memoryview(dat)
+  while len(view):
+    view = view[f.write(view):]
+
+def read_exactly(f, size: int) -> bytearray | None:
+  dat = bytearray(size)
+  view = memoryview(dat)
+  pos = 0
+  while pos < size:
+    n = f.readinto(view[pos:])
+    if not n:
+      return None
+    pos += n
+  return dat
+
+def decompress_video_data(rawdat, w, h, pix_fmt="rgb24", vid_fmt='hevc') -> np.ndarray:
+  dat = subprocess.check_output(ffmpeg_decode_args(pix_fmt, vid_fmt), input=rawdat)
 
   ret: np.ndarray
   if pix_fmt == "rgb24":
@@ -87,34 +153,114 @@ def get_index_data(fn: str, index_data: dict|None = None):
   stream = index_data["probe"]["streams"][0]
   return index_data["index"], index_data["global_prefix"], stream["width"], stream["height"]
 
-def get_video_index(fn):
+def video_index_key(fn: str) -> str:
+  # camera files don't change once uploaded, so their location and size identify them.
+  # local files can be rewritten in place, so their mtime is included too
+  fn = resolve_name(fn)
+  with FileReader(fn) as f:
+    length = f.get_length()
+  if fn.startswith(("http://", "https://")):
+    identity = fn.split("?")[0]
+  else:
+    identity = f"{os.path.abspath(fn)}:{os.stat(fn).st_mtime_ns}"
+  return sha256(f"{VIDEO_INDEX_VERSION}:{identity}:{length}".encode()).hexdigest()
+
+def load_video_index(path: str) -> dict | None:
+  # any unreadable entry (truncated, not a zip, missing or malformed arrays) is a cache miss and gets rebuilt
+  try:
+    with open(path, "rb") as f, np.load(f) as cached:
+      index_data = {
+        'index': cached['index'],
+        'global_prefix': cached['global_prefix'].tobytes(),
+        'probe': json.loads(str(cached['probe'])),
+      }
+    if index_data['index'].ndim != 2 or index_data['index'].shape[1] != 2:
+      raise ValueError(f"bad index shape {index_data['index'].shape}")
+  except FileNotFoundError:
+    return None
+  except Exception:
+    with suppress(FileNotFoundError):
+      os.unlink(path)
+    return None
+  # mark it as recently used for eviction
+  with suppress(OSError):
+    os.utime(path)
+  return index_data
+
+def save_video_index(path: str, index_data: dict) -> None:
+  with atomic_write(path, mode="wb", overwrite=True) as f:
+    np.savez(f,
+             index=index_data['index'],
+             global_prefix=np.frombuffer(index_data['global_prefix'], dtype=np.uint8),
+             probe=np.array(json.dumps(index_data['probe'])))
+
+def evict_video_index_cache(cache_dir: str, max_size: float | None = None) -> None:
+  """Removes the least recently used indexes until the cache is at most max_size MB"""
+  if max_size is None:
+    max_size = float(os.getenv("FRAMEREADER_INDEX_CACHE_SIZE", VIDEO_INDEX_CACHE_SIZE))
+  entries = []
+  with os.scandir(cache_dir) as it:
+    for entry in it:
+      # skip indexes still being written by atomic_write
+      if not entry.name.endswith(".npz"):
+        continue
+      with suppress(FileNotFoundError):
+        st = entry.stat()
+        entries.append((entry.path, st.st_size, st.st_mtime))
+  entries.sort(key=lambda e: e[2])
+  usage = sum(size for _, size, _ in entries)
+  for path, size, _ in entries:
+    if usage <= max_size * 1000 * 1000:
+      break
+    with suppress(FileNotFoundError):
+      os.unlink(path)
+    usage -= size
+
+def get_video_index(fn, cache: bool | None = None):
+  # FRAMEREADER_INDEX_CACHE=1 turns the index cache on, like LOGREADER_INDEX_CACHE for logs
+  if cache is None:
+    cache = bool(int(os.getenv("FRAMEREADER_INDEX_CACHE", "0")))
+
+  index_path = cache_path_for_video_index(video_index_key(fn)) if cache else None
+  if index_path is not None:
+    index_data = load_video_index(index_path)
+    if index_data is not None:
+      return index_data
+
   assert_hvec(fn)
   frame_types, dat_len, prefix = hevc_index(fn)
   index = np.array(frame_types + [(0xFFFFFFFF, dat_len)], dtype=np.uint32)
   probe = ffprobe(fn, "hevc")
-  return {
+  index_data = {
     'index': index,
     'global_prefix': prefix,
     'probe': probe
   }
+  if index_path is not None:
+    save_video_index(index_path, index_data)
+    evict_video_index_cache(os.path.dirname(index_path))
+  return index_data
 
 
 class FfmpegDecoder:
+  """
+    Decodes frames through ffmpeg. By default one ffmpeg process is kept alive per iterator and fed
+    consecutive GOPs through its stdin, so sequential reads don't pay process startup for every GOP.
+    With streaming=False each GOP is decoded by its own process.
+  """
   def __init__(self, fn: str, index_data: dict|None = None,
-               pix_fmt: str = "rgb24"):
+               pix_fmt: str = "rgb24", streaming: bool = True):
     self.fn = fn
     self.index, self.prefix, self.w, self.h = get_index_data(fn, index_data)
     self.frame_count = len(self.index) - 1          # sentinel row at the end
     self.iframes = np.where(self.index[:, 0] == HEVC_SLICE_I)[0]
     self.pix_fmt = pix_fmt
+    self.streaming = streaming
 
   def _gop_bounds(self, frame_idx: int):
-    f_b = frame_idx
-    while f_b > 0 and self.index[f_b, 0] != HEVC_SLICE_I:
-      f_b -= 1
-    f_e = frame_idx + 1
-    while f_e < self.frame_count and self.index[f_e, 0] != HEVC_SLICE_I:
-      f_e += 1
+    i = np.searchsorted(self.iframes, frame_idx, side="right")
+    f_b = int(self.iframes[i - 1]) if i > 0 else 0
+    f_e = int(self.iframes[i]) if i < len(self.iframes) else self.frame_count
     return f_b, f_e, self.index[f_b, 1], self.index[f_e, 1]
 
   def _decode_gop(self, raw: bytes) -> Iterator[np.ndarray]:
@@ -126,6 +272,10 @@ class FfmpegDecoder:
   def get_iterator(self, start_fidx: int = 0, end_fidx: int|None = None,
                    frame_skip: int = 1) -> Iterator[tuple[int, np.ndarray]]:
     end_fidx = end_fidx or self.frame_count
+    if self.streaming:
+      yield from self._stream_iterator(start_fidx, end_fidx, frame_skip)
+      return
+
     fidx = start_fidx
     while fidx < end_fidx:
       f_b, f_e, off_b, off_e = self._gop_bounds(fidx)
@@ -141,33 +291,106 @@ class FfmpegDecoder:
           yield fidx, frm
       fidx += 1
 
+  def _feed(self, stdin, f_b: int, f_e: int, errors: list[BaseException]) -> None:
+    # the GOPs are contiguous in the file, feed them one at a time so ffmpeg can start on the first right away
+    try:
+      with FileReader(self.fn) as f:
+        write_all(stdin, self.prefix)
+        gop_start = f_b
+        while gop_start < f_e:
+          _, gop_end, off_b, off_e = self._gop_bounds(gop_start)
+          f.seek(off_b)
+          write_all(stdin, f.read(off_e - off_b))
+          gop_start = gop_end
+    except BaseException as e:
+      # handed to the iterator, which raises it once ffmpeg's output runs out.
+      # if the iterator was closed first this is just the broken pipe, and nobody looks at it
+      errors.append(e)
+    finally:
+      with suppress(OSError):
+        stdin.close()
+
+  def _stream_iterator(self, start_fidx: int, end_fidx: int, frame_skip: int) -> Iterator[tuple[int, np.ndarray]]:
+    f_b = self._gop_bounds(start_fidx)[0]
+    f_e = self._gop_bounds(end_fidx - 1)[1]
+    size = frame_size(self.w, self.h, self.pix_fmt)
+    shape = (self.h, self.w, 3) if self.pix_fmt == "rgb24" else (size,)
+
+    # unbuffered pipes, the feeder thread owns stdin and there's no buffer lock to share with it
+    args = ffmpeg_decode_args(self.pix_fmt)
+    proc = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0)
+    feed_errors: list[BaseException] = []
+    feeder = threading.Thread(target=self._feed, args=(proc.stdin, f_b, f_e, feed_errors), daemon=True)
+    feeder.start()
+    try:
+      for fidx in range(f_b, min(f_e, end_fidx)):
+        dat = read_exactly(proc.stdout, size)
+        if dat is None:
+          # a failed read is the real error. a broken pipe only means ffmpeg stopped reading, so its exit status comes first
+          feeder.join()
+          feed_error = feed_errors[0] if feed_errors else None
+          if feed_error is not None and not isinstance(feed_error, BrokenPipeError):
+            raise feed_error
+          if proc.wait() != 0:
+            raise subprocess.CalledProcessError(proc.returncode, args) from feed_error
+          if feed_error is not None:
+            raise feed_error
+          return
+        if fidx >= start_fidx and (fidx - start_fidx) % frame_skip == 0:
+          yield fidx, np.frombuffer(dat, dtype=np.uint8).reshape(shape)
+    finally:
+      # the feeder stops on the broken pipe
+      proc.kill()
+      proc.stdout.close()
+      proc.wait()
+
 def FrameIterator(fn: str, index_data: dict|None=None,
                         pix_fmt: str = "rgb24",
-                        start_fidx:int=0, end_fidx=None, frame_skip:int=1) -> Iterator[np.ndarray]:
-  dec = FfmpegDecoder(fn, pix_fmt=pix_fmt, index_data=index_data)
+                        start_fidx:int=0, end_fidx=None, frame_skip:int=1, streaming: bool = True) -> Iterator[np.ndarray]:
+  dec = FfmpegDecoder(fn, pix_fmt=pix_fmt, index_data=index_data, streaming=streaming)
   for _, frame in dec.get_iterator(start_fidx=start_fidx, end_fidx=end_fidx, frame_skip=frame_skip):
     yield frame
 
 class FrameReader:
+  """
+    Random access to decoded frames, with an LRU cache of recently decoded ones. cache_bytes bounds the cache
+    by total size on top of cache_size frames. With cache_yuv, rgb24 readers decode and cache NV12 frames,
+    half the size of RGB, and convert to RGB in get(). get_yuv() returns the cached YUV frame as is.
+  """
   def __init__(self, fn: str, index_data: dict|None = None,
-               cache_size: int = 30, pix_fmt: str = "rgb24"):
-    self.decoder = FfmpegDecoder(fn, index_data, pix_fmt)
+               cache_size: int = 30, pix_fmt: str = "rgb24", streaming: bool = True,
+               cache_bytes: int | None = None, cache_yuv: bool = False):
+    decode_fmt = "nv12" if cache_yuv and pix_fmt == "rgb24" else pix_fmt
+    self.decoder = FfmpegDecoder(fn, index_data, decode_fmt, streaming)
     self.iframes = self.decoder.iframes
-    self._cache: LRUCache = LRUCache(cache_size)
+    self._cache: LRUCache = LRUCache(cache_size, cache_bytes)
     self.w, self.h, self.frame_count, = self.decoder.w, self.decoder.h, self.decoder.frame_count
     self.pix_fmt = pix_fmt
 
     self.it: Iterator[tuple[int, np.ndarray]] | None = None
     self.fidx = -1
 
-  def get(self, fidx:int):
+  def _get_decoded(self, fidx: int) -> np.ndarray:
     if fidx in self._cache:  # If frame is cached, return it
       return self._cache[fidx]
     read_start = self.decoder.get_gop_start(fidx)
-    if not self.it or fidx < self.fidx or read_start != self.decoder.get_gop_start(self.fidx):  # If the frame is in a different GOP, reset the iterator
+    # Reset the iterator on a backward seek, or when it would have to decode whole GOPs to get to the frame.
+    # Otherwise keep reading, the iterator carries on into the following GOPs
+    if not self.it or fidx < self.fidx or read_start > self.fidx + 1:
       self.it = self.decoder.get_iterator(read_start)
       self.fidx = -1
     while self.fidx < fidx:
       self.fidx, frame = next(self.it)
       self._cache[self.fidx] = frame
     return self._cache[fidx]
+
+  def get(self, fidx:int):
+    frame = self._get_decoded(fidx)
+    if self.decoder.pix_fmt != self.pix_fmt:
+      return yuv_to_rgb(frame, self.w, self.h, self.decoder.pix_fmt)
+    return frame
+
+  def get_yuv(self, fidx: int) -> np.ndarray:
+    if self.decoder.pix_fmt not in ("nv12", "yuv420p"):
+      raise ValueError(f"frames are decoded as {self.decoder.pix_fmt}, use pix_fmt='nv12' or cache_yuv=True")
+    return self._get_decoded(fidx)
@@ -1,3 +1,5 @@
+import capnp
+import struct
 import numpy as np
 
 
@@ -52,11 +54,10 @@ def potentially_ragged_array(arr, dtype=None, **kwargs):
   except ValueError:
     return np.array(arr, dtype=object, **kwargs)
 
-def msgs_to_time_series(msgs):
+
+def dicts_to_time_series(msgs):
   """
-    Convert an iterable of canonical capnp messages into a dictionary of time series.
-    Each time series has a value with key "t" which consists of monotonically increasing timestamps
-    in seconds.
+    Reference implementation of msgs_to_time_series, going through to_dict() for every message.
   """
   values = {}
   for msg in msgs:
@@ -76,6 +77,462 @@ def msgs_to_time_series(msgs):
   return values
 
 
+U64 = struct.Struct("<Q")
+
+# capnp slot type -> little-endian dtype of its data section encoding
+PRIMITIVE_DTYPES = {
+  'int8': '<i1', 'int16': '<i2', 'int32': '<i4', 'int64': '<i8',
+  'uint8': '<u1', 'uint16': '<u2', 'uint32': '<u4', 'uint64': '<u8',
+  'float32': '<f4', 'float64': '<f8', 'enum': '<u2',
+}
+INITIAL_CAPACITY = 64
+
+
+def _resolve_struct(buf: bytes, seg_starts: list[int], ptr_pos: int) -> tuple[int, int, int, int] | None:
+  """Follows the struct pointer at ptr_pos, returns (data start, data size, pointers start, pointer count) in bytes"""
+  ptr = U64.unpack_from(buf, ptr_pos)[0]
+  kind = ptr & 3
+  if ptr == 0:
+    return None
+  if kind == 2:
+    # far pointer, to a landing pad in another segment
+    pad_pos = seg_starts[ptr >> 32] + ((ptr >> 3) & 0x1FFFFFFF) * 8
+    if not (ptr >> 2) & 1:
+      return _resolve_struct(buf, seg_starts, pad_pos)
+    far, tag = U64.unpack_from(buf, pad_pos)[0], U64.unpack_from(buf, pad_pos + 8)[0]
+    data_pos = seg_starts[far >> 32] + ((far >> 3) & 0x1FFFFFFF) * 8
+  elif kind == 0:
+    offset = (ptr >> 2) & 0x3FFFFFFF
+    if offset & 0x20000000:
+      offset -= 0x40000000
+    data_pos, tag = ptr_pos + 8 + offset * 8, ptr
+  else:
+    return None
+  data_size = ((tag >> 32) & 0xFFFF) * 8
+  return data_pos, data_size, data_pos + data_size, tag >> 48
+
+
+class _Section:
+  """Preallocated rows holding the raw data section of one struct, one row per message"""
+  def __init__(self, size: int):
+    self.size = size
+    self._buf = bytearray(INITIAL_CAPACITY * size)
+
+  @property
+  def rows(self) -> np.ndarray:
+    return np.frombuffer(self._buf, dtype=np.uint8).reshape(-1, self.size) if self.size else np.zeros((0, 0), dtype=np.uint8)
+
+  def grow(self, capacity: int) -> None:
+    self._buf.extend(bytes(capacity * self.size - len(self._buf)))
+
+  def write(self, i: int, buf: bytes, data_pos: int, data_size: int) -> None:
+    # shorter sections (older schemas) keep their zeros, meaning defaults
+    n = min(data_size, self.size)
+    if n:
+      self._buf[i * self.size:i * self.size + n] = buf[data_pos:data_pos + n]
+
+
+class _Leaf:
+  """A primitive field stored in a data section"""
+  def __init__(self, field, section: _Section):
+    slot = field.proto.slot
+    self.kind = slot.type.which()
+    self.section = section
+    default = getattr(slot.defaultValue, self.kind)
+    if self.kind == 'bool':
+      self.offset, self.default = slot.offset, int(default)
+    elif self.kind == 'void':
+      self.offset, self.default = 0, None
+    else:
+      self.dtype = np.dtype(PRIMITIVE_DTYPES[self.kind])
+      self.offset = slot.offset * self.dtype.itemsize
+      if self.kind == 'enum':
+        self.enumerants = {v: k for k, v in field.schema.enumerants.items()}
+        default = field.schema.enumerants[str(default)] if not isinstance(default, int) else default
+      # capnp stores each value xor'd with its default
+      self.default = np.frombuffer(np.array(default, dtype=self.dtype).tobytes(), dtype=np.uint8)
+
+  def values(self, n: int, raw_enums: bool = False) -> np.ndarray:
+    if self.kind == 'void':
+      return potentially_ragged_array([None] * n)
+
+    rows = self.section.rows[:n]
+    if self.kind == 'bool':
+      if self.offset // 8 >= self.section.size:
+        return np.full(n, bool(self.default))
+      return ((rows[:, self.offset // 8] >> (self.offset % 8)) & 1 ^ self.default).astype(bool)
+
+    if self.offset + self.dtype.itemsize > self.section.size:
+      raw = np.zeros(n, dtype=self.dtype)
+    else:
+      raw = np.ascontiguousarray(rows[:, self.offset:self.offset + self.dtype.itemsize])
+    raw = (raw.reshape(n, -1) ^ self.default).view(self.dtype).ravel()
+
+    # match what numpy infers from the equivalent list of python values
+    if self.kind == 'enum' and not raw_enums:
+      return potentially_ragged_array([self.enumerants.get(v, v) for v in raw.tolist()])
+    if self.kind.startswith('float'):
+      return raw.astype(np.float64)
+    if self.kind == 'uint64' and n and raw.max() > np.iinfo(np.int64).max:
+      return potentially_ragged_array(raw.tolist())
+    return raw.astype(np.int64)
+
+
+class _Complex:
+  """Pointer fields (text, data, lists) are read through capnp, converted like to_dict(verbose=True) would"""
+  def __init__(self, field):
+    self.values: list = []
+    slot_type = field.proto.slot.type
+    self.kind = slot_type.which()
+    if self.kind == 'list':
+      self.kind = {'struct': 'struct_list', 'enum': 'enum_list', 'list': 'nested_list'}.get(slot_type.list.elementType.which(), 'list')
+
+  def convert(self, val):
+    if self.kind == 'list':
+      return list(val)
+    if self.kind == 'struct_list':
+      return [v.to_dict(verbose=True) for v in val]
+    if self.kind == 'enum_list':
+      return [str(v) for v in val]
+    if self.kind == 'nested_list':
+      return _to_dict_value(val)
+    return val
+
+
+def _to_dict_value(val):
+  if isinstance(val, capnp.lib.capnp._DynamicListReader):
+    return [_to_dict_value(v) for v in val]
+  if isinstance(val, capnp.lib.capnp._DynamicStructReader):
+    return val.to_dict(verbose=True)
+  if isinstance(val, capnp.lib.capnp._DynamicEnum):
+    return str(val)
+  return val
+
+
+class _StructPlan:
+  """
+    Field accessor plan for one struct, built once from its schema. Primitive fields are copied as raw data
+    sections into preallocated rows and decoded column-wise, pointer fields are read through capnp.
+  """
+  def __init__(self, schema, section: _Section | None = None):
+    node = schema.node.struct
+    # groups share the data section of their parent
+    self.section = section if section is not None else _Section(node.dataWordCount * 8)
+    self.sections = [self.section] if section is None else []
+    self.discriminant_offset = node.discriminantOffset * 2 if node.discriminantCount else None
+    self.needs_reader = False
+    self.has_union = self.discriminant_offset is not None
+
+    # name -> (entry, discriminant value or None, pointer index or None)
+    self.entries: dict[str, tuple] = {}
+    self.union_names: dict[int, str] = {}
+    for field in schema.fields_list:
+      proto = field.proto
+      discriminant = proto.discriminantValue if proto.discriminantValue != 0xFFFF else None
+      if discriminant is not None:
+        self.union_names[discriminant] = proto.name
+
+      if proto.which() == 'group':
+        entry = _StructPlan(field.schema, self.section)
+        ptr_index = None
+      elif proto.slot.type.which() == 'struct':
+        entry = _StructPlan(field.schema)
+        ptr_index = proto.slot.offset
+      elif proto.slot.type.which() in PRIMITIVE_DTYPES or proto.slot.type.which() in ('bool', 'void'):
+        entry = _Leaf(field, self.section)
+        ptr_index = None
+      else:
+        entry = _Complex(field)
+        ptr_index = None
+        self.needs_reader = True
+
+      if isinstance(entry, _StructPlan):
+        self.sections.extend(entry.sections)
+        self.needs_reader |= entry.needs_reader
+        self.has_union |= entry.has_union
+      self.entries[proto.name] = (entry, discriminant, ptr_index)
+
+    # only pointer fields and structs with something to copy need to be visited per message,
+    # leaves are decoded later from the data section rows
+    self.visits = [(name, *value) for name, value in self.entries.items()
+                   if isinstance(value[0], _Complex) or (isinstance(value[0], _StructPlan) and value[0].needs_visit)]
+    self.needs_visit = bool(self.visits) or (section is None and self.section.size > 0)
+
+  def discriminant(self, buf: bytes, data_pos: int, data_size: int) -> int:
+    if self.discriminant_offset is None or self.discriminant_offset + 2 > data_size:
+      return 0
+    return int.from_bytes(buf[data_pos + self.discriminant_offset:data_pos + self.discriminant_offset + 2], 'little')
+
+  def fill(self, i: int, buf: bytes, seg_starts: list[int], loc: tuple[int, int, int, int] | None, reader, own_section: bool = True) -> None:
+    if loc is None:
+      # null pointer, everything is default. Complex fields still go through the default reader
+      data_pos = data_size = ptr_pos = ptr_count = 0
+    else:
+      data_pos, data_size, ptr_pos, ptr_count = loc
+      if own_section:
+        self.section.write(i, buf, data_pos, data_size)
+
+    if not self.visits:
+      return
+    active = self.discriminant(buf, data_pos, data_size)
+    for name, entry, discriminant, ptr_index in self.visits:
+      # inactive union members are left out. If that changes between messages, columns() falls back
+      if discriminant is not None and discriminant != active:
+        continue
+
+      if isinstance(entry, _Complex):
+        entry.values.append(entry.convert(reader._get(name)))
+      else:
+        child_reader = reader._get(name) if entry.needs_reader else None
+        if ptr_index is None:
+          entry.fill(i, buf, seg_starts, loc, child_reader, own_section=False)
+        else:
+          child_loc = _resolve_struct(buf, seg_starts, ptr_pos + ptr_index * 8) if ptr_index < ptr_count else None
+          entry.fill(i, buf, seg_starts, child_loc, child_reader)
+
+  def discriminants(self, n: int) -> np.ndarray:
+    if self.discriminant_offset is None:
+      return np.zeros(n, dtype=np.uint16)
+    if self.discriminant_offset + 2 > self.section.size:
+      return np.zeros(n, dtype=np.uint16)
+    rows = self.section.rows[:n, self.discriminant_offset:self.discriminant_offset + 2]
+    return np.ascontiguousarray(rows).view('<u2').ravel()
+
+  def columns(self, n: int, prefix: str | None = None) -> dict[str, np.ndarray | list] | None:
+    """Flattened columns in to_dict() order, or None if the active union member isn't the same in every message"""
+    order = list(self.entries)
+    if self.discriminant_offset is not None:
+      discriminants = self.discriminants(n)
+      if n and not (discriminants == discriminants[0]).all():
+        return None
+      active = self.union_names.get(int(discriminants[0]) if n else 0)
+      order = [name for name in order if self.entries[name][1] is None]
+      if active is not None:
+        order.insert(0, active)
+
+    result: dict[str, np.ndarray | list] = {}
+    for name in order:
+      entry = self.entries[name][0]
+      key = name if prefix is None else f"{prefix}/{name}"
+      if isinstance(entry, _StructPlan):
+        child = entry.columns(n, key)
+        if child is None:
+          return None
+        result.update(child)
+      elif isinstance(entry, _Complex):
+        result[key] = entry.values
+      else:
+        result[key] = entry
+    return result
+
+
+def _segment_starts(buf) -> list[int]:
+  # capnp stream framing: (segment count - 1), segment sizes in words, padded to a word boundary
+  num_segments = int.from_bytes(buf[0:4], 'little') + 1
+  seg_starts = [(4 + 4 * num_segments + 7) & ~7]
+  for k in range(num_segments - 1):
+    seg_starts.append(seg_starts[-1] + int.from_bytes(buf[4 + 4 * k:8 + 4 * k], 'little') * 8)
+  return seg_starts
+
+
+class _ServicePlan:
+  def __init__(self, schema, ptr_index: int):
+    self.plan = _StructPlan(schema)
+    # pointer of the service in the Event struct
+    self.ptr_index = ptr_index
+    self.times = np.zeros(INITIAL_CAPACITY, dtype=np.float64)
+    self.valid = np.zeros(INITIAL_CAPACITY, dtype=bool)
+    self.n = 0
+    # messages are kept around in case a union changes member mid-log, which the columnar layout can't represent
+    self.messages: list | None = [] if self.plan.has_union else None
+
+  def add(self, msg, typ: str) -> None:
+    message = msg._get(typ)
+    i = self.n
+    if i == len(self.times):
+      capacity = 2 * len(self.times)
+      for section in self.plan.sections:
+        section.grow(capacity)
+      self.times = np.resize(self.times, capacity)
+      self.valid = np.resize(self.valid, capacity)
+
+    if isinstance(message, capnp.lib.capnp._DynamicStructBuilder):
+      message = message.as_reader()
+    # LogReader events carry their serialized bytes, anything else is copied out of capnp
+    buf = None if isinstance(msg, (capnp.lib.capnp._DynamicStructReader, capnp.lib.capnp._DynamicStructBuilder)) else getattr(msg, '_dat', None)
+    if buf is not None:
+      seg_starts = _segment_starts(buf)
+      event = _resolve_struct(buf, seg_starts, seg_starts[0])
+      loc = _resolve_struct(buf, seg_starts, event[2] + self.ptr_index * 8) if event is not None and self.ptr_index < event[3] else None
+    else:
+      buf = message.as_builder().to_bytes()
+      seg_starts = _segment_starts(buf)
+      loc = _resolve_struct(buf, seg_starts, seg_starts[0])
+
+    self.plan.fill(i, buf, seg_starts, loc, message if self.plan.needs_reader else None)
+    self.times[i] = msg.logMonoTime / 1.0e9
+    self.valid[i] = msg.valid
+    self.n += 1
+    if self.messages is not None:
+      self.messages.append(msg)
+
+  def time_series(self, typ: str) -> dict[str, np.ndarray]:
+    n = self.n
+    columns = self.plan.columns(n)
+    if columns is None:
+      return dicts_to_time_series(self.messages)[typ]
+
+    times = self.times[:n]
+    order = np.argsort(times)
+    group = {"t": times[order]}
+    for name, column in columns.items():
+      if isinstance(column, list):
+        group[name] = _list_column(column)[order]
+      else:
+        group[name] = column.values(n)[order]
+    group['_valid'] = self.valid[:n][order]
+    return group
+
+
+def _list_column(values: list) -> np.ndarray:
+  # per message, to_dict lists become arrays when flattened
+  return potentially_ragged_array([np.array(v) if isinstance(v, list) else v for v in values])
+
+
+def _service_plan(msg, typ: str) -> _ServicePlan | None:
+  field = msg.schema.fields[typ]
+  is_struct = field.proto.which() == 'slot' and field.proto.slot.type.which() == 'struct'
+  # TODO: support qcomGnss and ubloxGnss
+  return _ServicePlan(field.schema, field.proto.slot.offset) if is_struct and typ not in ('qcomGnss', 'ubloxGnss') else None
+
+
+def msgs_to_columns(msgs, typ: str) -> dict[str, np.ndarray | list] | None:
+  """
+    Flattened fields of messages of a single service, in message order. Primitive fields are arrays,
+    pointer fields are lists of to_dict(verbose=True) values. None if the service can't be laid out in columns.
+  """
+  plan = None
+  for msg in msgs:
+    if plan is None:
+      plan = _service_plan(msg, typ)
+      if plan is None:
+        return None
+    plan.add(msg, typ)
+  if plan is None:
+    return {}
+
+  columns = plan.plan.columns(plan.n)
+  if columns is None:
+    return None
+  return {name: column if isinstance(column, list) else column.values(plan.n) for name, column in columns.items()}
+
+
+def _read_words(buf: np.ndarray, pos: np.ndarray) -> np.ndarray:
+  return buf[pos[:, None] + np.arange(8)].view('<u8').ravel()
+
+
+def event_layouts(buf: np.ndarray, starts: np.ndarray, lengths: np.ndarray, ptr_index: int) -> tuple[np.ndarray, ...]:
+  """
+    Locates the data sections of serialized events laid out back to back in buf: the Event's own, and the one of the
+    struct behind its pointer ptr_index (empty for other pointers). Returns (ok, event start, event size, service start,
+    service size), offsets relative to the start of each event. Not ok where they can't be followed, like far pointers.
+  """
+  ends = starts + lengths
+  ok = lengths >= 16
+  if len(buf) < 16:
+    return ok, *(np.zeros(len(starts), dtype=np.int64) for _ in range(4))
+
+  def words(pos):
+    nonlocal ok
+    ok &= (pos >= starts) & (pos + 8 <= ends)
+    return _read_words(buf, np.where(ok, pos, 0))
+
+  def struct_pointer(ptr_pos, ptr):
+    offset = ((ptr >> np.uint64(2)) & np.uint64(0x3FFFFFFF)).astype(np.int64)
+    offset[offset >= 0x20000000] -= 0x40000000
+    return ptr_pos + 8 + offset * 8, ((ptr >> np.uint64(32)) & np.uint64(0xFFFF)).astype(np.int64) * 8
+
+  # capnp stream framing: (segment count - 1), segment sizes in words, padded to a word boundary
+  num_segments = (words(starts) & np.uint64(0xFFFFFFFF)).astype(np.int64) + 1
+  root_pos = starts + ((4 + 4 * np.minimum(num_segments, 1 << 20) + 7) & ~7)
+  root = words(root_pos)
+  ok &= (root & np.uint64(3)) == 0
+  event_pos, event_size = struct_pointer(root_pos, root)
+  ok &= (root >> np.uint64(48)).astype(np.int64) > ptr_index
+  ok &= event_pos + event_size <= ends
+
+  ptr_pos = event_pos + event_size + ptr_index * 8
+  ptr = words(ptr_pos)
+  kind = ptr & np.uint64(3)
+  # far pointers would need the segment table
+  ok &= kind != 2
+  is_struct = (kind == 0) & (ptr != 0)
+  service_pos, service_size = struct_pointer(ptr_pos, ptr)
+  service_pos, service_size = np.where(is_struct, service_pos, ptr_pos), np.where(is_struct, service_size, 0)
+  ok &= (service_pos >= starts) & (service_pos + service_size <= ends)
+  return ok, event_pos - starts, event_size, service_pos - starts, service_size
+
+
+def data_section_columns(schema, rows: np.ndarray) -> dict[str, tuple[np.ndarray, np.ndarray | None]]:
+  """
+    Primitive fields of a struct decoded from its raw data section, one row of bytes per message, enums as their raw
+    values. Each column comes with the rows its union member is active in, None outside of unions. Union discriminants
+    are included as _which.
+  """
+  section = _Section(rows.shape[1])
+  section._buf = bytearray(rows.tobytes())
+  n = len(rows)
+
+  def walk(schema, prefix, active):
+    node = schema.node.struct
+    offset = node.discriminantOffset * 2
+    result = {}
+    if node.discriminantCount:
+      if offset + 2 <= section.size:
+        discriminants = np.ascontiguousarray(section.rows[:n, offset:offset + 2]).view('<u2').ravel()
+      else:
+        discriminants = np.zeros(n, dtype=np.uint16)
+      result[f"{prefix}_which"] = (discriminants, active)
+
+    for field in schema.fields_list:
+      proto = field.proto
+      is_group = proto.which() == 'group'
+      if not is_group and proto.slot.type.which() not in PRIMITIVE_DTYPES and proto.slot.type.which() not in ('bool', 'void'):
+        continue
+
+      field_active = active
+      if proto.discriminantValue != 0xFFFF:
+        member = discriminants == proto.discriminantValue
+        field_active = member if active is None else active & member
+      if is_group:
+        result.update(walk(field.schema, f"{prefix}{proto.name}/", field_active))
+      else:
+        result[f"{prefix}{proto.name}"] = (_Leaf(field, section).values(n, raw_enums=True), field_active)
+    return result
+
+  return walk(schema, "", None)
+
+
+def msgs_to_time_series(msgs):
+  """
+    Convert an iterable of canonical capnp messages into a dictionary of time series.
+    Each time series has a value with key "t" which consists of monotonically increasing timestamps
+    in seconds.
+  """
+  plans: dict[str, _ServicePlan | None] = {}
+  for msg in msgs:
+    typ = msg.which()
+
+    if typ not in plans:
+      plans[typ] = _service_plan(msg, typ)
+
+    plan = plans[typ]
+    if plan is not None:
+      plan.add(msg, typ)
+
+  return {typ: plan.time_series(typ) for typ, plan in plans.items() if plan is not None}
+
+
 if __name__ == "__main__":
   import sys
   from openpilot.tools.lib.logreader import LogReader
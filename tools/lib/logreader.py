@@ -1,27 +1,41 @@
 #!/usr/bin/env python3
+import array
+import bisect
 import bz2
+import contextlib
 from functools import partial
+import itertools
+import mmap
 import multiprocessing
 import capnp
+import numpy as np
 import enum
+import hashlib
 import os
 import pathlib
+import queue
+import struct
 import sys
+import tempfile
+import threading
 import tqdm
 import urllib.parse
 import warnings
 import zstandard as zstd
 
-from collections.abc import Iterable, Iterator
+from collections.abc import Generator, Iterable, Iterator
 from typing import cast
 from urllib.parse import parse_qs, urlparse
 
-from cereal import log as capnp_log
+from cereal import CEREAL_PATH, log as capnp_log
 from openpilot.common.swaglog import cloudlog
+from openpilot.common.utils import atomic_write
+from openpilot.tools.lib.cache import cache_path_for_log_index
 from openpilot.tools.lib.filereader import FileReader
-from openpilot.tools.lib.file_sources import comma_api_source, internal_source, openpilotci_source, comma_car_segments_source, Source
+from openpilot.tools.lib.file_sources import comma_api_source, internal_source, openpilotci_source, comma_car_segments_source, FileNames, Source
 from openpilot.tools.lib.route import SegmentRange, FileName
 from openpilot.tools.lib.log_time_series import msgs_to_time_series
+from openpilot.tools.lib.url_file import CHUNK_SIZE
 
 LogMessage = type[capnp._DynamicStructReader]
 LogIterable = Iterable[LogMessage]
@@ -51,12 +65,16 @@ def decompress_stream(data: bytes):
 
 
 class CachedEventReader:
-  __slots__ = ('_evt', '_enum')
+  __slots__ = ('_evt', '_enum', '_dat')
 
-  def __init__(self, evt: capnp._DynamicStructReader, _enum: str | None = None):
-    """All capnp attribute accesses are expensive, and which() is often called multiple times"""
+  def __init__(self, evt: capnp._DynamicStructReader, _enum: str | None = None, _dat: memoryview | None = None):
+    """
+      All capnp attribute accesses are expensive, and which() is often called multiple times.
+      _dat is the serialized event, when it's known, so it can be read without copying it out of capnp.
+    """
     self._evt = evt
     self._enum: str | None = _enum
+    self._dat = _dat
 
   # fast pickle support
   def __reduce__(self):
@@ -87,10 +105,170 @@ class CachedEventReader:
     return getattr(self._evt, name)
 
 
+ZSTD_MAGIC = b'\x28\xB5\x2F\xFD'  # https://github.com/facebook/zstd/blob/dev/doc/zstd_compression_format.md#zstandard-frames
+BZ2_MAGIC = b'BZh9'
+SCAN_BATCH_SIZE = 256 * 1024
+# bump when the layout of the saved log index changes
+LOG_INDEX_VERSION = 1
+
+
+def _file_length(fn: str, dat: bytes | None = None) -> int:
+  if dat is not None:
+    return len(dat)
+  with FileReader(fn) as f:
+    return f.get_length()
+
+
+def _read_chunks(fn: str, dat: bytes | None = None, length: int | None = None, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+  if dat is not None:
+    view = memoryview(dat)
+    for i in range(0, len(view), chunk_size):
+      yield view[i:i + chunk_size]
+    return
+
+  with FileReader(fn) as f:
+    if length is None:
+      length = f.get_length()
+    if length == -1:
+      # missing remote file, let the reader raise its usual error
+      yield f.read()
+      return
+
+    pos = 0
+    while pos < length:
+      chunk = f.read(min(chunk_size, length - pos))
+      if not chunk:
+        break
+      pos += len(chunk)
+      yield chunk
+
+
+def _decompress_chunks(chunks: Iterator[bytes], ext: str | None) -> Iterator[bytes]:
+  """Incrementally decompress a bz2/zstd/raw stream, handling concatenated frames"""
+  first = next(chunks, b"")
+  if ext == ".bz2" or first[:4] == BZ2_MAGIC:
+    new_decompressor = bz2.BZ2Decompressor
+  elif ext == ".zst" or first[:4] == ZSTD_MAGIC:
+    new_decompressor = zstd.ZstdDecompressor().decompressobj
+  else:
+    # old rlogs weren't compressed
+    yield first
+    yield from chunks
+    return
+
+  decompressor = new_decompressor()
+  for chunk in itertools.chain((first,), chunks):
+    while len(chunk):
+      yield decompressor.decompress(chunk)
+      if not decompressor.eof:
+        break
+      chunk = decompressor.unused_data
+      decompressor = new_decompressor()
+
+
+U32 = struct.Struct("<I")
+U64 = struct.Struct("<Q")
+U16 = struct.Struct("<H")
+
+
+def _log_index_key(length: int, head: bytes) -> str:
+  # logs are immutable once written, their size and first chunk identify them. The index stores union field
+  # names, so it's only valid for the schema it was built with
+  key = hashlib.sha256(f"{LOG_INDEX_VERSION}:{length}:".encode())
+  with open(os.path.join(CEREAL_PATH, "log.capnp"), "rb") as f:
+    key.update(f.read())
+  key.update(head)
+  return key.hexdigest()
+
+
+def _remove_index(path: str) -> None:
+  with contextlib.suppress(FileNotFoundError):
+    os.unlink(path)
+
+
+class _EventLayout:
+  """Reads the framing, union discriminant and logMonoTime straight out of serialized Events, without decoding them"""
+  def __init__(self):
+    node = capnp_log.Event.schema.node.struct
+    self.discriminant_offset = node.discriminantOffset * 2
+    self.mono_time_offset = capnp_log.Event.schema.fields['logMonoTime'].proto.slot.offset * 8
+    self.union_fields: dict[int, str] = {capnp_log.Event.schema.fields[name].proto.discriminantValue: name
+                                         for name in capnp_log.Event.schema.union_fields}
+
+  @staticmethod
+  def segments(msg: memoryview) -> list[memoryview]:
+    # capnp stream framing: (segment count - 1), segment sizes in words, padded to a word boundary
+    num_segments = U32.unpack_from(msg)[0] + 1
+    if num_segments == 1:
+      return [msg[8:]]
+    pos = (4 + 4 * num_segments + 7) & ~7
+    segments = []
+    for size in struct.unpack_from(f"<{num_segments}I", msg, 4):
+      segments.append(msg[pos:pos + size * 8])
+      pos += size * 8
+    return segments
+
+  def peek(self, buf: bytearray, pos: int) -> tuple[int, str | None, int] | None:
+    """Returns (message size, union field, logMonoTime) for the message at pos, or None if it's incomplete"""
+    remaining = len(buf) - pos
+    if remaining < 8:
+      return None
+    num_segments = U32.unpack_from(buf, pos)[0] + 1
+    seg_start = (4 + 4 * num_segments + 7) & ~7
+    if remaining < seg_start:
+      return None
+    if num_segments == 1:
+      seg_size = U32.unpack_from(buf, pos + 4)[0] * 8
+      size = seg_start + seg_size
+    else:
+      seg_sizes = struct.unpack_from(f"<{num_segments}I", buf, pos + 4)
+      seg_size = seg_sizes[0] * 8
+      size = seg_start + sum(seg_sizes) * 8
+    if remaining < size:
+      return None
+
+    # root struct pointer: type (2 bits), signed offset in words (30 bits), data words (16 bits), pointers (16 bits)
+    root = U64.unpack_from(buf, pos + seg_start)[0] if seg_size >= 8 else 0
+    offset = (root >> 2) & 0x3FFFFFFF
+    if offset & 0x20000000:
+      offset -= 0x40000000
+    data_start = 8 + offset * 8
+    data_size = ((root >> 32) & 0xFFFF) * 8
+    if root & 3 != 0 or data_start < 0 or data_start + data_size > seg_size:
+      # far pointers and anything else unusual go through capnp
+      try:
+        with capnp_log.Event.from_bytes(bytes(buf[pos:pos + size])) as evt:
+          return size, evt.which(), evt.logMonoTime
+      except capnp.KjException:
+        return size, None, 0
+
+    data_start += pos + seg_start
+    mono_time = 0
+    if self.mono_time_offset + 8 <= data_size:
+      mono_time = U64.unpack_from(buf, data_start + self.mono_time_offset)[0]
+    discriminant = 0
+    if self.discriminant_offset + 2 <= data_size:
+      discriminant = U16.unpack_from(buf, data_start + self.discriminant_offset)[0]
+    return size, self.union_fields.get(discriminant), mono_time
+
+
 class _LogFileReader:
-  def __init__(self, fn, only_union_types=False, sort_by_time=False, dat=None):
+  """
+    Streams a log file: the file is decompressed incrementally into an anonymous temporary file while a
+    compact index of message type -> positions is built. Events are only decoded when they're yielded.
+
+    With index_cache, the index is also saved to a sidecar file keyed by the log's contents, so later
+    reads of the same file skip indexing and only decompress as far as the requested messages.
+  """
+  _layout: _EventLayout | None = None
+
+  def __init__(self, fn, only_union_types=False, sort_by_time=False, dat=None, index_cache: bool | None = None):
     self.data_version = None
+    self._fn = fn
+    self._dat = dat
     self._only_union_types = only_union_types
+    self._sort_by_time = sort_by_time
+    self._index_cache = bool(int(os.environ.get("LOGREADER_INDEX_CACHE", "0"))) if index_cache is None else index_cache
 
     ext = None
     if not dat:
@@ -98,38 +276,261 @@ class _LogFileReader:
       if ext not in ('', '.bz2', '.zst'):
         # old rlogs weren't compressed
         raise ValueError(f"unknown extension {ext}")
+    self._ext = ext
+
+    if _LogFileReader._layout is None:
+      _LogFileReader._layout = _EventLayout()
+
+    # per-message index, in file order
+    self._offsets = array.array('Q')
+    self._sizes = array.array('I')
+    self._mono_times = array.array('Q')
+    self._types: list[str | None] = []
+    # message type -> positions in the per-message index
+    self._index: dict[str | None, array.array] = {}
+    self._order: array.array | None = None
+    # whether the index covers the whole file, and how many of the indexed messages can be read
+    self._indexed = False
+    self._available = 0
+
+    self._buf = tempfile.TemporaryFile()
+    self._view: memoryview | None = None
+    self._scanner: Iterator[None] | None = self._stream()
 
-      with FileReader(fn) as f:
-        dat = f.read()
-
-    if ext == ".bz2" or dat.startswith(b'BZh9'):
-      dat = bz2.decompress(dat)
-    elif ext == ".zst" or dat.startswith(b'\x28\xB5\x2F\xFD'):
-      # https://github.com/facebook/zstd/blob/dev/doc/zstd_compression_format.md#zstandard-frames
-      dat = decompress_stream(dat)
+  def __reduce__(self):
+    return _LogFileReader, (self._fn, self._only_union_types, self._sort_by_time, self._dat, self._index_cache)
+
+  def __del__(self):
+    # readers can be dropped half way through the scan, e.g. after first()
+    if getattr(self, "_scanner", None) is not None:
+      self._scanner.close()
+    if hasattr(self, "_buf"):
+      self._buf.close()
+
+  def _stream(self) -> Iterator[None]:
+    if not self._index_cache:
+      yield from self._scan(_decompress_chunks(_read_chunks(self._fn, self._dat), self._ext))
+      return
+
+    length = _file_length(self._fn, self._dat)
+    raw_chunks = _read_chunks(self._fn, self._dat, length)
+    first = next(raw_chunks, b"")
+    raw_chunks = itertools.chain((first,), raw_chunks)
+    index_path = cache_path_for_log_index(_log_index_key(length, first))
+
+    if self._load_index(index_path):
+      if (yield from self._fill(_decompress_chunks(raw_chunks, self._ext), index_path)):
+        return
+    else:
+      yield from self._scan(_decompress_chunks(raw_chunks, self._ext))
+    self._save_index(index_path)
+
+  def _write(self, dat: bytes | bytearray | memoryview) -> None:
+    self._buf.write(dat)
+    self._buf.flush()
+
+  def _finish(self, size: int) -> None:
+    if size > 0:
+      self._view = memoryview(mmap.mmap(self._buf.fileno(), 0, access=mmap.ACCESS_READ))
+    self._buf.close()
+
+  def _scan(self, chunks: Iterator[bytes], batch_size: int = SCAN_BATCH_SIZE, file_pos: int = 0) -> Iterator[None]:
+    peek = cast(_EventLayout, self._layout).peek
+    pending = bytearray()
+    for chunk in chunks:
+      pending += chunk
+      pos = flushed = 0
+      while (peeked := peek(pending, pos)) is not None:
+        size, typ, mono_time = peeked
+        self._index.setdefault(typ, array.array('I')).append(len(self._types))
+        self._types.append(typ)
+        self._offsets.append(file_pos + pos)
+        self._sizes.append(size)
+        self._mono_times.append(mono_time)
+        pos += size
+
+        # hand over what's indexed so far, so the first results don't wait on the whole chunk
+        if pos - flushed >= batch_size:
+          self._write(pending[flushed:pos])
+          self._available = len(self._types)
+          flushed = pos
+          yield
+
+      if pos > flushed:
+        self._write(pending[flushed:pos])
+        self._available = len(self._types)
+      del pending[:pos]
+      file_pos += pos
+      if pos > flushed:
+        yield
+
+    if len(pending):
+      warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
 
-    ents = capnp_log.Event.read_multiple_bytes(dat)
+    self._indexed = True
+    self._finish(file_pos)
+
+  def _fill(self, chunks: Iterator[bytes], index_path: str) -> Generator[None, None, bool]:
+    """
+      Decompresses a file whose index was loaded from the cache. Messages are checked against the index as they
+      become readable, so if it doesn't match, nothing wrong has been handed out and indexing resumes from the
+      first mismatch. Returns whether the whole index matched.
+    """
+    peek = cast(_EventLayout, self._layout).peek
+    pending = bytearray()
+    file_pos = 0
+    num_msgs = len(self._types)
+    for chunk in chunks:
+      pending += chunk
+      pos = 0
+      i = self._available
+      matches = True
+      while (peeked := peek(pending, pos)) is not None:
+        if i == num_msgs or self._offsets[i] != file_pos + pos or peeked != (self._sizes[i], self._types[i], self._mono_times[i]):
+          matches = False
+          break
+        pos += peeked[0]
+        i += 1
+
+      if pos:
+        self._write(pending[:pos])
+        self._available = i
+        del pending[:pos]
+        file_pos += pos
+      if not matches:
+        break
+      yield
+    else:
+      if self._available == num_msgs and not len(pending):
+        self._finish(file_pos)
+        return True
+
+    cloudlog.warning(f"Log index doesn't match {self._fn}, reindexing")
+    _remove_index(index_path)
+    self._truncate_index(self._available)
+    yield from self._scan(itertools.chain((bytes(pending),), chunks), file_pos=file_pos)
+    return False
+
+  def _truncate_index(self, num_msgs: int) -> None:
+    del self._types[num_msgs:], self._offsets[num_msgs:], self._sizes[num_msgs:], self._mono_times[num_msgs:]
+    for name, positions in list(self._index.items()):
+      del positions[bisect.bisect_left(positions, num_msgs):]
+      if not len(positions):
+        del self._index[name]
+    self._indexed = False
+
+  def _load_index(self, path: str) -> bool:
+    if not os.path.exists(path):
+      return False
 
-    self._ents = []
     try:
-      for e in ents:
-        self._ents.append(CachedEventReader(e))
-    except capnp.KjException:
-      warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
-
-    if sort_by_time:
-      self._ents.sort(key=lambda x: x.logMonoTime)
+      with open(path, "rb") as f, np.load(f) as index:
+        names = [str(name) or None for name in index["names"]]
+        types = index["types"]
+        offsets, sizes, mono_times = index["offsets"], index["sizes"], index["mono_times"]
+      if not (len(types) == len(offsets) == len(sizes) == len(mono_times)) or (len(types) and not 0 <= types.min() <= types.max() < len(names)):
+        raise ValueError("inconsistent log index")
+    except Exception:
+      # a truncated or foreign file is a cache miss, it's rewritten once the log has been indexed
+      cloudlog.exception(f"failed to load log index {path}")
+      _remove_index(path)
+      return False
+
+    self._types = [names[t] for t in types.tolist()]
+    self._offsets = array.array('Q', offsets.astype(np.uint64).tobytes())
+    self._sizes = array.array('I', sizes.astype(np.uint32).tobytes())
+    self._mono_times = array.array('Q', mono_times.astype(np.uint64).tobytes())
+    for t, name in enumerate(names):
+      self._index[name] = array.array('I', np.flatnonzero(types == t).astype(np.uint32).tobytes())
+    self._indexed = True
+    return True
+
+  def _save_index(self, path: str) -> None:
+    names = list(self._index.keys())
+    codes = {name: t for t, name in enumerate(names)}
+    types = np.array([codes[typ] for typ in self._types], dtype=np.int16)
+    mono_times = np.frombuffer(self._mono_times, dtype=np.uint64)
+
+    with atomic_write(path, mode="wb", overwrite=True) as f:
+      np.savez(f,
+               names=np.array([name or "" for name in names]),
+               counts=np.array([len(self._index[name]) for name in names], dtype=np.uint32),
+               first_mono_times=np.array([mono_times[self._index[name][0]] for name in names], dtype=np.uint64),
+               last_mono_times=np.array([mono_times[self._index[name][-1]] for name in names], dtype=np.uint64),
+               types=types,
+               offsets=np.frombuffer(self._offsets, dtype=np.uint64),
+               sizes=np.frombuffer(self._sizes, dtype=np.uint32),
+               mono_times=mono_times)
+
+  def _advance(self) -> bool:
+    if self._scanner is None:
+      return False
+    if next(self._scanner, False) is False:
+      self._scanner = None
+    return True
+
+  def _scan_all(self) -> None:
+    while self._advance():
+      pass
+
+  def _positions(self, msg_type: str) -> Iterator[int]:
+    if self._sort_by_time:
+      self._scan_all()
+      yield from sorted(self._index.get(msg_type, ()), key=self._mono_times.__getitem__)
+      return
+
+    i = 0
+    while True:
+      positions = self._index.get(msg_type, ())
+      while i < len(positions) and positions[i] < self._available:
+        yield positions[i]
+        i += 1
+      if (self._indexed and i == len(positions)) or not self._advance():
+        return
+
+  def _read(self, start: int, size: int) -> memoryview:
+    if self._view is not None:
+      return self._view[start:start + size]
+    return memoryview(os.pread(self._buf.fileno(), size, start))
+
+  def _event(self, i: int) -> CachedEventReader:
+    dat = self._read(self._offsets[i], self._sizes[i])
+    # from_segments keeps the message alive for as long as the reader is, without copying it
+    return CachedEventReader(capnp_log.Event.from_segments(_EventLayout.segments(dat)), self._types[i], dat)
 
   def __iter__(self) -> Iterator[capnp._DynamicStructReader]:
-    for ent in self._ents:
-      if self._only_union_types:
-        try:
-          ent.which()
-          yield ent
-        except capnp.lib.capnp.KjException:
-          pass
-      else:
-        yield ent
+    if self._sort_by_time:
+      self._scan_all()
+      if self._order is None:
+        self._order = array.array('I', sorted(range(len(self._types)), key=self._mono_times.__getitem__))
+      events = (self._event(i) for i in self._order)
+    else:
+      events = self._iter_file_order()
+
+    for evt in events:
+      if self._only_union_types and evt._enum is None:
+        continue
+      yield evt
+
+  def _iter_file_order(self) -> Iterator[CachedEventReader]:
+    # decode each contiguous run of indexed messages in one go
+    i = 0
+    while True:
+      end = self._available
+      if i < end:
+        start = self._offsets[i]
+        dat = self._read(start, self._offsets[end - 1] + self._sizes[end - 1] - start)
+        for k, evt in enumerate(capnp_log.Event.read_multiple_bytes(dat), i):
+          pos = self._offsets[k] - start
+          yield CachedEventReader(evt, self._types[k], dat[pos:pos + self._sizes[k]])
+        i = end
+      elif not self._advance():
+        return
+
+  def filter(self, msg_type: str) -> Iterator[capnp._DynamicStructReader]:
+    """Only decodes the events of the requested type"""
+    for i in self._positions(msg_type):
+      yield self._event(i)
 
 
 class ReadMode(enum.StrEnum):
@@ -147,6 +548,13 @@ def direct_source(file_or_url: str) -> list[str]:
   return [file_or_url]
 
 
+def _probe_source(results: queue.Queue, i: int, source: Source, sr: SegmentRange, seg_idxs: list[int], fns: FileNames) -> None:
+  try:
+    results.put((i, source(sr, seg_idxs, fns), None))
+  except Exception as e:
+    results.put((i, None, e))
+
+
 # TODO this should apply to camera files as well
 def auto_source(identifier: str, sources: list[Source], default_mode: ReadMode) -> list[str]:
   exceptions = {}
@@ -168,24 +576,35 @@ def auto_source(identifier: str, sources: list[Source], default_mode: ReadMode)
   # This function only returns when we've sourced all files, or throws an exception
   valid_files: dict[int, str] = {}
   for fn in try_fns:
-    for source in sources:
-      try:
-        files = source(sr, needed_seg_idxs, fn)
-
-        # Build a dict of valid files
-        valid_files |= files
-
-        # Don't check for segment files that have already been found
-        needed_seg_idxs = [idx for idx in needed_seg_idxs if idx not in valid_files]
-
-        # We've found all files, return them
-        if len(needed_seg_idxs) == 0:
-          return cast(list[str], list(valid_files.values()))
-        else:
-          raise FileNotFoundError(f"Did not find {fn} for seg idxs {needed_seg_idxs} of {sr.route_name}")
-
-      except Exception as e:
-        exceptions[source.__name__] = e
+    # Probe all sources at once, stopping as soon as the ones that finished cover every missing segment.
+    # Earlier sources in the list take precedence for segments found by several
+    found: dict[int, dict[int, str]] = {}
+    results: queue.Queue[tuple[int, dict[int, str] | None, Exception | None]] = queue.Queue()
+    for i, source in enumerate(sources):
+      # Daemon threads, probes still running once every segment is found don't hold up interpreter exit
+      threading.Thread(target=_probe_source, args=(results, i, source, sr, needed_seg_idxs, fn), daemon=True).start()
+    for _ in sources:
+      i, files, exc = results.get()
+      if files is None:
+        exceptions[sources[i].__name__] = exc
+        continue
+      found[i] = files
+
+      missing = [idx for idx in needed_seg_idxs if idx not in found[i]]
+      if len(missing):
+        exceptions[sources[i].__name__] = FileNotFoundError(f"Did not find {fn} for seg idxs {missing} of {sr.route_name}")
+      if all(any(idx in files for files in found.values()) for idx in needed_seg_idxs):
+        break
+
+    for i in sorted(found):
+      valid_files |= {idx: url for idx, url in found[i].items() if idx in needed_seg_idxs and idx not in valid_files}
+
+    # Don't check for segment files that have already been found
+    needed_seg_idxs = [idx for idx in needed_seg_idxs if idx not in valid_files]
+
+    # We've found all files, return them
+    if len(needed_seg_idxs) == 0:
+      return [valid_files[idx] for idx in sr.seg_idxs]
 
     if fn == try_fns[0]:
       missing_logs = len(needed_seg_idxs)
@@ -231,6 +650,30 @@ def parse_direct(identifier: str):
   return None
 
 
+# Per-process state of run_across_segments workers. Kept for the worker's lifetime, along with
+# other process-wide caches (URLFile cache usage, capnp layout), so they're reused across segments
+_worker_identifiers: list[str] = []
+_worker_lr_kwargs: dict = {}
+
+
+def _init_segment_worker(identifiers: list[str], lr_kwargs: dict):
+  global _worker_identifiers, _worker_lr_kwargs
+  _worker_identifiers = identifiers
+  _worker_lr_kwargs = lr_kwargs
+
+
+def _run_on_worker_segment(func, i):
+  return func(_LogFileReader(_worker_identifiers[i], **_worker_lr_kwargs))
+
+
+def _put_result(results: queue.Queue, i: int, ret):
+  results.put((i, ret, None))
+
+
+def _put_error(results: queue.Queue, i: int, exc: BaseException):
+  results.put((i, None, exc))
+
+
 class LogReader:
   def _parse_identifier(self, identifier: str) -> list[str]:
     # useradmin, etc.
@@ -245,7 +688,7 @@ class LogReader:
     return identifiers
 
   def __init__(self, identifier: str | list[str], default_mode: ReadMode = ReadMode.RLOG,
-               sources: list[Source] = None, sort_by_time=False, only_union_types=False):
+               sources: list[Source] = None, sort_by_time=False, only_union_types=False, index_cache: bool | None = None):
     if sources is None:
       sources = [internal_source, comma_api_source, openpilotci_source, comma_car_segments_source]
 
@@ -257,29 +700,64 @@ class LogReader:
 
     self.sort_by_time = sort_by_time
     self.only_union_types = only_union_types
+    self.index_cache = index_cache
 
     self.__lrs: dict[int, _LogFileReader] = {}
     self.reset()
 
   def _get_lr(self, i):
     if i not in self.__lrs:
-      self.__lrs[i] = _LogFileReader(self.logreader_identifiers[i], sort_by_time=self.sort_by_time, only_union_types=self.only_union_types)
+      self.__lrs[i] = _LogFileReader(self.logreader_identifiers[i], sort_by_time=self.sort_by_time, only_union_types=self.only_union_types,
+                                     index_cache=self.index_cache)
     return self.__lrs[i]
 
   def __iter__(self):
     for i in range(len(self.logreader_identifiers)):
       yield from self._get_lr(i)
 
-  def _run_on_segment(self, func, i):
-    return func(self._get_lr(i))
+  def iter_across_segments(self, num_processes, func, ordered=True, max_in_flight=None) -> Iterator:
+    """
+      Yields func's result for each segment as soon as it's available, in segment order or in order of completion.
+      At most max_in_flight segments (default 2 per process) are queued, running or waiting to be yielded at once.
+    """
+    num_segs = len(self.logreader_identifiers)
+    max_in_flight = max(max_in_flight or 2 * num_processes, 1)
+    results: queue.Queue = queue.Queue()
+    lr_kwargs = {'sort_by_time': self.sort_by_time, 'only_union_types': self.only_union_types, 'index_cache': self.index_cache}
+
+    # workers are handed the segment list once, so each task only sends an index
+    with multiprocessing.Pool(num_processes, initializer=_init_segment_worker, initargs=(self.logreader_identifiers, lr_kwargs)) as pool:
+      def submit(i):
+        pool.apply_async(_run_on_worker_segment, (func, i), callback=partial(_put_result, results, i),
+                         error_callback=partial(_put_error, results, i))
+
+      submitted = 0
+      done: dict[int, object] = {}
+      next_idx = 0
+      while next_idx < num_segs:
+        while submitted < num_segs and submitted - next_idx < max_in_flight:
+          submit(submitted)
+          submitted += 1
+
+        i, ret, exc = results.get()
+        if exc is not None:
+          raise exc
+        if not ordered:
+          next_idx += 1
+          yield ret
+          continue
+
+        done[i] = ret
+        while next_idx in done:
+          yield done.pop(next_idx)
+          next_idx += 1
 
   def run_across_segments(self, num_processes, func, disable_tqdm=False, desc=None):
-    with multiprocessing.Pool(num_processes) as pool:
-      ret = []
-      num_segs = len(self.logreader_identifiers)
-      for p in tqdm.tqdm(pool.imap(partial(self._run_on_segment, func), range(num_segs)), total=num_segs, disable=disable_tqdm, desc=desc):
-        ret.extend(p)
-      return ret
+    ret = []
+    num_segs = len(self.logreader_identifiers)
+    for p in tqdm.tqdm(self.iter_across_segments(num_processes, func), total=num_segs, disable=disable_tqdm, desc=desc):
+      ret.extend(p)
+    return ret
 
   def reset(self):
     self.logreader_identifiers = []
@@ -291,7 +769,9 @@ class LogReader:
     return _LogFileReader("", dat=dat)
 
   def filter(self, msg_type: str):
-    return (getattr(m, m.which()) for m in filter(lambda m: m.which() == msg_type, self))
+    for i in range(len(self.logreader_identifiers)):
+      for m in self._get_lr(i).filter(msg_type):
+        yield getattr(m, msg_type)
 
   def first(self, msg_type: str):
     return next(self.filter(msg_type), None)
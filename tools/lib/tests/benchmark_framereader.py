@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import time
+
+from openpilot.tools.lib.framereader import FrameReader, get_video_index
+
+DEMO_VIDEO = "https://commadataci.blob.core.windows.net/openpilotci/0375fdf7b1ce594d/2019-06-13--08-32-25/3/fcamera.hevc"
+
+
+def time_sequential(fn: str, index_data: dict, frames: int, streaming: bool) -> float:
+  fr = FrameReader(fn, index_data, pix_fmt="nv12", streaming=streaming)
+  st = time.monotonic()
+  for i in range(min(frames, fr.frame_count)):
+    fr.get(i)
+  return time.monotonic() - st
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Time reading a video frame by frame, with a decoder per GOP and with one streaming decoder")
+  parser.add_argument("video", nargs="?", default=DEMO_VIDEO, help="hevc file or url")
+  parser.add_argument("--frames", type=int, default=1200, help="number of frames to read")
+  args = parser.parse_args()
+
+  # keep downloads and hardware decoding out of the measurement
+  os.environ["FILEREADER_CACHE"] = "1"
+  os.environ.setdefault("FFMPEG_THREADS", "1")
+  index_data = get_video_index(args.video)
+
+  per_gop = time_sequential(args.video, index_data, args.frames, streaming=False)
+  streaming = time_sequential(args.video, index_data, args.frames, streaming=True)
+
+  print(f"reading {args.frames} frames sequentially")
+  print(f"  decoder per GOP:  {per_gop:.2f} s")
+  print(f"  streaming:        {streaming:.2f} s")
+  print(f"  speedup: {per_gop / streaming:.1f}x")
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+from openpilot.tools.lib.log_time_series import dicts_to_time_series, msgs_to_time_series
+from openpilot.tools.lib.logreader import LogReader
+
+DEMO_LOG = "https://commadataci.blob.core.windows.net/openpilotci/0375fdf7b1ce594d/2019-06-13--08-32-25/3/qlog.bz2"
+
+
+def time_conversion(fn, msgs) -> float:
+  st = time.monotonic()
+  fn(msgs)
+  return time.monotonic() - st
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Time to convert a log to time series, with and without to_dict()")
+  parser.add_argument("log", nargs="?", default=DEMO_LOG, help="log file or url")
+  parser.add_argument("-n", type=int, default=3, help="number of runs")
+  args = parser.parse_args()
+
+  msgs = list(LogReader(args.log))
+  baseline = [time_conversion(dicts_to_time_series, msgs) for _ in range(args.n)]
+  schema_plan = [time_conversion(msgs_to_time_series, msgs) for _ in range(args.n)]
+
+  print(f"converting {len(msgs)} messages over {args.n} runs")
+  print(f"  to_dict:     {min(baseline) * 1e3:.1f} ms min, {sum(baseline) / len(baseline) * 1e3:.1f} ms mean")
+  print(f"  schema plan: {min(schema_plan) * 1e3:.1f} ms min, {sum(schema_plan) / len(schema_plan) * 1e3:.1f} ms mean")
+  print(f"  speedup: {min(baseline) / min(schema_plan):.1f}x")
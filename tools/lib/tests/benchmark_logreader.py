@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import tempfile
+import time
+
+from openpilot.tools.lib import cache, logreader
+from openpilot.tools.lib.logreader import LogReader
+
+DEMO_LOG = "https://commadataci.blob.core.windows.net/openpilotci/0375fdf7b1ce594d/2019-06-13--08-32-25/3/qlog.bz2"
+
+
+def time_first(log: str, msg_type: str, index_cache: bool) -> float:
+  st = time.monotonic()
+  LogReader(log, index_cache=index_cache).first(msg_type)
+  return time.monotonic() - st
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Time to first message with a cold and a warm log index")
+  parser.add_argument("log", nargs="?", default=DEMO_LOG, help="log file or url")
+  parser.add_argument("--msg-type", default="carParams")
+  parser.add_argument("-n", type=int, default=5, help="number of runs")
+  args = parser.parse_args()
+
+  # keep remote reads out of the measurement
+  os.environ["FILEREADER_CACHE"] = "1"
+  len(list(LogReader(args.log)))
+
+  with tempfile.TemporaryDirectory() as cache_dir:
+    # start from an empty index cache, without touching the real one
+    logreader.cache_path_for_log_index = lambda key: cache.cache_path_for_log_index(key, cache_dir=cache_dir)
+    cold = [time_first(args.log, args.msg_type, index_cache=False) for _ in range(args.n)]
+
+    st = time.monotonic()
+    len(list(LogReader(args.log, index_cache=True)))
+    build = time.monotonic() - st
+
+    warm = [time_first(args.log, args.msg_type, index_cache=True) for _ in range(args.n)]
+
+  print(f"time to first {args.msg_type} over {args.n} runs")
+  print(f"  cold index: {min(cold) * 1e3:.1f} ms min, {sum(cold) / len(cold) * 1e3:.1f} ms mean")
+  print(f"  warm index: {min(warm) * 1e3:.1f} ms min, {sum(warm) / len(warm) * 1e3:.1f} ms mean")
+  print(f"  building the index took {build * 1e3:.1f} ms")
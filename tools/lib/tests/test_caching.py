@@ -6,7 +6,7 @@ import pytest
 
 from openpilot.selfdrive.test.helpers import http_server_context
 from openpilot.system.hardware.hw import Paths
-from openpilot.tools.lib.url_file import URLFile
+from openpilot.tools.lib.url_file import CHUNK_SIZE, URLFile
 
 
 class CachingTestRequestHandler(http.server.BaseHTTPRequestHandler):
@@ -28,11 +28,47 @@ class CachingTestRequestHandler(http.server.BaseHTTPRequestHandler):
     self.end_headers()
 
 
+class RangeTestRequestHandler(http.server.BaseHTTPRequestHandler):
+  DATA = bytes(range(256)) * (8 * CHUNK_SIZE // 256)
+  def log_message(self, *args):
+    pass
+
+  def do_GET(self):
+    start, end = 0, len(self.DATA) - 1
+    if "Range" in self.headers:
+      start_str, end_str = self.headers["Range"].removeprefix("bytes=").split("-")
+      start, end = int(start_str), min(int(end_str), end)
+    self.send_response(206 if "Range" in self.headers else 200)
+    self.send_header("Content-Length", str(end - start + 1))
+    self.end_headers()
+    self.wfile.write(self.DATA[start:end + 1])
+
+  def do_HEAD(self):
+    self.send_response(200)
+    self.send_header("Content-Length", str(len(self.DATA)))
+    self.end_headers()
+
+
 @pytest.fixture
 def host():
   with http_server_context(handler=CachingTestRequestHandler) as (host, port):
     yield f"http://{host}:{port}"
 
+
+@pytest.fixture
+def range_host():
+  with http_server_context(handler=RangeTestRequestHandler, server_class=http.server.ThreadingHTTPServer) as (host, port):
+    yield f"http://{host}:{port}"
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+  monkeypatch.setenv("COMMA_CACHE", str(tmp_path))
+  URLFile.reset()
+  yield tmp_path
+  URLFile.reset()
+
+
 class TestFileDownload:
 
   def test_pipeline_defaults(self, host):
@@ -128,3 +164,54 @@ class TestFileDownload:
     CachingTestRequestHandler.FILE_EXISTS = True
     length = URLFile(file_url).get_length()
     assert length == 4
+
+  def test_cache_size_limit(self, range_host, cache_dir):
+    f = URLFile(f"{range_host}/large.bin", cache=True, cache_size=3)
+    for pos in range(0, len(RangeTestRequestHandler.DATA), CHUNK_SIZE // 2):
+      assert f.read(ll=CHUNK_SIZE // 2) == RangeTestRequestHandler.DATA[pos:pos + CHUNK_SIZE // 2]
+      # read-ahead may still be writing a chunk or two past the limit
+      usage = sum(p.stat().st_size for p in cache_dir.iterdir())
+      assert usage <= (3 + 2) * CHUNK_SIZE
+
+    # least recently used chunks are gone, the last ones read are still cached
+    URLFile.executor().shutdown(wait=True)
+    assert sum(p.stat().st_size for p in cache_dir.iterdir()) <= 3 * CHUNK_SIZE
+    assert os.path.exists(f._chunk_path(len(RangeTestRequestHandler.DATA) - CHUNK_SIZE))
+    assert not os.path.exists(f._chunk_path(0))
+
+  def test_readahead(self, range_host, cache_dir):
+    data = RangeTestRequestHandler.DATA
+    num_chunks = len(data) // CHUNK_SIZE
+    prefetched = URLFile(f"{range_host}/prefetched.bin", cache=True, readahead=4)
+    serial = URLFile(f"{range_host}/serial.bin", cache=True, readahead=0)
+
+    def requested(f, chunk):
+      path = f._chunk_path(chunk * CHUNK_SIZE)
+      # downloads write their chunk before they're dropped from the pending ones
+      with URLFile._pending_lock:
+        if path in URLFile._pending:
+          return True
+      return os.path.exists(path)
+
+    for i in range(num_chunks):
+      expected = data[i * CHUNK_SIZE:(i + 1) * CHUNK_SIZE]
+      assert prefetched.read(ll=CHUNK_SIZE) == expected
+      assert serial.read(ll=CHUNK_SIZE) == expected
+
+      # the next chunks are already on their way before the sequential read gets to them, but not past the end
+      assert all(requested(prefetched, j) for j in range(i + 1, min(i + 5, num_chunks)))
+      assert not requested(prefetched, num_chunks)
+      assert i + 1 == num_chunks or not requested(serial, i + 1)
+
+  def test_cache_size_limit_shared_dir(self, range_host, cache_dir):
+    # other tools share COMMA_CACHE, eviction only touches chunks
+    (cache_dir / "other").mkdir()
+    (cache_dir / "other" / "data").write_bytes(b"x" * CHUNK_SIZE)
+    (cache_dir / "notes.txt").write_bytes(b"x" * CHUNK_SIZE)
+
+    f = URLFile(f"{range_host}/large.bin", cache=True, cache_size=2, readahead=0)
+    data = RangeTestRequestHandler.DATA
+    assert f.read() == data
+    assert (cache_dir / "other" / "data").exists()
+    assert (cache_dir / "notes.txt").exists()
+    assert not os.path.exists(f._chunk_path(0))
@@ -0,0 +1,311 @@
+import os
+import random
+import shutil
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from openpilot.tools.lib import framereader
+from openpilot.tools.lib.framereader import (FfmpegDecoder, LRUCache, evict_video_index_cache, get_video_index, load_video_index,
+                                             save_video_index, yuv_to_rgb)
+from openpilot.tools.lib.url_file import URLFileException
+from openpilot.tools.lib.vidindex import (HEVC_CODED_SLICE_SEGMENT_NAL_UNITS, HEVC_PARAMETER_SET_NAL_UNITS, HevcNalUnitType,
+                                          VideoFileInvalid, get_hevc_nal_unit_length, get_hevc_nal_unit_type, get_hevc_slice_type,
+                                          hevc_index, require_nal_unit_start)
+
+PROBE = {'streams': [{'width': 64, 'height': 32}]}
+# stands in for ffmpeg, each "frame" in the file is passed through as one decoded rgb24 frame
+CAT_DECODER = [sys.executable, "-c", "import shutil, sys; shutil.copyfileobj(sys.stdin.buffer, sys.stdout.buffer)"]
+SLICE_TYPE_BITS = {0: "1", 1: "010", 2: "011", 3: "00100"}
+
+
+def hevc_index_walk(dat: bytes, allow_corrupt: bool = False) -> tuple[list, int, bytes]:
+  # hevc_index before it was vectorized, visits every NAL unit in turn
+  prefix_dat = b""
+  frame_types = list()
+  i = 1
+  try:
+    while i < len(dat):
+      require_nal_unit_start(dat, i)
+      nal_unit_len = get_hevc_nal_unit_length(dat, i)
+      nal_unit_type = get_hevc_nal_unit_type(dat, i)
+      if nal_unit_type in HEVC_PARAMETER_SET_NAL_UNITS:
+        prefix_dat += dat[i:i+nal_unit_len]
+      elif nal_unit_type in HEVC_CODED_SLICE_SEGMENT_NAL_UNITS:
+        slice_type, is_first_slice = get_hevc_slice_type(dat, i, nal_unit_type)
+        if is_first_slice:
+          frame_types.append((slice_type, i))
+      i += nal_unit_len
+  except Exception:
+    if not allow_corrupt:
+      raise
+  return frame_types, len(dat), prefix_dat
+
+
+def nal_unit(rng: random.Random, nal_type: int, rbsp_bits: str = "") -> bytes:
+  # payload bytes are never zero, so they can't form a start code
+  bits = rbsp_bits + "1" * (-len(rbsp_bits) % 8)
+  rbsp = int(bits, 2).to_bytes(len(bits) // 8, "big") if bits else b""
+  return b"\x00\x00\x01" + bytes([nal_type << 1, 1]) + rbsp + bytes(rng.randint(1, 255) for _ in range(rng.randint(0, 40)))
+
+
+def slice_unit(rng: random.Random, nal_type: int, slice_type: int, first: bool) -> bytes:
+  if not first:
+    return nal_unit(rng, nal_type, "0")
+  no_output_of_prior_pics = "0" if HevcNalUnitType.BLA_W_LP <= nal_type <= HevcNalUnitType.RSV_IRAP_VCL23 else ""
+  # first_slice_segment_in_pic_flag, no_output_of_prior_pics_flag, slice_pic_parameter_set_id=0, slice_type
+  return nal_unit(rng, nal_type, "1" + no_output_of_prior_pics + "1" + SLICE_TYPE_BITS[slice_type])
+
+
+def make_hevc(seed: int, frames: int = 50, slices: int = 3) -> bytes:
+  rng = random.Random(seed)
+  units = [nal_unit(rng, t) for t in HEVC_PARAMETER_SET_NAL_UNITS]
+  for i in range(frames):
+    nal_type = HevcNalUnitType.IDR_W_RADL if i % 20 == 0 else rng.choice((HevcNalUnitType.TRAIL_R, HevcNalUnitType.CRA_NUT))
+    slice_type = 2 if i % 20 == 0 else rng.randint(0, 1)
+    if rng.random() < 0.1:
+      units.append(nal_unit(rng, HevcNalUnitType.PREFIX_SEI_NUT))
+    units += [slice_unit(rng, nal_type, slice_type, first=j == 0) for j in range(slices)]
+  return b"\x00" + b"".join(units)
+
+
+def hevc_variants():
+  for seed in range(5):
+    dat = make_hevc(seed)
+    yield f"valid-{seed}", dat
+    yield f"truncated-{seed}", dat[:-(len(dat) % 97) - 50] + b"\x00\x00\x01\x02"
+    yield f"cut-header-{seed}", dat + b"\x00\x00\x01\x02"
+    # a first slice with slice_type 3
+    yield f"bad-slice-{seed}", dat + slice_unit(random.Random(seed), HevcNalUnitType.TRAIL_R, 3, first=True) + make_hevc(seed + 10)[1:]
+  yield "not-a-start-code", b"\x00\x00\x02\x01" + make_hevc(0)[4:]
+
+
+class TestHevcIndex:
+  @pytest.mark.parametrize("allow_corrupt", [False, True])
+  @pytest.mark.parametrize("name,dat", list(hevc_variants()), ids=lambda v: v if isinstance(v, str) else "")
+  def test_matches_nal_walk(self, tmp_path, name, dat, allow_corrupt):
+    fn = tmp_path / "video.hevc"
+    fn.write_bytes(dat)
+
+    try:
+      expected = hevc_index_walk(dat, allow_corrupt)
+    except Exception as e:
+      with pytest.raises(type(e)):
+        hevc_index(str(fn), allow_corrupt)
+      return
+
+    assert hevc_index(str(fn), allow_corrupt) == expected
+    if name.startswith("valid"):
+      frame_types, _, prefix = expected
+      assert len(frame_types) == 50
+      assert len(prefix) > 0
+
+  def test_too_short(self, tmp_path):
+    fn = tmp_path / "video.hevc"
+    fn.write_bytes(b"\x00\x00")
+    with pytest.raises(VideoFileInvalid):
+      hevc_index(str(fn), allow_corrupt=True)
+
+
+class TestVideoIndexCache:
+  def index_data(self, frames=10):
+    return {
+      'index': np.array([(i % 3, i * 100) for i in range(frames)] + [(0xFFFFFFFF, frames * 100)], dtype=np.uint32),
+      'global_prefix': b"\x00\x00\x01\x40\x01",
+      'probe': PROBE,
+    }
+
+  def test_round_trip(self, tmp_path):
+    path = str(tmp_path / "index.npz")
+    index_data = self.index_data()
+    save_video_index(path, index_data)
+
+    loaded = load_video_index(path)
+    assert loaded is not None
+    np.testing.assert_array_equal(loaded['index'], index_data['index'])
+    assert loaded['index'].dtype == np.uint32
+    assert loaded['global_prefix'] == index_data['global_prefix']
+    assert loaded['probe'] == index_data['probe']
+
+  @pytest.mark.parametrize("contents", [b"", b"PK\x05\x06" + bytes(18), b"not an npz"])
+  def test_corrupt(self, tmp_path, contents):
+    path = tmp_path / "index.npz"
+    path.write_bytes(contents)
+    assert load_video_index(str(path)) is None
+    assert not path.exists()
+
+  def test_truncated(self, tmp_path):
+    path = tmp_path / "index.npz"
+    save_video_index(str(path), self.index_data())
+    path.write_bytes(path.read_bytes()[:-20])
+    assert load_video_index(str(path)) is None
+    assert not path.exists()
+
+  def test_missing(self, tmp_path):
+    assert load_video_index(str(tmp_path / "index.npz")) is None
+
+  def test_get_video_index(self, tmp_path, mocker):
+    fn = tmp_path / "video.hevc"
+    fn.write_bytes(make_hevc(0))
+    mocker.patch("openpilot.tools.lib.framereader.cache_path_for_video_index", lambda key: str(tmp_path / f"{key}.npz"))
+    mocker.patch("openpilot.tools.lib.framereader.ffprobe", return_value=PROBE)
+
+    # off unless asked for
+    get_video_index(str(fn))
+    assert not list(tmp_path.glob("*.npz"))
+
+    built = get_video_index(str(fn), cache=True)
+    assert len(list(tmp_path.glob("*.npz"))) == 1
+
+    index_spy = mocker.spy(framereader, "hevc_index")
+    cached = get_video_index(str(fn), cache=True)
+    assert index_spy.call_count == 0
+    np.testing.assert_array_equal(cached['index'], built['index'])
+    assert cached['global_prefix'] == built['global_prefix']
+
+    # a corrupt entry is rebuilt
+    next(tmp_path.glob("*.npz")).write_bytes(b"garbage")
+    rebuilt = get_video_index(str(fn), cache=True)
+    assert index_spy.call_count == 1
+    np.testing.assert_array_equal(rebuilt['index'], built['index'])
+    assert load_video_index(str(next(tmp_path.glob("*.npz")))) is not None
+
+  def test_eviction(self, tmp_path):
+    paths = [str(tmp_path / f"{i}.npz") for i in range(5)]
+    for i, path in enumerate(paths):
+      save_video_index(path, self.index_data(frames=10000))
+      os.utime(path, (i, i))
+    size = os.path.getsize(paths[0])
+
+    # a read makes the oldest entry the most recently used
+    assert load_video_index(paths[0]) is not None
+    evict_video_index_cache(str(tmp_path), max_size=2.5 * size / 1e6)
+    assert [os.path.exists(p) for p in paths] == [True, False, False, False, True]
+
+
+class FailingReader:
+  # reads the first GOP, then fails like a dropped connection
+  def __init__(self, fn):
+    self.f = open(fn, "rb")
+    self.reads = 0
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.f.close()
+
+  def seek(self, pos):
+    self.f.seek(pos)
+
+  def read(self, size):
+    self.reads += 1
+    if self.reads > 1:
+      raise URLFileException("connection reset")
+    return self.f.read(size)
+
+
+class TestStreamingDecoder:
+  W, H, FRAMES, GOP = 4, 2, 20, 5
+
+  def decoder(self, tmp_path) -> tuple[FfmpegDecoder, np.ndarray]:
+    frame_size = self.W * self.H * 3
+    frames = np.random.default_rng(0).integers(0, 256, (self.FRAMES, self.H, self.W, 3), dtype=np.uint8)
+    fn = tmp_path / "video.hevc"
+    fn.write_bytes(frames.tobytes())
+    index = [(2 if i % self.GOP == 0 else 1, i * frame_size) for i in range(self.FRAMES)]
+    index_data = {
+      'index': np.array(index + [(0xFFFFFFFF, self.FRAMES * frame_size)], dtype=np.uint32),
+      'global_prefix': b"",
+      'probe': {'streams': [{'width': self.W, 'height': self.H}]},
+    }
+    return FfmpegDecoder(str(fn), index_data), frames
+
+  def test_frames(self, tmp_path, mocker):
+    mocker.patch("openpilot.tools.lib.framereader.ffmpeg_decode_args", return_value=CAT_DECODER)
+    dec, frames = self.decoder(tmp_path)
+    out = list(dec.get_iterator(3, 17, frame_skip=2))
+    assert [fidx for fidx, _ in out] == list(range(3, 17, 2))
+    for fidx, frame in out:
+      np.testing.assert_array_equal(frame, frames[fidx])
+
+  def test_read_error(self, tmp_path, mocker):
+    mocker.patch("openpilot.tools.lib.framereader.ffmpeg_decode_args", return_value=CAT_DECODER)
+    mocker.patch("openpilot.tools.lib.framereader.FileReader", FailingReader)
+    dec, _ = self.decoder(tmp_path)
+    seen = []
+    with pytest.raises(URLFileException):
+      for fidx, _ in dec.get_iterator():
+        seen.append(fidx)
+    # the GOP that was read still decodes
+    assert seen == list(range(self.GOP))
+
+  def test_decoder_error(self, tmp_path, mocker):
+    mocker.patch("openpilot.tools.lib.framereader.ffmpeg_decode_args", return_value=[sys.executable, "-c", "import sys; sys.exit(1)"])
+    dec, _ = self.decoder(tmp_path)
+    with pytest.raises(subprocess.CalledProcessError):
+      list(dec.get_iterator())
+
+
+class TestLRUCache:
+  def test_capacity(self):
+    cache = LRUCache(3)
+    for i in range(5):
+      cache[i] = np.zeros(10, dtype=np.uint8)
+    assert [i in cache for i in range(5)] == [False, False, True, True, True]
+    assert cache.nbytes == 30
+
+  def test_max_bytes(self):
+    cache = LRUCache(100, max_bytes=100)
+    for i in range(4):
+      cache[i] = np.zeros(30, dtype=np.uint8)
+    assert [i in cache for i in range(4)] == [False, True, True, True]
+    assert cache.nbytes == 90
+
+    # reading an entry makes it the most recently used
+    cache[1]
+    cache[4] = np.zeros(30, dtype=np.uint8)
+    assert [i in cache for i in range(5)] == [False, True, False, True, True]
+    assert cache.nbytes == 90
+
+    # replacing an entry accounts for its new size
+    cache[1] = np.zeros(50, dtype=np.uint8)
+    assert [i in cache for i in range(5)] == [False, True, False, False, True]
+    assert cache.nbytes == 80
+
+  def test_newest_kept(self):
+    cache = LRUCache(100, max_bytes=100)
+    cache[0] = np.zeros(30, dtype=np.uint8)
+    cache[1] = np.zeros(500, dtype=np.uint8)
+    assert 0 not in cache and 1 in cache
+    assert len(cache) == 1 and cache.nbytes == 500
+
+    cache[2] = np.zeros(10, dtype=np.uint8)
+    assert 1 not in cache and 2 in cache
+    assert cache.nbytes == 10
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg not installed")
+class TestYuvToRgb:
+  W, H = 64, 48
+
+  @pytest.mark.parametrize("pix_fmt", ["nv12", "yuv420p"])
+  def test_matches_ffmpeg(self, pix_fmt):
+    rng = np.random.default_rng(0)
+    y = rng.integers(16, 236, (self.H, self.W), dtype=np.uint8)
+    u, v = rng.integers(16, 241, (2, self.H // 2, self.W // 2), dtype=np.uint8)
+    yuv420p = np.concatenate([y.ravel(), u.ravel(), v.ravel()])
+    frame = np.concatenate([y.ravel(), np.stack([u, v], axis=-1).ravel()]) if pix_fmt == "nv12" else yuv420p
+
+    # the hevc decoder outputs yuv420p, so that's what ffmpeg converts when asked for rgb24
+    out = subprocess.check_output(["ffmpeg", "-v", "quiet", "-f", "rawvideo", "-pix_fmt", "yuv420p", "-s", f"{self.W}x{self.H}", "-i", "-",
+                                   "-f", "rawvideo", "-pix_fmt", "rgb24", "-"], input=yuv420p.tobytes())
+    expected = np.frombuffer(out, dtype=np.uint8).reshape(self.H, self.W, 3)
+
+    rgb = yuv_to_rgb(frame, self.W, self.H, pix_fmt)
+    assert rgb.shape == expected.shape and rgb.dtype == np.uint8
+    diff = np.abs(rgb.astype(np.int16) - expected)
+    assert diff.max() <= 3
+    assert diff.mean() < 1
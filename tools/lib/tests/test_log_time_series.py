@@ -0,0 +1,81 @@
+import numpy as np
+
+from cereal import log
+from openpilot.tools.lib.log_time_series import dicts_to_time_series, msgs_to_time_series
+from openpilot.tools.lib.logreader import LogReader, _LogFileReader
+
+
+def make_msgs(n=200):
+  msgs = []
+  for i in range(n):
+    # out of order times, to cover sorting
+    t = (i * 7919) % n
+    msg = log.Event.new_message(logMonoTime=t * 10**7, valid=i % 3 != 0)
+    which = ('carState', 'controlsState', 'deviceState', 'can')[i % 4]
+    if which == 'carState':
+      cs = msg.init('carState')
+      cs.vEgo = i / 3
+      cs.gearShifter = 'drive' if i % 2 else 'park'
+      cs.wheelSpeeds.fl = -i
+      cs.buttonEvents = [{'type': 'accelCruise', 'pressed': bool(i % 2)}] * (i % 3)
+    elif which == 'controlsState':
+      cs = msg.init('controlsState')
+      cs.lateralControlState.init('pidState').p = i
+      cs.curvature = i * 0.1
+    elif which == 'deviceState':
+      ds = msg.init('deviceState')
+      ds.cpuTempC = [i, i + 1]
+      ds.freeSpacePercent = i
+      ds.networkType = 'wifi'
+    else:
+      msg.init('can', 1)
+    msgs.append(msg.to_bytes())
+  return msgs
+
+
+def make_multi_segment_msg():
+  msg = log.Event.new_message(logMonoTime=1, valid=True)
+  cs = msg.init('carState')
+  cs.vEgo = 1.
+  # fill up the first segment, so the cruiseState struct ends up behind a far pointer
+  cs.buttonEvents = [{'type': 'accelCruise'}] * 2000
+  cs.cruiseState.speed = 5.
+  dat = msg.to_bytes()
+  assert int.from_bytes(dat[:4], 'little') > 0
+  return dat
+
+
+def assert_same(a, b):
+  assert isinstance(b, type(a))
+  if isinstance(a, np.ndarray):
+    assert a.dtype == b.dtype and a.shape == b.shape
+    if a.dtype == object:
+      for x, y in zip(a, b, strict=True):
+        assert_same(x, y)
+    else:
+      np.testing.assert_array_equal(a, b)
+  elif isinstance(a, dict):
+    assert list(a) == list(b)
+    for k in a:
+      assert_same(a[k], b[k])
+  else:
+    assert a == b
+
+
+class TestLogTimeSeries:
+  def test_matches_to_dict(self):
+    msgs = list(log.Event.read_multiple_bytes(b''.join(make_msgs())))
+    ts = msgs_to_time_series(msgs)
+    assert list(ts) == ['carState', 'controlsState', 'deviceState']
+    assert np.all(np.diff(ts['carState']['t']) >= 0)
+    assert_same(dicts_to_time_series(msgs), ts)
+
+  def test_log_reader_events(self, tmp_path):
+    # events from LogReader are read straight from their serialized bytes
+    log_file = tmp_path / "rlog"
+    dat = b''.join(make_msgs()) + make_multi_segment_msg()
+    log_file.write_bytes(dat)
+
+    expected = dicts_to_time_series(log.Event.read_multiple_bytes(dat))
+    assert_same(expected, msgs_to_time_series(LogReader(str(log_file))))
+    assert_same(expected['carState'], msgs_to_time_series(_LogFileReader(str(log_file)).filter('carState'))['carState'])
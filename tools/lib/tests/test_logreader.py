@@ -1,17 +1,23 @@
+import bz2
 import capnp
 import contextlib
+import http.server
 import io
 import shutil
 import tempfile
+import threading
+import time
 import os
 import pytest
 import requests
+import zstandard as zstd
 
 from parameterized import parameterized
 
 from cereal import log as capnp_log
-from openpilot.tools.lib.logreader import LogsUnavailable, LogIterable, LogReader, parse_indirect, ReadMode
-from openpilot.tools.lib.file_sources import comma_api_source, InternalUnavailableException
+from openpilot.selfdrive.test.helpers import http_server_context
+from openpilot.tools.lib.logreader import LogsUnavailable, LogIterable, LogReader, _LogFileReader, auto_source, parse_indirect, ReadMode
+from openpilot.tools.lib.file_sources import comma_api_source, eval_source, InternalUnavailableException
 from openpilot.tools.lib.route import SegmentRange
 from openpilot.tools.lib.url_file import URLFileException
 
@@ -25,6 +31,76 @@ def noop(segment: LogIterable):
   return segment
 
 
+class SlowFileRequestHandler(http.server.BaseHTTPRequestHandler):
+  LATENCY = 0.2
+  lock = threading.Lock()
+  in_flight = 0
+  max_in_flight = 0
+  probes: list[str] = []
+
+  def log_message(self, *args):
+    pass
+
+  def do_HEAD(self):
+    cls = SlowFileRequestHandler
+    with cls.lock:
+      cls.probes.append(self.path)
+      cls.in_flight += 1
+      cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+    # slow enough for concurrent probes to overlap
+    time.sleep(self.LATENCY)
+    with cls.lock:
+      cls.in_flight -= 1
+
+    # only even segments have a zst rlog, every segment has a bz2 one
+    seg = int(self.path.split("/")[-2])
+    exists = self.path.endswith(".bz2") or seg % 2 == 0
+    self.send_response(200 if exists else 404)
+    self.send_header("Content-Length", "4" if exists else "0")
+    self.end_headers()
+
+
+def seg_speeds(segment: LogIterable):
+  # later segments finish first
+  speeds = [m.carState.vEgo for m in segment]
+  time.sleep(0.2 * (4 - speeds[0] // 100))
+  return speeds
+
+
+def seg_speeds_after_consumer(segment: LogIterable):
+  # the last segment only finishes once the consumer has been handed another segment's result
+  speeds = [m.carState.vEgo for m in segment]
+  if speeds[0] // 100 == 3:
+    marker = os.environ["SEGMENT_CONSUMED_MARKER"]
+    for _ in range(1000):
+      if os.path.exists(marker):
+        break
+      time.sleep(0.01)
+    else:
+      raise TimeoutError("no result was streamed before the last segment finished")
+  return speeds
+
+
+class SourceProbe:
+  # sources that can wait for another one to finish first, records the order they finish in
+  def __init__(self):
+    self.done = {"release": threading.Event()}
+    self.finished: list[str] = []
+    self.daemon: dict[str, bool] = {}
+
+  def source(self, name, files, after=None):
+    self.done[name] = threading.Event()
+    def source(sr, seg_idxs, fns):
+      self.daemon[name] = threading.current_thread().daemon
+      if after is not None:
+        self.done[after].wait(10)
+      self.finished.append(name)
+      self.done[name].set()
+      return {seg: files[seg] for seg in seg_idxs if seg in files}
+    source.__name__ = name
+    return source
+
+
 @contextlib.contextmanager
 def setup_source_scenario(mocker, is_internal=False):
   internal_source_mock = mocker.patch("openpilot.tools.lib.logreader.internal_source")
@@ -255,3 +331,165 @@ class TestLogReader:
       msgs = list(LogReader(qlog.name, only_union_types=True))
       assert len(msgs) == num_msgs
       [m.which() for m in msgs]
+
+  @pytest.mark.parametrize("ext", ["", ".bz2", ".zst"])
+  def test_streaming_index(self, ext):
+    num_msgs = 3000
+    dat = b""
+    for i in range(num_msgs):
+      evt = capnp_log.Event.new_message(logMonoTime=(i * 7919) % num_msgs)
+      if i % 3 == 0:
+        evt.init("deviceState").cpuTempC = [float(i)]
+      else:
+        evt.init("carState").vEgo = float(i)
+      dat += evt.to_bytes()
+
+    if ext == ".bz2":
+      dat = bz2.compress(dat)
+    elif ext == ".zst":
+      # multiple frames should be read back to back
+      dat = zstd.compress(dat[:len(dat) // 2]) + zstd.compress(dat[len(dat) // 2:])
+
+    with tempfile.NamedTemporaryFile(suffix=ext) as log_file:
+      with open(log_file.name, "wb") as f:
+        f.write(dat)
+
+      for sort_by_time in (False, True):
+        msgs = list(LogReader(log_file.name, sort_by_time=sort_by_time))
+        assert len(msgs) == num_msgs
+        if sort_by_time:
+          assert msgs == sorted(msgs, key=lambda m: m.logMonoTime)
+
+        expected = [m.carState.vEgo for m in msgs if m.which() == "carState"]
+        assert [m.vEgo for m in LogReader(log_file.name, sort_by_time=sort_by_time).filter("carState")] == expected
+
+        lr = LogReader(log_file.name, sort_by_time=sort_by_time)
+        assert list(lr.first("deviceState").cpuTempC) == list(next(m.deviceState.cpuTempC for m in msgs if m.which() == "deviceState"))
+        assert lr.first("carParams") is None
+        # a partially consumed reader keeps streaming where it left off
+        assert len(list(lr)) == num_msgs
+
+  def test_index_cache(self, mocker, tmp_path):
+    mocker.patch("openpilot.tools.lib.logreader.cache_path_for_log_index", lambda key: str(tmp_path / f"{key}.npz"))
+    scan_spy = mocker.spy(_LogFileReader, "_scan")
+
+    with tempfile.NamedTemporaryFile(suffix=".zst") as log_file:
+      dat = b"".join(capnp_log.Event.new_message(logMonoTime=i, carState={"vEgo": i}).to_bytes() for i in range(1000))
+      dat += capnp_log.Event.new_message(logMonoTime=1000, initData={}).to_bytes()
+      with open(log_file.name, "wb") as f:
+        f.write(zstd.compress(dat))
+
+      # index is written once the file has been read through
+      msgs = list(LogReader(log_file.name, index_cache=True))
+      assert len(list(tmp_path.iterdir())) == 1
+      assert scan_spy.call_count == 1
+
+      lr = LogReader(log_file.name, index_cache=True)
+      assert lr.first("carParams") is None
+      assert lr.first("initData") is not None
+      assert [m.vEgo for m in lr.filter("carState")] == list(range(1000))
+      assert [m.as_builder().to_bytes() for m in lr] == [m.as_builder().to_bytes() for m in msgs]
+      assert scan_spy.call_count == 1
+
+      # a different file never uses a stale index
+      with open(log_file.name, "wb") as f:
+        f.write(zstd.compress(dat[:len(msgs[0].as_builder().to_bytes()) * 10]))
+      assert len(list(LogReader(log_file.name, index_cache=True))) == 10
+      assert scan_spy.call_count == 2
+
+  def test_index_cache_invalid(self, mocker, tmp_path):
+    # every log maps to the same entry, so it's stale for all but the one it was built from
+    index_path = tmp_path / "index.npz"
+    mocker.patch("openpilot.tools.lib.logreader.cache_path_for_log_index", lambda key: str(index_path))
+
+    events = [capnp_log.Event.new_message(logMonoTime=i, carState={"vEgo": i}).to_bytes() for i in range(1000)]
+    init_data = capnp_log.Event.new_message(logMonoTime=500, initData={}).to_bytes()
+    log_a, log_b = tmp_path / "a.zst", tmp_path / "b.zst"
+    log_a.write_bytes(zstd.compress(b"".join(events)))
+    log_b.write_bytes(zstd.compress(b"".join(events[:500] + [init_data] + events[500:])))
+    expected = [m.as_builder().to_bytes() for m in LogReader(str(log_b))]
+
+    scan_spy = mocker.spy(_LogFileReader, "_scan")
+    assert len(list(LogReader(str(log_a), index_cache=True))) == 1000
+    assert scan_spy.call_count == 1
+
+    # a stale index is only trusted as far as it matches, then the rest of the file is indexed
+    lr = LogReader(str(log_b), index_cache=True)
+    assert [m.vEgo for m in lr.filter("carState")] == list(range(1000))
+    assert lr.first("initData") is not None
+    assert [m.as_builder().to_bytes() for m in lr] == expected
+    assert scan_spy.call_count == 2
+
+    # and replaced with the right one
+    assert LogReader(str(log_b), index_cache=True).first("initData") is not None
+    assert scan_spy.call_count == 2
+
+    # unreadable entries are a miss too
+    for contents in (b"", index_path.read_bytes()[:100], b"PK\x05\x06" + bytes(18)):
+      index_path.write_bytes(contents)
+      assert [m.as_builder().to_bytes() for m in LogReader(str(log_b), index_cache=True)] == expected
+      assert index_path.stat().st_size > 100
+
+  def test_eval_source_concurrent(self):
+    SlowFileRequestHandler.max_in_flight = 0
+    SlowFileRequestHandler.probes = []
+    with http_server_context(SlowFileRequestHandler, server_class=http.server.ThreadingHTTPServer) as (host, port):
+      files = {seg: [f"http://{host}:{port}/{seg}/rlog.zst", f"http://{host}:{port}/{seg}/rlog.bz2"] for seg in range(10)}
+      valid_files = eval_source(files)
+
+    assert valid_files == {seg: urls[0] if seg % 2 == 0 else urls[1] for seg, urls in files.items()}
+    assert list(valid_files) == list(range(10))
+    # one round for the first choices and one for the missing segments' fallbacks, with the probes of a round in flight together
+    probes = SlowFileRequestHandler.probes
+    assert sorted(probes[:10]) == sorted(f"/{seg}/rlog.zst" for seg in range(10))
+    assert sorted(probes[10:]) == sorted(f"/{seg}/rlog.bz2" for seg in range(1, 10, 2))
+    assert 1 < SlowFileRequestHandler.max_in_flight <= 10
+
+  def test_auto_source_concurrent(self):
+    route = "344c5c15b34f2d8a/2024-01-03--09-37-12/0:4/q"
+    all_files = {seg: f"seg{seg}" for seg in range(4)}
+
+    # the first source to cover every segment ends the search without waiting on the others
+    probe = SourceProbe()
+    sources = [probe.source("held", {}, after="release"), probe.source("all", all_files), probe.source("partial", {0: "fast0"})]
+    try:
+      assert auto_source(route, sources, ReadMode.QLOG) == ["seg0", "seg1", "seg2", "seg3"]
+      assert "held" not in probe.finished
+      # the held probe can't keep the interpreter from exiting
+      assert probe.daemon["held"]
+    finally:
+      probe.done["release"].set()
+
+    # segments found by several sources come from the earliest one in the list, whichever finishes first
+    probe = SourceProbe()
+    sources = [probe.source("a", {1: "a1", 3: "a3"}, after="b"), probe.source("b", {seg: all_files[seg] for seg in range(3)})]
+    assert auto_source(route, sources, ReadMode.QLOG) == ["seg0", "a1", "seg2", "a3"]
+    assert probe.finished == ["b", "a"]
+
+    probe = SourceProbe()
+    with pytest.raises(LogsUnavailable):
+      auto_source(route, [probe.source("a", {0: "a0"}), probe.source("b", {1: "b1"})], ReadMode.QLOG)
+
+  def test_iter_across_segments(self, tmp_path, monkeypatch):
+    fns = []
+    for seg in range(4):
+      fn = str(tmp_path / f"{seg}.zst")
+      with open(fn, "wb") as f:
+        f.write(zstd.compress(b"".join(capnp_log.Event.new_message(logMonoTime=i, carState={"vEgo": seg * 100 + i}).to_bytes() for i in range(10))))
+      fns.append(fn)
+    expected = [[seg * 100 + i for i in range(10)] for seg in range(4)]
+
+    lr = LogReader(fns)
+    assert list(lr.iter_across_segments(2, seg_speeds, max_in_flight=1)) == expected
+    assert list(lr.iter_across_segments(4, seg_speeds)) == expected
+
+    # completion order isn't fixed, but results stream out while the last segment is still running
+    marker = tmp_path / "consumed"
+    monkeypatch.setenv("SEGMENT_CONSUMED_MARKER", str(marker))
+    results = []
+    for ret in lr.iter_across_segments(4, seg_speeds_after_consumer, ordered=False):
+      results.append(ret)
+      marker.touch()
+    assert sorted(results) == expected
+    assert results[0] != expected[-1]
+    assert lr.run_across_segments(2, seg_speeds, disable_tqdm=True) == sum(expected, [])
@@ -2,6 +2,8 @@ import re
 import logging
 import os
 import socket
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from hashlib import sha256
 from urllib3 import PoolManager, Retry
 from urllib3.response import BaseHTTPResponse
@@ -14,6 +16,15 @@ from urllib3.exceptions import MaxRetryError
 #  Cache chunk size
 K = 1000
 CHUNK_SIZE = 1000 * K
+#  Cache size limit in MB, least recently used chunks are evicted past it. Override with FILEREADER_CACHE_SIZE
+DEFAULT_CACHE_SIZE = 10 * K
+#  Chunks fetched ahead of sequential reads. Override with FILEREADER_READAHEAD
+DEFAULT_READAHEAD = 4
+READAHEAD_WORKERS = 4
+#  Eviction frees down to this fraction of the limit, so it doesn't run on every write
+EVICT_TARGET = 0.9
+#  Chunk and length files written by URLFile, anything else in the cache directory is left alone
+CACHE_FILE_RE = re.compile(r"[0-9a-f]{64}_(\d+\.0|length)")
 
 logging.getLogger("urllib3").setLevel(logging.WARNING)
 
@@ -28,10 +39,22 @@ class URLFileException(Exception):
 
 class URLFile:
   _pool_manager: PoolManager | None = None
+  _executor: ThreadPoolExecutor | None = None
+  #  Downloads in progress by cache path, shared so a read waits on a read-ahead of the same chunk
+  _pending: dict[str, Future] = {}
+  _pending_lock = threading.Lock()
+  #  Estimated size of the download cache, counted once per process and kept up to date on writes
+  _cache_usage: int | None = None
+  _cache_usage_lock = threading.Lock()
 
   @staticmethod
   def reset() -> None:
     URLFile._pool_manager = None
+    URLFile._executor = None
+    URLFile._pending = {}
+    URLFile._pending_lock = threading.Lock()
+    URLFile._cache_usage = None
+    URLFile._cache_usage_lock = threading.Lock()
 
   @staticmethod
   def pool_manager() -> PoolManager:
@@ -41,7 +64,13 @@ class URLFile:
       URLFile._pool_manager = PoolManager(num_pools=10, maxsize=100, socket_options=socket_options, retries=retries)
     return URLFile._pool_manager
 
-  def __init__(self, url: str, timeout: int = 10, cache: bool | None = None):
+  @staticmethod
+  def executor() -> ThreadPoolExecutor:
+    if URLFile._executor is None:
+      URLFile._executor = ThreadPoolExecutor(max_workers=READAHEAD_WORKERS, thread_name_prefix="urlfile")
+    return URLFile._executor
+
+  def __init__(self, url: str, timeout: int = 10, cache: bool | None = None, cache_size: int | None = None, readahead: int | None = None):
     self._url = url
     self._timeout = Timeout(connect=timeout, read=timeout)
     self._pos = 0
@@ -50,6 +79,10 @@ class URLFile:
     self._force_download = not int(os.environ.get("FILEREADER_CACHE", "0"))
     if cache is not None:
       self._force_download = not cache
+    #  Cache limit in bytes, and number of chunks to fetch ahead of sequential reads
+    self._cache_size = (cache_size if cache_size is not None else int(os.environ.get("FILEREADER_CACHE_SIZE", DEFAULT_CACHE_SIZE))) * K * K
+    self._readahead = readahead if readahead is not None else int(os.environ.get("FILEREADER_READAHEAD", DEFAULT_READAHEAD))
+    self._read_end = 0
 
     if not self._force_download:
       os.makedirs(Paths.download_cache_root(), exist_ok=True)
@@ -98,29 +131,118 @@ class URLFile:
     file_end = self._pos + ll if ll is not None else self.get_length()
     assert file_end != -1, f"Remote file is empty or doesn't exist: {self._url}"
     #  We have to align with chunks we store. Position is the begginiing of the latest chunk that starts before or at our file
-    position = (file_begin // CHUNK_SIZE) * CHUNK_SIZE
-    response = b""
-    while True:
-      self._pos = position
-      chunk_number = self._pos / CHUNK_SIZE
-      file_name = hash_256(self._url) + "_" + str(chunk_number)
-      full_path = os.path.join(Paths.download_cache_root(), str(file_name))
-      data = None
-      #  If we don't have a file, download it
-      if not os.path.exists(full_path):
-        data = self.read_aux(ll=CHUNK_SIZE)
-        with atomic_write(full_path, mode="wb", overwrite=True) as new_cached_file:
-          new_cached_file.write(data)
+    first_chunk = (file_begin // CHUNK_SIZE) * CHUNK_SIZE
+    positions = list(range(first_chunk, max(file_end, first_chunk + 1), CHUNK_SIZE))
+
+    #  Missing chunks of this read are downloaded in parallel
+    chunks = [self._fetch_chunk(position) for position in positions]
+
+    #  Sequential reads also fetch the next chunks in the background, bounded by the file length
+    if self._readahead > 0 and file_begin == self._read_end:
+      length = self.get_length()
+      positions_ahead = range(positions[-1] + CHUNK_SIZE, positions[-1] + (self._readahead + 1) * CHUNK_SIZE, CHUNK_SIZE)
+      for position in positions_ahead:
+        if length == -1 or position >= length:
+          break
+        self._fetch_chunk(position)
+
+    response = []
+    for position, pending in zip(positions, chunks, strict=True):
+      data = self._read_chunk(position, pending)
+      response.append(data[max(0, file_begin - position): min(CHUNK_SIZE, file_end - position)])
+
+    self._pos = self._read_end = file_end
+    return b"".join(response)
+
+  def _chunk_path(self, position: int) -> str:
+    chunk_number = position / CHUNK_SIZE
+    return os.path.join(Paths.download_cache_root(), hash_256(self._url) + "_" + str(chunk_number))
+
+  def _read_chunk(self, position: int, pending: Future | None) -> bytes:
+    full_path = self._chunk_path(position)
+    if pending is not None:
+      data = pending.result()
+      if data is not None:
+        return data
+
+    try:
+      with open(full_path, "rb") as cached_file:
+        data = cached_file.read()
+      #  Mark as recently used for eviction
+      os.utime(full_path)
+      return data
+    except FileNotFoundError:
+      pass
+
+    #  If we don't have a file, download it
+    return self._download_chunk(position, full_path)
+
+  def _fetch_chunk(self, position: int) -> Future | None:
+    """Starts downloading a chunk in the background, if it isn't cached or already being downloaded"""
+    full_path = self._chunk_path(position)
+    with URLFile._pending_lock:
+      pending = URLFile._pending.get(full_path)
+      if pending is None and not os.path.exists(full_path):
+        pending = self.executor().submit(self._download_chunk, position, full_path)
+        URLFile._pending[full_path] = pending
+    return pending
+
+  def _download_chunk(self, position: int, full_path: str) -> bytes:
+    try:
+      data = self.get_multi_range([(position, position + CHUNK_SIZE)])[0]
+      #  Written under a temporary name and renamed, so concurrent readers never see partial chunks
+      with atomic_write(full_path, mode="wb", overwrite=True) as new_cached_file:
+        new_cached_file.write(data)
+      self._account(len(data))
+      return data
+    finally:
+      with URLFile._pending_lock:
+        URLFile._pending.pop(full_path, None)
+
+  def _account(self, size: int) -> None:
+    with URLFile._cache_usage_lock:
+      if URLFile._cache_usage is None:
+        URLFile._cache_usage = sum(size for _, size, _ in self._cache_entries())
       else:
-        with open(full_path, "rb") as cached_file:
-          data = cached_file.read()
+        URLFile._cache_usage += size
+      if URLFile._cache_usage > self._cache_size:
+        URLFile._cache_usage = self._evict(int(self._cache_size * EVICT_TARGET))
 
-      response += data[max(0, file_begin - position): min(CHUNK_SIZE, file_end - position)]
+  @staticmethod
+  def _cache_entries() -> list[tuple[str, int, float]]:
+    entries = []
+    with os.scandir(Paths.download_cache_root()) as it:
+      for entry in it:
+        #  Downloads still being written by atomic_write don't match, they have a temporary name
+        if CACHE_FILE_RE.fullmatch(entry.name) is None:
+          continue
+        try:
+          if not entry.is_file(follow_symlinks=False):
+            continue
+          st = entry.stat(follow_symlinks=False)
+        except OSError:
+          continue
+        entries.append((entry.path, st.st_size, st.st_mtime))
+    return entries
 
-      position += CHUNK_SIZE
-      if position >= file_end:
-        self._pos = file_end
-        return response
+  @staticmethod
+  def _evict(target: int) -> int:
+    """Removes the least recently used files until the cache is at most target bytes, returns the new size"""
+    #  Recount from disk, other processes share the cache
+    entries = sorted(URLFile._cache_entries(), key=lambda e: e[2])
+    usage = sum(size for _, size, _ in entries)
+    for path, size, _ in entries:
+      if usage <= target:
+        break
+      try:
+        os.unlink(path)
+      except FileNotFoundError:
+        #  Already evicted by another process
+        pass
+      except OSError:
+        continue
+      usage -= size
+    return usage
 
   def read_aux(self, ll: int | None = None) -> bytes:
     if ll is None:
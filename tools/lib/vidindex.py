@@ -4,6 +4,8 @@ import os
 import struct
 from enum import IntEnum
 
+import numpy as np
+
 from openpilot.tools.lib.filereader import FileReader
 
 DEBUG = int(os.getenv("DEBUG", "0"))
@@ -258,6 +260,13 @@ def get_hevc_slice_type(dat: bytes, nal_unit_start: int, nal_unit_type: HevcNalU
     raise VideoFileInvalid("slice_type must be 0, 1, or 2")
   return slice_type, is_first_slice
 
+def get_hevc_nal_unit_starts(dat: bytes) -> np.ndarray:
+  # every start code in the stream, in order. start codes can't overlap, so these are exactly
+  # the positions found by walking from one NAL unit to the next
+  buf = np.frombuffer(dat, dtype=np.uint8)
+  ones = np.flatnonzero(buf[2:] == 1)
+  return ones[(buf[ones] == 0) & (buf[ones + 1] == 0)]
+
 def hevc_index(hevc_file_name: str, allow_corrupt: bool=False) -> tuple[list, int, bytes]:
   with FileReader(hevc_file_name) as f:
     dat = f.read()
@@ -268,28 +277,45 @@ def hevc_index(hevc_file_name: str, allow_corrupt: bool=False) -> tuple[list, in
   if dat[0] != 0x00:
     raise VideoFileInvalid("first byte must be 0x00")
 
-  prefix_dat = b""
+  prefix_dat = []
   frame_types = list()
 
   i = 1 # skip past first byte 0x00
   try:
-    while i < len(dat):
-      require_nal_unit_start(dat, i)
-      nal_unit_len = get_hevc_nal_unit_length(dat, i)
+    require_nal_unit_start(dat, i)
+    starts = get_hevc_nal_unit_starts(dat)
+    starts = starts[starts >= i]
+    nal_unit_ends = np.append(starts[1:], len(dat))
+
+    # only parameter sets and the first slice of each picture need parsing, so pick those out
+    # from the NAL unit headers and the first_slice_segment_in_pic_flag without visiting every unit
+    buf = np.frombuffer(dat, dtype=np.uint8)
+    header_start = starts + NAL_UNIT_START_CODE_SIZE
+    rbsp_start = header_start + NAL_UNIT_HEADER_SIZE
+    complete = rbsp_start < len(buf)
+    nal_unit_types = (buf[np.where(complete, header_start, 0)] >> 1) & 0x3F
+    is_first_slice = (buf[np.where(complete, rbsp_start, 0)] >> 7) & 1 == 1
+    is_parameter_set = np.isin(nal_unit_types, HEVC_PARAMETER_SET_NAL_UNITS)
+    is_coded_slice = np.isin(nal_unit_types, HEVC_CODED_SLICE_SEGMENT_NAL_UNITS)
+    # incomplete units go through the full parser, which raises on them
+    needs_parsing = ~complete | is_parameter_set | (is_coded_slice & is_first_slice)
+
+    for idx in np.flatnonzero(needs_parsing).tolist():
+      i = int(starts[idx])
+      nal_unit_len = int(nal_unit_ends[idx]) - i
       nal_unit_type = get_hevc_nal_unit_type(dat, i)
       if nal_unit_type in HEVC_PARAMETER_SET_NAL_UNITS:
-        prefix_dat += dat[i:i+nal_unit_len]
+        prefix_dat.append(dat[i:i+nal_unit_len])
       elif nal_unit_type in HEVC_CODED_SLICE_SEGMENT_NAL_UNITS:
-        slice_type, is_first_slice = get_hevc_slice_type(dat, i, nal_unit_type)
-        if is_first_slice:
+        slice_type, is_first = get_hevc_slice_type(dat, i, nal_unit_type)
+        if is_first:
           frame_types.append((slice_type, i))
-      i += nal_unit_len
   except Exception as e:
     if not allow_corrupt:
       raise
     print(f"ERROR: NAL unit skipped @ {i}\n", str(e))
 
-  return frame_types, len(dat), prefix_dat
+  return frame_types, len(dat), b"".join(prefix_dat)
 
 def main() -> None:
   parser = argparse.ArgumentParser()